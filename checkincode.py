@@ -10,9 +10,19 @@ import psycopg2.extras
 import re
 import json
 from dateutil import parser
-from io import BytesIO
-from PIL import Image
+from io import BytesIO, StringIO
+import csv
+import gzip
+import tempfile
+import threading
+from PIL import Image, ImageDraw, ImageFont
 import asyncio
+import aiohttp
+import contextvars
+from collections import deque
+import time as time_module
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from zoneinfo import ZoneInfo
 
 
@@ -36,6 +46,23 @@ DATABASE_URL = os.getenv("DATABASE_URL")  # Heroku automatically sets this
 DATABASE_TABLE_NAME = "channel_settings_data"  # Renamed for clarity, holds core settings
 LEADERBOARD_CHECKIN_TABLE = "checkin_leaderboard"
 LEADERBOARD_MISSED_TABLE = "missed_leaderboard"
+ATTENDANCE_BITMAP_TABLE = "attendance_bitmaps"
+DAILY_SNAPSHOT_TABLE = "daily_checkin_snapshots"
+WEEKLY_ROLLUP_TABLE = "checkin_weekly_rollup"
+MONTHLY_ROLLUP_TABLE = "checkin_monthly_rollup"
+CHECKIN_MESSAGE_TABLE = "checkin_messages"
+SUMMARY_ARCHIVE_TABLE = "checkin_summary_archive"
+ROLLING_SUMMARY_TABLE = "rolling_summaries"
+IMAGE_DESCRIPTION_TABLE = "image_descriptions"
+SUMMARY_METRICS_TABLE = "summary_call_metrics"
+BACKFILL_CHECKPOINT_TABLE = "backfill_checkpoints"
+# ---------------------------------------------------------
+
+
+# --- Attendance history ---
+# One bit per reset period, bit 0 is the most recent period. 366 bits is ~46 bytes per user,
+# so a year of history for 10k users stays around 460 KB.
+ATTENDANCE_BITMAP_MAX_PERIODS = 366
 # ---------------------------------------------------------
 
 
@@ -47,6 +74,21 @@ bot = commands.Bot(command_prefix=commands.when_mentioned_or("c.", "C."), intent
 guild_channel_data_cache = {}
 
 
+# In-memory cache for attendance bitmaps
+# Structure: {(guild_id, channel_id): {user_id: [bits, periods, last_period]}}
+attendance_bitmap_cache = {}
+
+
+# In-memory cache for rendered heatmap PNGs, cleared for a channel at its next reset and bounded to
+# HEATMAP_CACHE_MAX_ENTRIES (oldest first), since channels without a reset time never clear theirs
+# Structure: {(guild_id, channel_id, user_id or 0, period_end_date): png_bytes}
+heatmap_cache = {}
+
+
+# Shared HTTP session for downloading stored check-in attachments, created on first use
+attachment_http_session = None
+
+
 
 
 def get_db_connection():
@@ -123,6 +165,168 @@ def initialize_database():
            print(f"INFO: {LEADERBOARD_MISSED_TABLE} table ensured.")
 
 
+           # Create table for per-user attendance bitmaps (one bit per reset period)
+           cur.execute(f"""
+               CREATE TABLE IF NOT EXISTS {ATTENDANCE_BITMAP_TABLE} (
+                   guild_id BIGINT NOT NULL,
+                   channel_id BIGINT NOT NULL,
+                   user_id BIGINT NOT NULL,
+                   bits BYTEA NOT NULL,
+                   periods INTEGER NOT NULL DEFAULT 0,
+                   last_period DATE NOT NULL,
+                   PRIMARY KEY (guild_id, channel_id, user_id)
+               );
+           """)
+           print(f"INFO: {ATTENDANCE_BITMAP_TABLE} table ensured.")
+
+
+           # Create table for per-reset snapshots of who checked in and who missed
+           # The primary key doubles as the (guild_id, channel_id, snapshot_date) index for history queries
+           cur.execute(f"""
+               CREATE TABLE IF NOT EXISTS {DAILY_SNAPSHOT_TABLE} (
+                   guild_id BIGINT NOT NULL,
+                   channel_id BIGINT NOT NULL,
+                   snapshot_date DATE NOT NULL,
+                   checked_ids BIGINT[] NOT NULL DEFAULT '{{}}',
+                   missed_ids BIGINT[] NOT NULL DEFAULT '{{}}',
+                   reset_at TIMESTAMPTZ NOT NULL,
+                   PRIMARY KEY (guild_id, channel_id, snapshot_date)
+               );
+           """)
+           print(f"INFO: {DAILY_SNAPSHOT_TABLE} table ensured.")
+
+
+           # Create weekly and monthly per-user rollups, maintained incrementally at reset time
+           # period_start is the Monday of the week or the first day of the month
+           for rollup_table in (WEEKLY_ROLLUP_TABLE, MONTHLY_ROLLUP_TABLE):
+               cur.execute(f"""
+                   CREATE TABLE IF NOT EXISTS {rollup_table} (
+                       guild_id BIGINT NOT NULL,
+                       channel_id BIGINT NOT NULL,
+                       period_start DATE NOT NULL,
+                       user_id BIGINT NOT NULL,
+                       checkins INTEGER NOT NULL DEFAULT 0,
+                       misses INTEGER NOT NULL DEFAULT 0,
+                       PRIMARY KEY (guild_id, channel_id, period_start, user_id)
+                   );
+               """)
+               print(f"INFO: {rollup_table} table ensured.")
+
+
+           # Create table for accepted check-in messages, so summaries never need to crawl channel history
+           cur.execute(f"""
+               CREATE TABLE IF NOT EXISTS {CHECKIN_MESSAGE_TABLE} (
+                   message_id BIGINT PRIMARY KEY,
+                   guild_id BIGINT NOT NULL,
+                   channel_id BIGINT NOT NULL,
+                   user_id BIGINT NOT NULL,
+                   author_name VARCHAR(255) NOT NULL,
+                   created_at TIMESTAMPTZ NOT NULL,
+                   content TEXT NOT NULL DEFAULT '',
+                   attachments JSONB NOT NULL DEFAULT '[]'
+               );
+           """)
+           cur.execute(f"""
+               CREATE INDEX IF NOT EXISTS {CHECKIN_MESSAGE_TABLE}_channel_time_idx
+               ON {CHECKIN_MESSAGE_TABLE} (guild_id, channel_id, created_at);
+           """)
+           print(f"INFO: {CHECKIN_MESSAGE_TABLE} table ensured.")
+
+
+           # Create table for generated summaries: one row per day, and per rolled-up week/month window
+           # An empty summary records a day without check-ins, so it is never re-queried
+           cur.execute(f"""
+               CREATE TABLE IF NOT EXISTS {SUMMARY_ARCHIVE_TABLE} (
+                   guild_id BIGINT NOT NULL,
+                   channel_id BIGINT NOT NULL,
+                   level VARCHAR(8) NOT NULL,
+                   period_start DATE NOT NULL,
+                   summary TEXT NOT NULL,
+                   checkin_count INTEGER NOT NULL DEFAULT 0,
+                   created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                   PRIMARY KEY (guild_id, channel_id, level, period_start)
+               );
+           """)
+           print(f"INFO: {SUMMARY_ARCHIVE_TABLE} table ensured.")
+
+
+           # Create table for the running "since last reset" summary of channels with rolling summaries enabled
+           cur.execute(f"""
+               CREATE TABLE IF NOT EXISTS {ROLLING_SUMMARY_TABLE} (
+                   guild_id BIGINT NOT NULL,
+                   channel_id BIGINT NOT NULL,
+                   window_start TIMESTAMPTZ NOT NULL,
+                   summary TEXT NOT NULL DEFAULT '',
+                   last_message_at TIMESTAMPTZ NOT NULL,
+                   checkin_count INTEGER NOT NULL DEFAULT 0,
+                   updated_at TIMESTAMPTZ,
+                   PRIMARY KEY (guild_id, channel_id)
+               );
+           """)
+           print(f"INFO: {ROLLING_SUMMARY_TABLE} table ensured.")
+
+
+           # Create table for model-written descriptions of check-in images, keyed by Discord attachment id
+           # image_hash is a 64-bit dHash, so re-posts of the same screenshot can reuse a description
+           cur.execute(f"""
+               CREATE TABLE IF NOT EXISTS {IMAGE_DESCRIPTION_TABLE} (
+                   attachment_id BIGINT PRIMARY KEY,
+                   guild_id BIGINT NOT NULL,
+                   image_hash BIGINT NOT NULL,
+                   description TEXT NOT NULL,
+                   created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+               );
+           """)
+           cur.execute(f"""
+               CREATE INDEX IF NOT EXISTS {IMAGE_DESCRIPTION_TABLE}_hash_idx
+               ON {IMAGE_DESCRIPTION_TABLE} (guild_id, image_hash);
+           """)
+           print(f"INFO: {IMAGE_DESCRIPTION_TABLE} table ensured.")
+
+
+           # Create table for per-call model usage: prompt size, images, queue wait, latency and response size
+           cur.execute(f"""
+               CREATE TABLE IF NOT EXISTS {SUMMARY_METRICS_TABLE} (
+                   id BIGSERIAL PRIMARY KEY,
+                   guild_id BIGINT NOT NULL,
+                   channel_id BIGINT NOT NULL,
+                   command VARCHAR(16) NOT NULL,
+                   outcome VARCHAR(16) NOT NULL,
+                   prompt_chars INTEGER NOT NULL,
+                   estimated_tokens INTEGER NOT NULL,
+                   image_count INTEGER NOT NULL,
+                   image_bytes BIGINT NOT NULL,
+                   queue_wait REAL NOT NULL,
+                   model_latency REAL NOT NULL,
+                   response_chars INTEGER NOT NULL,
+                   created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+               );
+           """)
+           cur.execute(f"""
+               CREATE INDEX IF NOT EXISTS {SUMMARY_METRICS_TABLE}_guild_time_idx
+               ON {SUMMARY_METRICS_TABLE} (guild_id, created_at);
+           """)
+           print(f"INFO: {SUMMARY_METRICS_TABLE} table ensured.")
+
+
+           # Create table for resumable backfills of the message store from channel history
+           # cursor_message_id is the newest message already scanned; status is running, done or cancelled
+           cur.execute(f"""
+               CREATE TABLE IF NOT EXISTS {BACKFILL_CHECKPOINT_TABLE} (
+                   guild_id BIGINT NOT NULL,
+                   channel_id BIGINT NOT NULL,
+                   since TIMESTAMPTZ,
+                   cursor_message_id BIGINT,
+                   scanned INTEGER NOT NULL DEFAULT 0,
+                   stored INTEGER NOT NULL DEFAULT 0,
+                   status VARCHAR(16) NOT NULL DEFAULT 'running',
+                   updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                   PRIMARY KEY (guild_id, channel_id)
+               );
+           """)
+           print(f"INFO: {BACKFILL_CHECKPOINT_TABLE} table ensured.")
+
+
            conn.commit()
            print("INFO: All necessary database tables are ready.")
 
@@ -335,6 +539,108 @@ async def save_specific_data_to_db(guild_id, channel_id, data):
 
 
 
+async def save_leaderboard_deltas(guild_id, channel_id, data, user_ids, save_core=False):
+    """
+    Persists only the leaderboard rows of the given users in one transaction: users with a positive
+    count are upserted, the rest are deleted. With save_core, the core JSONB settings (e.g. banned
+    users) are written in the same transaction. Returns True on success.
+    """
+    conn = get_db_connection()
+    if conn:
+        cur = None
+        try:
+            cur = conn.cursor()
+            user_to_real_mapping = data.get("userToReal", {})
+            if save_core:
+                core_data = {key: value for key, value in data.items() if key not in ("users", "missed_users")}
+                core_data_for_json = psycopg2.extras.Json(convert_sets_to_lists(core_data))
+                cur.execute(
+                    f"""
+                    INSERT INTO {DATABASE_TABLE_NAME} (guild_id, channel_id, data)
+                    VALUES (%s, %s, %s)
+                    ON CONFLICT (guild_id, channel_id) DO UPDATE
+                    SET data = EXCLUDED.data
+                    """,
+                    (guild_id, channel_id, core_data_for_json)
+                )
+
+            for table, counts in ((LEADERBOARD_CHECKIN_TABLE, data.get("users", {})),
+                                  (LEADERBOARD_MISSED_TABLE, data.get("missed_users", {}))):
+                upserts = [(guild_id, channel_id, user_id, user_to_real_mapping.get(str(user_id), f"User_{user_id}"),
+                            counts[user_id]) for user_id in user_ids if counts.get(user_id, 0) > 0]
+                removed = [user_id for user_id in user_ids if counts.get(user_id, 0) <= 0]
+                if upserts:
+                    psycopg2.extras.execute_values(
+                        cur,
+                        f"""
+                        INSERT INTO {table} (guild_id, channel_id, user_id, user_name, count) VALUES %s
+                        ON CONFLICT (guild_id, channel_id, user_id) DO UPDATE
+                        SET user_name = EXCLUDED.user_name, count = EXCLUDED.count
+                        """,
+                        upserts
+                    )
+                if removed:
+                    cur.execute(f"DELETE FROM {table} WHERE guild_id = %s AND channel_id = %s AND user_id = ANY(%s)",
+                                (guild_id, channel_id, removed))
+            conn.commit()
+            print(f"INFO: Saved leaderboard changes for {len(user_ids)} user(s) in guild {guild_id}, channel {channel_id}.")
+            return True
+        except (Exception, psycopg2.Error) as error:
+            print(f"ERROR: Error while saving leaderboard changes for guild {guild_id}, channel {channel_id}: {error}")
+            conn.rollback()
+            return False
+        finally:
+            if cur:
+                cur.close()
+            conn.close()
+    else:
+        print("ERROR: Could not establish database connection for saving leaderboard changes.")
+        return False
+
+
+
+
+async def save_name_mapping_deltas(guild_id, channel_id, names):
+    """
+    Merges {user_id: real_name} into the stored userToReal/realPeople mappings with jsonb_set,
+    and renames the users' leaderboard rows, in one transaction, without rewriting the rest of the channel data.
+    """
+    conn = get_db_connection()
+    if conn:
+        cur = None
+        try:
+            cur = conn.cursor()
+            delta = psycopg2.extras.Json({str(user_id): name for user_id, name in names.items()})
+            cur.execute(
+                f"""
+                UPDATE {DATABASE_TABLE_NAME}
+                SET data = jsonb_set(
+                    jsonb_set(data, '{{userToReal}}', COALESCE(data->'userToReal', '{{}}'::jsonb) || %s::jsonb),
+                    '{{realPeople}}', COALESCE(data->'realPeople', '{{}}'::jsonb) || %s::jsonb)
+                WHERE guild_id = %s AND channel_id = %s
+                """,
+                (delta, delta, guild_id, channel_id)
+            )
+            for table in (LEADERBOARD_CHECKIN_TABLE, LEADERBOARD_MISSED_TABLE):
+                cur.executemany(
+                    f"UPDATE {table} SET user_name = %s WHERE guild_id = %s AND channel_id = %s AND user_id = %s",
+                    [(name, guild_id, channel_id, user_id) for user_id, name in names.items()]
+                )
+            conn.commit()
+            print(f"INFO: Saved {len(names)} name mapping change(s) for guild {guild_id}, channel {channel_id}.")
+        except (Exception, psycopg2.Error) as error:
+            print(f"ERROR: Error while saving name mappings for guild {guild_id}, channel {channel_id}: {error}")
+            conn.rollback()
+        finally:
+            if cur:
+                cur.close()
+            conn.close()
+    else:
+        print("ERROR: Could not establish database connection for saving name mappings.")
+
+
+
+
 async def load_all_data_from_db():
    """Loads all existing guild and channel data from the database into the cache."""
    global guild_channel_data_cache
@@ -479,7 +785,9 @@ async def get_channel_data(guild_id, channel_id):
            "reset_time": None,  # Channel-specific reset time (HHMMSS string)
            "last_reset_time": None,  # Last time this channel was reset (datetime object)
            "days_since_last": {},
-           "last_checkins": {}
+           "last_checkins": {},
+           "rolling_summary": False,  # Keep the "since last reset" summary updated in the background
+           "name_sync": False  # Keep auto-mapped real names in step with member display names
        }
 
 
@@ -505,6 +813,9 @@ async def get_channel_data(guild_id, channel_id):
 
 # Helper function to check if the user is an admin
 async def is_admin(ctx):
+   # Commands get this resolved once by resolve_command_context
+   if getattr(ctx, "author_is_admin", None) is not None:
+       return ctx.author_is_admin
    guild_settings = await get_guild_settings(ctx.guild.id)
    # Check if the author is the guild owner or in the server_admins set
    return ctx.author.id == ctx.guild.owner_id or ctx.author.id in guild_settings.get("server_admins", set())
@@ -512,927 +823,4198 @@ async def is_admin(ctx):
 
 
 
-@bot.command()
-async def m(ctx):
-   """Displays the manual for all bot commands."""
-   await ctx.send("**Commands accessible by everyone**:"
-                  "\n`c.m` - Manual"
-                  "\n`c.c` - Post check-in (channel-specific)"
-                  "\n`c.t` - Check who sent a check-in today (channel-specific)"
-                  "\n`c.wl` - Leaderboard/Streak for checking in (channel-specific)"
-                  "\n`c.ll` - Leaderboard/Streak for NOT checking in (channel-specific)"
-                  "\n`c.cr` - Shows the current reset time for this channel and timezone for this guild"
-                  "\n\n**Commands only accessible by server admins**:"
-                  "\n`c.n` - Tracks certain users/changes usernames to their real names (channel-specific)"
-                  "\n`c.a` - Adds/removes a certain number of check-ins to a user's check-in count (negative number to remove check-ins) (channel-specific)"
-                  "\n`c.z` - Adds/removes a certain number of missed check-ins to a user's missed check-in count (negative number to remove missed check-ins) (channel-specific)"
-                  "\n`c.r` - Sets the reset time for check-ins for this channel"
-                  "\n`c.e` - Requires evidence for check-ins (channel-specific)"
-                  "\n`c.d` - Manages banned users (ban, unban, list) (channel-specific)"
-                  "\n`c.g` - Manages server admins (guild-wide)"
-                  "\n`c.tz` - Lists all timezones available (guild-wide)"
-                  "\n`c.w` - Sets a minimum number of words required in the check-in (channel-specific)"
-                  "\n`c.lr` - Reset the leaderboard, type in 'wl' or 'll' to choose which leaderboard to reset (channel-specific)")
 
+# --- Per-invocation command context ---
+COMMAND_CONTEXT_SLOW_SECONDS = 0.5  # Context resolution slower than this is logged with per-stage timings
+GUILD_WIDE_COMMANDS = {"m", "g", "tz", "usage", "jobs"}  # Commands that never touch channel data
 
 
+@bot.before_invoke
+async def resolve_command_context(ctx):
+    """
+    Resolves the state most commands need once per invocation and attaches it to ctx:
+    ctx.guild_settings, ctx.channel_data (None for GUILD_WIDE_COMMANDS), ctx.author_is_admin and ctx.guild_tz.
+    Per-stage load times are kept in ctx.context_timings and logged when slow (e.g. on a cold cache).
+    """
+    if ctx.guild is None:
+        return
+    timings = {}
+    stage_started = time_module.perf_counter()
+    ctx.guild_settings = await get_guild_settings(ctx.guild.id)
+    timings["guild_settings"] = time_module.perf_counter() - stage_started
+
+    stage_started = time_module.perf_counter()
+    ctx.channel_data = None
+    if ctx.command.name not in GUILD_WIDE_COMMANDS:
+        ctx.channel_data = await get_channel_data(ctx.guild.id, ctx.channel.id)
+    timings["channel_data"] = time_module.perf_counter() - stage_started
+
+    stage_started = time_module.perf_counter()
+    ctx.author_is_admin = (ctx.author.id == ctx.guild.owner_id
+                           or ctx.author.id in ctx.guild_settings.get("server_admins", set()))
+    ctx.guild_tz = get_guild_tz(ctx.guild_settings)
+    timings["admin_and_timezone"] = time_module.perf_counter() - stage_started
+
+    ctx.context_timings = timings
+    total = timings["guild_settings"] + timings["channel_data"] + timings["admin_and_timezone"]
+    if total >= COMMAND_CONTEXT_SLOW_SECONDS:
+        stages = ", ".join(f"{stage} {seconds * 1000:.0f} ms" for stage, seconds in timings.items())
+        print(f"WARNING: Resolving context for c.{ctx.command.name} in guild {ctx.guild.id} took {total:.2f}s ({stages}).")
+
+
+def shift_attendance_bits(bits, periods, last_period, period_date, attended):
+    """
+    Advances an attendance bitmap to period_date and records whether the user attended it.
+    Periods skipped between last_period and period_date are filled with zero bits.
+    Returns the new (bits, periods, last_period) triple.
+    """
+    if last_period is None or periods <= 0:
+        bits, periods, last_period = 0, 0, None
+        gap = 1
+    else:
+        gap = (period_date - last_period).days
 
-async def set_admin_for_guild(guild):
-   """
-   Sets the server admin for a guild. Prioritizes the inviter if available
-   from audit logs, otherwise defaults to the guild owner. This is a guild-wide setting.
-   """
-   guild_settings = await get_guild_settings(guild.id)
+    if gap > 0:
+        gap = min(gap, ATTENDANCE_BITMAP_MAX_PERIODS)
+        bits <<= gap
+        periods += gap
+        last_period = period_date
+        gap = 0
+    # gap <= 0 means a second reset on an already recorded date: its result replaces that date's bit,
+    # the same way the daily snapshot row is replaced
+    bit = 1 << -gap
+    if -gap < ATTENDANCE_BITMAP_MAX_PERIODS:
+        bits = (bits | bit) if attended else (bits & ~bit)
 
+    periods = min(periods, ATTENDANCE_BITMAP_MAX_PERIODS)
+    bits &= (1 << periods) - 1
+    return bits, periods, last_period
 
-   # If the server already has admins, do nothing
-   if guild_settings.get("server_admins"):  # Use .get() in case it's not initialized yet
-       print(f"INFO: Guild {guild.name} ({guild.id}) already has admins set. Skipping initial admin setup.")
-       return
 
 
-   inviter = None
-   try:
-       # Fetch audit logs to find who added the bot
-       async for entry in guild.audit_logs(action=discord.AuditLogAction.bot_add, limit=1):
-           if entry.target.id == bot.user.id:
-               inviter = entry.user
-               break
-   except discord.Forbidden:
-       print(
-           f"WARNING: Missing permissions to access audit logs in {guild.name} ({guild.id}). Cannot determine inviter.")
 
+def align_attendance_bits(bits, periods, last_period, as_of_date):
+    """Shifts a stored bitmap so that bit 0 lines up with as_of_date (users who left the guild stop being updated)."""
+    if last_period is None or as_of_date is None:
+        return bits, periods
+    gap = (as_of_date - last_period).days
+    if gap <= 0:
+        return bits, periods
+    gap = min(gap, ATTENDANCE_BITMAP_MAX_PERIODS)
+    periods = min(periods + gap, ATTENDANCE_BITMAP_MAX_PERIODS)
+    return (bits << gap) & ((1 << periods) - 1), periods
 
-   if inviter:
-       guild_settings["server_admins"].add(inviter.id)
-       print(f"INFO: Admin for {guild.name} ({guild.id}) set to inviter: {inviter.name} ({inviter.id})")
-   else:
-       # Fallback to guild owner if inviter cannot be determined
-       guild_settings["server_admins"].add(guild.owner_id)
-       print(f"INFO: Admin for {guild.name} ({guild.id}) set to owner: {guild.owner.name} ({guild.owner_id})")
 
 
-   await save_specific_data_to_db(guild.id, 0, guild_settings)  # Save guild-wide settings
-   print(f"INFO: Current admins for {guild.name}: {guild_settings['server_admins']}")
 
+def compute_streak_stats(bits, periods):
+    """Returns (current_streak, longest_streak, attendance_rate) for an attendance bitmap using bit operations."""
+    if periods <= 0:
+        return 0, 0, 0.0
 
+    # Trailing one bits are the periods attended in a row up to the latest reset
+    current_streak = (~bits & (bits + 1)).bit_length() - 1
 
+    # Every pass of run &= run >> 1 shortens all runs of ones by one bit,
+    # so the number of passes until it is empty is the longest run
+    longest_streak = 0
+    run = bits
+    while run:
+        run &= run >> 1
+        longest_streak += 1
 
-@bot.event
-async def on_guild_join(guild):
-   """Event handler for when the bot joins a new server."""
-   print(f"INFO: Joined new guild: {guild.name} ({guild.id})")
-   await set_admin_for_guild(guild)
+    return current_streak, longest_streak, bits.bit_count() / periods
 
 
 
 
-@bot.command()
-async def g(ctx, action: str = None, member: discord.Member = None): # Make action optional
-   """
-   Manages server administrators: add, remove, or list.
-   Only existing admins (or guild owner) can use this command. This is a guild-wide setting.
-   """
-   guild_id = ctx.guild.id
-   guild_settings = await get_guild_settings(guild_id)
+async def load_attendance_bitmaps(guild_id, channel_id):
+    """Loads the attendance bitmaps for a specific guild-channel pair from the database."""
+    conn = get_db_connection()
+    if conn:
+        cur = None
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                f"SELECT user_id, bits, periods, last_period FROM {ATTENDANCE_BITMAP_TABLE} "
+                f"WHERE guild_id = %s AND channel_id = %s",
+                (guild_id, channel_id))
+            bitmaps = {}
+            for user_id, raw_bits, periods, last_period in cur.fetchall():
+                bitmaps[user_id] = [int.from_bytes(bytes(raw_bits), "little"), periods, last_period]
+            return bitmaps
+        except (Exception, psycopg2.Error) as error:
+            print(f"ERROR: Error while loading attendance bitmaps for guild {guild_id}, channel {channel_id}: {error}")
+            return None
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                conn.close()
+    else:
+        print("ERROR: Could not establish database connection for loading attendance bitmaps.")
+        return None
 
 
-   if not await is_admin(ctx):  # Check if the author is an admin or owner
-       await ctx.send(f"{ctx.author.mention}, this command is only accessible to server admins.")
-       return
 
 
-   if action is None: # New check for no arguments
-       await ctx.send("Please specify an action. Usage: "
-                      "`c.g add @User` to add a server admin, "
-                      "`c.g remove @User` to remove a server admin, or "
-                      "`c.g list` to view current server admins.")
-       return
+async def save_attendance_bitmaps(guild_id, channel_id, bitmaps):
+    """Upserts only the given attendance bitmaps ({user_id: [bits, periods, last_period]}) for a guild-channel pair."""
+    if not bitmaps:
+        return
+    conn = get_db_connection()
+    if conn:
+        cur = None
+        try:
+            cur = conn.cursor()
+            values = []
+            for user_id, (bits, periods, last_period) in bitmaps.items():
+                raw_bits = bits.to_bytes(max(1, (periods + 7) // 8), "little")
+                values.append((guild_id, channel_id, user_id, psycopg2.Binary(raw_bits), periods, last_period))
+            psycopg2.extras.execute_values(
+                cur,
+                f"""
+                INSERT INTO {ATTENDANCE_BITMAP_TABLE} (guild_id, channel_id, user_id, bits, periods, last_period)
+                VALUES %s
+                ON CONFLICT (guild_id, channel_id, user_id) DO UPDATE
+                SET bits = EXCLUDED.bits, periods = EXCLUDED.periods, last_period = EXCLUDED.last_period
+                """,
+                values
+            )
+            conn.commit()
+            print(f"DEBUG: Saved {len(values)} attendance bitmaps for Guild {guild_id}, Channel {channel_id}.")
+        except (Exception, psycopg2.Error) as error:
+            print(f"ERROR: Error while saving attendance bitmaps for guild {guild_id}, channel {channel_id}: {error}")
+            if conn:
+                conn.rollback()
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                conn.close()
+    else:
+        print("ERROR: Could not establish database connection for saving attendance bitmaps.")
 
 
-   action = action.lower()
 
 
-   if action == "add" and member:
-       if member.id in guild_settings["server_admins"]:
-           await ctx.send(f"{member.mention} is already a server admin.")
-       else:
-           guild_settings["server_admins"].add(member.id)
-           await ctx.send(f"{member.mention} has been added as a server admin.")
-           await save_specific_data_to_db(guild_id, 0, guild_settings)  # Save changes
-           print(f"INFO: {member.display_name} ({member.id}) added as admin for guild {guild_id}.")
-   elif action == "remove" and member:
-       if member.id == ctx.guild.owner_id:
-           await ctx.send(f"{member.mention}, the guild owner cannot be removed from admin status.")
-       elif member.id in guild_settings["server_admins"]:
-           guild_settings["server_admins"].remove(member.id)
-           await ctx.send(f"{member.mention} has been removed as a server admin.")
-           await save_specific_data_to_db(guild_id, 0, guild_settings)  # Save changes
-           print(f"INFO: {member.display_name} ({member.id}) removed from admins for guild {guild_id}.")
-       else:
-           await ctx.send(f"{member.mention} is not currently a server admin.")
-   elif action == "list":
-       admin_list = []
-       for admin_id in guild_settings["server_admins"]:
-           try:
-               admin_user = await bot.fetch_user(admin_id)
-               admin_list.append(f"{admin_user.display_name} (<@{admin_id}>)")
-           except (discord.NotFound, discord.HTTPException):
-               admin_list.append(f"Unknown User (<@{admin_id}>)")
-       admins = "\n".join(admin_list) if admin_list else "No admins assigned."
-       await ctx.send(f"**Server Admins:**\n{admins}")
-   else: # This 'else' block will now only be hit if action is provided but is invalid (e.g., c.g invalid_action)
-       await ctx.send("Invalid command. Usage: "
-                      "`c.g add @User`, `c.g remove @User`, or `c.g list`.")
+async def get_attendance_bitmaps(guild_id, channel_id):
+    """Retrieves a channel's attendance bitmaps from the cache, loading from DB if not present."""
+    key = (guild_id, channel_id)
+    if key not in attendance_bitmap_cache:
+        loaded_bitmaps = await load_attendance_bitmaps(guild_id, channel_id)
+        if loaded_bitmaps is None:
+            return {}  # Don't cache a failed load, try again next time
+        attendance_bitmap_cache[key] = loaded_bitmaps
+    return attendance_bitmap_cache[key]
 
 
 
 
-@bot.command()
-async def c(ctx, *checkIn):
-    """Check-in command for users. Handles check-ins and saves to Postgres immediately."""
-    data = await get_channel_data(ctx.guild.id, ctx.channel.id)
-    guild_id = ctx.guild.id
-    channel_id = ctx.channel.id
-    user_id = ctx.author.id
+async def update_attendance_bitmaps(guild_id, channel_id, period_date, checked_user_ids, missed_user_ids):
+    """Records one reset period in the attendance bitmaps of every checked and missed user, then persists them."""
+    bitmaps = await get_attendance_bitmaps(guild_id, channel_id)
+    checked = set(checked_user_ids)
+    changed = {}
+    recorded = checked | set(missed_user_ids)
+    for user_id in recorded:
+        bits, periods, last_period = bitmaps.get(user_id, (0, 0, None))
+        bitmaps[user_id] = list(shift_attendance_bits(bits, periods, last_period, period_date, user_id in checked))
+        changed[user_id] = bitmaps[user_id]
+    # A repeated reset replaces the date, so users only recorded by the earlier one lose that day's check-in
+    for user_id, (bits, periods, last_period) in bitmaps.items():
+        if user_id not in recorded and last_period == period_date and bits & 1:
+            bitmaps[user_id] = [bits & ~1, periods, last_period]
+            changed[user_id] = bitmaps[user_id]
+    await save_attendance_bitmaps(guild_id, channel_id, changed)
 
-    # -----------------------------
-    # 1. FETCH GUILD TIMEZONE HERE
-    # -----------------------------
-    guild_timezone = data.get("timezone", "UTC")
 
 
-    # If banned
-    if user_id in data.get("banned_users", set()):
-        await ctx.send(f"{ctx.author.mention}, you are banned from checking in.")
-        return
 
-    # Ensure 'dailyCheckedUsers' is a list and 'users' is a dict, defensively
-    if not isinstance(data.get("dailyCheckedUsers"), list):
-        data["dailyCheckedUsers"] = []
-    if not isinstance(data.get("users"), dict):
-        data["users"] = {}
+def get_guild_tz(guild_settings):
+    """Returns the pytz timezone configured for a guild, defaulting to America/Los_Angeles."""
+    try:
+        return pytz.timezone(guild_settings.get("timezone", "America/Los_Angeles"))
+    except pytz.exceptions.UnknownTimeZoneError:
+        return pytz.timezone("America/Los_Angeles")
 
-    # If already checked in today
-    if user_id in data["dailyCheckedUsers"]:
-        await ctx.send(f"{ctx.author.mention}, you've already checked in today in this channel!")
-        return
 
-    # If require_media is set, check for attachments or links
-    if data.get("require_media", False):
-        has_attachment = bool(ctx.message.attachments)
-        has_link = "http://" in ctx.message.content or "https://" in ctx.message.content
 
-        if not (has_attachment or has_link):
-            await ctx.send(f"{ctx.author.mention}, you must attach an image/file or include a link in your check-in.")
-            return
 
-    # Minimum word count
-    word_min = data.get("word_min", 1)
-    if word_min > 1:
-        checkInText = " ".join(checkIn)
-        if len(checkInText.split()) < word_min:
-            await ctx.send(f"{ctx.author.mention}, your check-in must be at least {word_min} words.")
-            return
+def parse_date_argument(date_str, guild_tz):
+    """Parses a MM-DD (current year in the guild timezone) or free-form date string. Returns a date or None."""
+    match_mm_dd = re.match(r'^\s*(\d{1,2})-(\d{1,2})\s*$', date_str)
+    try:
+        if match_mm_dd:
+            return datetime(datetime.now(guild_tz).year, int(match_mm_dd.group(1)), int(match_mm_dd.group(2))).date()
+        return parser.parse(date_str).date()
+    except (ValueError, OverflowError):
+        return None
 
-    # Add user to today's check-ins and increment total
-    data["dailyCheckedUsers"].append(user_id)
-    data["users"][user_id] = data["users"].get(user_id, 0) + 1
 
-    # Save immediately
-    await save_specific_data_to_db(guild_id, channel_id, data)
-    print(f"INFO: User {user_id} checked in to channel {channel_id} in guild {guild_id}.")
 
-    # -----------------------------
-    # 2. NOW SAFE TO USE TIMEZONE
-    # -----------------------------
-    now_guild_tz = datetime.now(pytz.timezone(guild_timezone))
 
-    # Track last check-in timestamps
-    data.setdefault("last_checkins", {})
-    data["last_checkins"][str(user_id)] = now_guild_tz.astimezone(pytz.utc)
+async def resolve_real_name(guild, data, user_id):
+    """Resolves a user ID to its mapped real name, falling back to the member or Discord display name."""
+    real_name = data.get("userToReal", {}).get(str(user_id))
+    if real_name:
+        return real_name
+    member = guild.get_member(user_id) if guild else None
+    if member:
+        return member.display_name
+    try:
+        user = await bot.fetch_user(user_id)
+        return user.display_name
+    except (discord.NotFound, discord.HTTPException):
+        return f"Unknown User ({user_id})"
 
-    # Save again to update last_checkins
-    await save_specific_data_to_db(guild_id, channel_id, data)
 
-    await ctx.send(f"{ctx.author.mention}, you've successfully checked in today in this channel!")
 
 
+async def format_leaderboard_lines(guild, data, user_counts, unit):
+    """Aggregates (user_id, count) pairs by real name and formats them as numbered leaderboard lines."""
+    counts_by_real_name = {}
+    for user_id, count in user_counts:
+        real_name = await resolve_real_name(guild, data, user_id)
+        counts_by_real_name[real_name] = counts_by_real_name.get(real_name, 0) + count
+    sorted_counts = sorted(counts_by_real_name.items(), key=lambda x: x[1], reverse=True)
+    return [f"{i + 1}. **{real_name}**: {count} {unit}" for i, (real_name, count) in enumerate(sorted_counts)]
 
 
 
-@bot.command()
-async def e(ctx):
-   """Toggles the requirement for media (image/link) in check-ins. This is channel-specific."""
-   data = await get_channel_data(ctx.guild.id, ctx.channel.id)
-   if not await is_admin(ctx):
-       await ctx.send(f"{ctx.author.mention}, this command is only accessible to admins.")
-       return
-   data["require_media"] = not data["require_media"]
-   status = "no longer" if not data["require_media"] else "now"
-   await ctx.send(f"Check-ins in this channel **{status}** require evidence (an image or file).")
-   await save_specific_data_to_db(ctx.guild.id, ctx.channel.id, data)  # Save changes
-   print(f"INFO: Media requirement for channel {ctx.channel.id} set to {data['require_media']}.")
 
+async def save_daily_snapshot(guild_id, channel_id, snapshot_date, checked_user_ids, missed_user_ids, reset_at):
+    """Persists the checked and missed user IDs of one reset period. A second reset on the same date replaces the row."""
+    conn = get_db_connection()
+    if conn:
+        cur = None
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                f"""
+                INSERT INTO {DAILY_SNAPSHOT_TABLE} (guild_id, channel_id, snapshot_date, checked_ids, missed_ids, reset_at)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                ON CONFLICT (guild_id, channel_id, snapshot_date) DO UPDATE
+                SET checked_ids = EXCLUDED.checked_ids, missed_ids = EXCLUDED.missed_ids, reset_at = EXCLUDED.reset_at
+                """,
+                (guild_id, channel_id, snapshot_date, list(checked_user_ids), list(missed_user_ids), reset_at)
+            )
+            conn.commit()
+            print(f"DEBUG: Saved daily snapshot for Guild {guild_id}, Channel {channel_id}, date {snapshot_date}.")
+        except (Exception, psycopg2.Error) as error:
+            print(f"ERROR: Error while saving daily snapshot for guild {guild_id}, channel {channel_id}: {error}")
+            if conn:
+                conn.rollback()
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                conn.close()
+    else:
+        print("ERROR: Could not establish database connection for saving daily snapshot.")
 
 
 
-@bot.command()
-async def wl(ctx):
-   """Displays the check-in leaderboard (who checked in most). This is channel-specific and aggregates by real name."""
-   data = await get_channel_data(ctx.guild.id, ctx.channel.id)
 
+async def load_snapshot_counts(guild_id, channel_id, start_date, end_date, missed=False):
+    """
+    Counts how many recorded periods each user checked in (or missed, if missed=True) between
+    start_date and end_date inclusive. start_date=None counts from the first snapshot.
+    Returns a list of (user_id, count) pairs, or None on error.
+    """
+    id_column = "missed_ids" if missed else "checked_ids"
+    conn = get_db_connection()
+    if conn:
+        cur = None
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                f"""
+                SELECT uid, COUNT(*)
+                FROM {DAILY_SNAPSHOT_TABLE} s, unnest(s.{id_column}) AS uid
+                WHERE s.guild_id = %s AND s.channel_id = %s
+                  AND (%s::date IS NULL OR s.snapshot_date >= %s::date)
+                  AND s.snapshot_date <= %s::date
+                GROUP BY uid
+                """,
+                (guild_id, channel_id, start_date, start_date, end_date)
+            )
+            return cur.fetchall()
+        except (Exception, psycopg2.Error) as error:
+            print(f"ERROR: Error while loading snapshot counts for guild {guild_id}, channel {channel_id}: {error}")
+            return None
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                conn.close()
+    else:
+        print("ERROR: Could not establish database connection for loading snapshot counts.")
+        return None
 
-   # Aggregate check-ins by real name
-   checkins_by_real_name = {}
-   for user_id, checkins in data.get("users", {}).items():
-       try:
-           user = await bot.fetch_user(user_id)
-           # Use userToReal for display names, falling back to discord display name
-           real_name = data["userToReal"].get(str(user_id), user.display_name)
-       except (discord.NotFound, discord.HTTPException):
-           real_name = f"Unknown User ({user_id})"
-       checkins_by_real_name[real_name] = checkins_by_real_name.get(real_name, 0) + checkins
 
 
-   sorted_checkins = sorted(checkins_by_real_name.items(), key=lambda x: x[1], reverse=True)
 
+def rollup_period_start(period_date, granularity):
+    """Returns the first day of the week (Monday) or month containing period_date."""
+    if granularity == "week":
+        return period_date - timedelta(days=period_date.weekday())
+    return period_date.replace(day=1)
 
-   embed = discord.Embed(title=f"Check-in Leaderboard for #{ctx.channel.name}", color=discord.Color.green())
-   if not sorted_checkins:
-       embed.description = "No check-ins recorded yet in this channel!"
-   else:
-       embed.description = "\n".join(
-           f"{i + 1}. **{real_name}**: {checkins} check-in(s)"
-           for i, (real_name, checkins) in enumerate(sorted_checkins)
-       )
-   await ctx.send(embed=embed)
 
 
 
+def rollup_period_end(period_start, granularity):
+    """Returns the last day of the week or month starting at period_start."""
+    if granularity == "week":
+        return period_start + timedelta(days=6)
+    return (period_start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
 
-@bot.command()
-async def ll(ctx):
-   """Displays the missed check-ins leaderboard. This is channel-specific and aggregates by real name."""
-   data = await get_channel_data(ctx.guild.id, ctx.channel.id)
 
 
-   # Aggregate missed check-ins by real name
-   missed_by_real_name = {}
-   for user_id, missed in data.get("missed_users", {}).items():
-       try:
-           user = await bot.fetch_user(user_id)
-           real_name = data["userToReal"].get(str(user_id), user.display_name)
-       except (discord.NotFound, discord.HTTPException):
-           real_name = f"Unknown User ({user_id})"
-       missed_by_real_name[real_name] = missed_by_real_name.get(real_name, 0) + missed
 
+async def update_checkin_rollups(guild_id, channel_id, period_date):
+    """
+    Recomputes the weekly and monthly rollups containing period_date from the daily snapshots in a single
+    transaction. Recomputing (rather than adding) keeps a replaced snapshot, e.g. a second reset on the
+    same date, from being counted twice. A snapshot's checked and missed ids are disjoint (the reset puts
+    every member in exactly one), so they are counted as stored, like the single-day stats and c.range.
+    """
+    conn = get_db_connection()
+    if conn:
+        cur = None
+        try:
+            cur = conn.cursor()
+            for rollup_table, granularity in ((WEEKLY_ROLLUP_TABLE, "week"), (MONTHLY_ROLLUP_TABLE, "month")):
+                period_start = rollup_period_start(period_date, granularity)
+                period_end = rollup_period_end(period_start, granularity)
+                cur.execute(f"DELETE FROM {rollup_table} WHERE guild_id = %s AND channel_id = %s AND period_start = %s",
+                            (guild_id, channel_id, period_start))
+                cur.execute(
+                    f"""
+                    INSERT INTO {rollup_table} (guild_id, channel_id, period_start, user_id, checkins, misses)
+                    SELECT %s, %s, %s, uid, SUM(checked), SUM(missed)
+                    FROM (
+                        SELECT uid, 1 AS checked, 0 AS missed FROM {DAILY_SNAPSHOT_TABLE} s, unnest(s.checked_ids) AS uid
+                        WHERE s.guild_id = %s AND s.channel_id = %s AND s.snapshot_date BETWEEN %s AND %s
+                        UNION ALL
+                        SELECT uid, 0, 1 FROM {DAILY_SNAPSHOT_TABLE} s, unnest(s.missed_ids) AS uid
+                        WHERE s.guild_id = %s AND s.channel_id = %s AND s.snapshot_date BETWEEN %s AND %s
+                    ) periods
+                    GROUP BY uid
+                    """,
+                    (guild_id, channel_id, period_start) + (guild_id, channel_id, period_start, period_end) * 2
+                )
+            conn.commit()
+            print(f"DEBUG: Updated weekly/monthly rollups for Guild {guild_id}, Channel {channel_id}, date {period_date}.")
+        except (Exception, psycopg2.Error) as error:
+            print(f"ERROR: Error while updating rollups for guild {guild_id}, channel {channel_id}: {error}")
+            if conn:
+                conn.rollback()
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                conn.close()
+    else:
+        print("ERROR: Could not establish database connection for updating rollups.")
 
-   sorted_missed = sorted(missed_by_real_name.items(), key=lambda x: x[1], reverse=True)
 
 
-   embed = discord.Embed(
-       title=f"Missed Check-ins Leaderboard for #{ctx.channel.name}",
-       color=discord.Color.red()
-   )
-   if not sorted_missed:
-       embed.description = "No missed check-ins recorded yet in this channel!"
-   else:
-       embed.description = "\n".join(
-           f"{i + 1}. **{real_name}**: {missed} missed check-in(s)"
-           for i, (real_name, missed) in enumerate(sorted_missed)
-       )
-   await ctx.send(embed=embed)
 
+async def load_period_stats(guild_id, channel_id, granularity, period_start):
+    """
+    Loads (user_id, checkins, misses) rows for one week or month from the rollup tables,
+    or for a single day from the daily snapshots. Returns None on error.
+    """
+    if granularity == "day":
+        query = f"""
+            SELECT uid, 1, 0 FROM {DAILY_SNAPSHOT_TABLE} s, unnest(s.checked_ids) AS uid
+            WHERE s.guild_id = %s AND s.channel_id = %s AND s.snapshot_date = %s
+            UNION ALL
+            SELECT uid, 0, 1 FROM {DAILY_SNAPSHOT_TABLE} s, unnest(s.missed_ids) AS uid
+            WHERE s.guild_id = %s AND s.channel_id = %s AND s.snapshot_date = %s
+        """
+        params = (guild_id, channel_id, period_start) * 2
+    else:
+        rollup_table = WEEKLY_ROLLUP_TABLE if granularity == "week" else MONTHLY_ROLLUP_TABLE
+        query = (f"SELECT user_id, checkins, misses FROM {rollup_table} "
+                 f"WHERE guild_id = %s AND channel_id = %s AND period_start = %s")
+        params = (guild_id, channel_id, period_start)
+
+    conn = get_db_connection()
+    if conn:
+        cur = None
+        try:
+            cur = conn.cursor()
+            cur.execute(query, params)
+            return cur.fetchall()
+        except (Exception, psycopg2.Error) as error:
+            print(f"ERROR: Error while loading {granularity} stats for guild {guild_id}, channel {channel_id}: {error}")
+            return None
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                conn.close()
+    else:
+        print("ERROR: Could not establish database connection for loading stats.")
+        return None
 
-@bot.command()
-async def dl(ctx):
-    """Leaderboard showing the number of days since a user last checked in."""
-    guild_id = ctx.guild.id
-    channel_id = ctx.channel.id
 
-    # Get channel data
-    channel_data = await get_channel_data(guild_id, channel_id)
-    if channel_data is None:
-        return await ctx.send("No data found for this channel.")
 
-    last_checkins = channel_data.get("last_checkins", {})
-    days_data = channel_data.get("days_since_last", {})
-    user_to_real = channel_data.get("userToReal", {})
 
-    leaderboard = []
+async def load_guild_insight_data(guild_id, trend_start_date):
+    """
+    Loads the raw inputs for c.insights in two queries: every (channel_id, user_id, checkins, misses)
+    row of the guild's leaderboards, and per-snapshot checked/missed counts since trend_start_date.
+    Returns (leaderboard_rows, snapshot_rows), or None on error.
+    """
+    conn = get_db_connection()
+    if conn:
+        cur = None
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                f"""
+                SELECT channel_id, user_id, COALESCE(c.count, 0), COALESCE(m.count, 0)
+                FROM (SELECT channel_id, user_id, count FROM {LEADERBOARD_CHECKIN_TABLE} WHERE guild_id = %s) c
+                FULL OUTER JOIN (SELECT channel_id, user_id, count FROM {LEADERBOARD_MISSED_TABLE} WHERE guild_id = %s) m
+                USING (channel_id, user_id)
+                """,
+                (guild_id, guild_id)
+            )
+            leaderboard_rows = cur.fetchall()
+            cur.execute(
+                f"""
+                SELECT channel_id, snapshot_date, cardinality(checked_ids), cardinality(missed_ids)
+                FROM {DAILY_SNAPSHOT_TABLE}
+                WHERE guild_id = %s AND snapshot_date >= %s
+                """,
+                (guild_id, trend_start_date)
+            )
+            return leaderboard_rows, cur.fetchall()
+        except (Exception, psycopg2.Error) as error:
+            print(f"ERROR: Error while loading insight data for guild {guild_id}: {error}")
+            return None
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                conn.close()
+    else:
+        print("ERROR: Could not establish database connection for loading insight data.")
+        return None
 
-    # Timezone fallback
-    guild_timezone = channel_data.get("timezone", "UTC")
-    try:
-        tz = pytz.timezone(guild_timezone)
-    except:
-        tz = pytz.UTC
 
-    now_local = datetime.now(tz)
 
-    for real_id_str, user_id in user_to_real.items():
-        real_id_str = str(real_id_str)
 
-        user = ctx.guild.get_member(int(user_id))
-        if not user:
-            continue
+def compute_insights(leaderboard_rows, snapshot_rows, checkin_epochs, utc_offset_seconds, trend_start_date):
+    """
+    Computes guild-wide and per-channel distributions with array operations.
+    Returns {"guild": stats, "channels": {channel_id: stats}, "trend": [...], "trend_slope": float, "hours": [24 counts]}.
+    """
+    insights = {"guild": None, "channels": {}, "trend": [], "trend_slope": 0.0, "hours": [0] * 24}
+
+    if leaderboard_rows:
+        table = np.array(leaderboard_rows, dtype=np.int64)
+        channel_ids, checkins, misses = table[:, 0], table[:, 2], table[:, 3]
+
+        def distribution(checkin_counts, miss_counts):
+            totals = checkin_counts + miss_counts
+            tracked = totals > 0
+            miss_rates = miss_counts[tracked] / totals[tracked] if tracked.any() else np.zeros(1)
+            return {
+                "users": int(checkin_counts.size),
+                "percentiles": np.percentile(checkin_counts, [25, 50, 75, 90]).tolist(),
+                "mean_checkins": float(checkin_counts.mean()),
+                "median_miss_rate": float(np.median(miss_rates)),
+                "mean_miss_rate": float(miss_rates.mean()),
+            }
+
+        insights["guild"] = distribution(checkins, misses)
+
+        # Group rows by channel with a single sort instead of a dict per user
+        order = np.argsort(channel_ids, kind="stable")
+        sorted_channels = channel_ids[order]
+        unique_channels, starts = np.unique(sorted_channels, return_index=True)
+        for channel_id, checkin_group, miss_group in zip(unique_channels,
+                                                         np.split(checkins[order], starts[1:]),
+                                                         np.split(misses[order], starts[1:])):
+            insights["channels"][int(channel_id)] = distribution(checkin_group, miss_group)
+
+    if snapshot_rows:
+        day_offsets = np.array([(row[1] - trend_start_date).days for row in snapshot_rows], dtype=np.int64)
+        checked_counts = np.array([row[2] for row in snapshot_rows], dtype=np.float64)
+        missed_counts = np.array([row[3] for row in snapshot_rows], dtype=np.float64)
+        days = int(day_offsets.max()) + 1
+        checked_per_day = np.bincount(day_offsets, weights=checked_counts, minlength=days)
+        tracked_per_day = np.bincount(day_offsets, weights=checked_counts + missed_counts, minlength=days)
+        has_data = tracked_per_day > 0
+        rates = np.divide(checked_per_day, tracked_per_day, out=np.zeros(days), where=has_data)
+        insights["trend"] = [(trend_start_date + timedelta(days=int(i)), float(rates[i]))
+                             for i in np.flatnonzero(has_data)]
+        if has_data.sum() >= 2:
+            insights["trend_slope"] = float(np.polyfit(np.flatnonzero(has_data), rates[has_data], 1)[0])
+
+    if len(checkin_epochs):
+        # Uses the guild's current UTC offset for every timestamp, so hours can be off by one across DST changes
+        local_seconds = np.asarray(checkin_epochs, dtype=np.int64) + utc_offset_seconds
+        insights["hours"] = np.bincount((local_seconds // 3600) % 24, minlength=24).tolist()
+
+    return insights
+
+
+
+
+def format_distribution(stats):
+    """Formats one distribution from compute_insights for an embed field."""
+    p25, p50, p75, p90 = stats["percentiles"]
+    return (f"Users: **{stats['users']}** | Mean check-ins: **{stats['mean_checkins']:.1f}**\n"
+            f"Check-ins p25/p50/p75/p90: **{p25:.0f} / {p50:.0f} / {p75:.0f} / {p90:.0f}**\n"
+            f"Miss rate median/mean: **{stats['median_miss_rate']:.0%} / {stats['mean_miss_rate']:.0%}**")
+
+
+
+
+async def load_snapshot_daily_counts(guild_id, channel_id, start_date, end_date):
+    """Loads (snapshot_date, checked_count, missed_count) rows for a channel between two dates. Returns None on error."""
+    conn = get_db_connection()
+    if conn:
+        cur = None
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                f"""
+                SELECT snapshot_date, cardinality(checked_ids), cardinality(missed_ids)
+                FROM {DAILY_SNAPSHOT_TABLE}
+                WHERE guild_id = %s AND channel_id = %s AND snapshot_date BETWEEN %s AND %s
+                """,
+                (guild_id, channel_id, start_date, end_date)
+            )
+            return cur.fetchall()
+        except (Exception, psycopg2.Error) as error:
+            print(f"ERROR: Error while loading daily counts for guild {guild_id}, channel {channel_id}: {error}")
+            return None
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                conn.close()
+    else:
+        print("ERROR: Could not establish database connection for loading daily counts.")
+        return None
 
-        if real_id_str in last_checkins:
-            last_time_str = last_checkins[real_id_str]
-            if isinstance(last_time_str, str):
-                try:
-                    last_time = datetime.fromisoformat(last_time_str).replace(tzinfo=pytz.UTC)
-                except:
-                    continue
-            else:
-                last_time = last_time_str
 
-            last_local = last_time.astimezone(tz)
-            day_diff = (now_local.date() - last_local.date()).days
 
-            # Respect stored data if it's higher
-            stored = days_data.get(user_id, 0)
-            day_count = max(day_diff, stored)
 
-            leaderboard.append((user.display_name, day_count))
+HEATMAP_WEEKS = 53
+HEATMAP_CACHE_MAX_ENTRIES = 128
+HEATMAP_COLORS = [(235, 237, 240), (155, 233, 168), (64, 196, 99), (48, 161, 78), (33, 110, 57)]
 
-        else:
-            # Never checked in — represent as special case (None)
-            leaderboard.append((user.display_name, None))
 
-    # Sort: first by those with actual days (descending), then by Never Checked In at bottom
-    def sort_key(entry):
-        name, days = entry
-        if days is None:
-            return (-1, 0, name.lower())  # bottom
-        return (1, days, name.lower())  # top, sorted by days
+def render_heatmap_png(day_values, end_date, title):
+    """
+    Renders a GitHub-style calendar heatmap (one column per week, Sunday on top) ending at end_date.
+    day_values maps a date to a value in [0, 1]; days without data are drawn empty. Returns PNG bytes.
+    """
+    cell, gap = 11, 3
+    step = cell + gap
+    left, top = 34, 42
+    last_week_start = end_date - timedelta(days=(end_date.weekday() + 1) % 7)
+    first_week_start = last_week_start - timedelta(weeks=HEATMAP_WEEKS - 1)
+
+    image = Image.new("RGB", (left + HEATMAP_WEEKS * step + 10, top + 7 * step + 10), "white")
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default()
+    text_color = (87, 96, 106)
+    draw.text((left, 6), title, fill=(36, 41, 47), font=font)
+    for row, label in ((1, "Mon"), (3, "Wed"), (5, "Fri")):
+        draw.text((4, top + row * step - 1), label, fill=text_color, font=font)
+
+    for week in range(HEATMAP_WEEKS):
+        week_start = first_week_start + timedelta(weeks=week)
+        x = left + week * step
+        if week_start.day <= 7:
+            draw.text((x, top - 14), week_start.strftime("%b"), fill=text_color, font=font)
+        for weekday in range(7):
+            day = week_start + timedelta(days=weekday)
+            if day > end_date:
+                break
+            value = day_values.get(day)
+            level = 0 if not value else min(4, max(1, int(value * 4 + 0.999)))
+            y = top + weekday * step
+            draw.rectangle((x, y, x + cell - 1, y + cell - 1), fill=HEATMAP_COLORS[level])
 
-    leaderboard.sort(key=sort_key, reverse=True)
+    buffer = BytesIO()
+    image.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
 
-    # Limit display
-    top_limit = min(50, len(leaderboard))
-    leaderboard = leaderboard[:top_limit]
 
-    if not leaderboard:
-        return await ctx.send("There is no data for this leaderboard yet.")
 
-    # GOLD FORMATTING
-    embed = discord.Embed(
-        title="📊 Days Since Last Check-In Leaderboard",
-        description="",
-        color=discord.Color.gold()
-    )
 
-    placement_emojis = ["🥇", "🥈", "🥉"]
+def invalidate_heatmap_cache(guild_id, channel_id):
+    """Drops every cached heatmap for a channel (called at reset, when new history lands)."""
+    for key in [key for key in heatmap_cache if key[0] == guild_id and key[1] == channel_id]:
+        heatmap_cache.pop(key, None)
 
-    for i, (name, days) in enumerate(leaderboard, start=1):
-        emoji = placement_emojis[i - 1] if i <= 3 else f"**{i}.**"
 
-        if days is None:
-            value = "Never checked in ❌"
-        else:
-            value = f"**{days}** days"
 
-        embed.description += f"{emoji} — **{name}**: {value}\n"
 
-    await ctx.send(embed=embed)
+def checkin_text_from_message(ctx):
+    """Returns the check-in text of the invoking message with the prefix and command name stripped."""
+    return ctx.message.content[len(ctx.prefix or "") + len(ctx.invoked_with or ""):].strip()
 
 
 
 
+async def save_checkin_message(guild_id, channel_id, message, checkin_text):
+    """Persists an accepted check-in message: author, timestamp, text and attachment metadata."""
+    attachments = [
+        {
+            "id": attachment.id,
+            "url": attachment.url,
+            "filename": attachment.filename,
+            "content_type": attachment.content_type,
+            "size": attachment.size,
+        }
+        for attachment in message.attachments
+    ]
+    conn = get_db_connection()
+    if conn:
+        cur = None
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                f"""
+                INSERT INTO {CHECKIN_MESSAGE_TABLE}
+                    (message_id, guild_id, channel_id, user_id, author_name, created_at, content, attachments)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (message_id) DO NOTHING
+                """,
+                (message.id, guild_id, channel_id, message.author.id, message.author.display_name[:255],
+                 message.created_at, checkin_text, psycopg2.extras.Json(attachments))
+            )
+            conn.commit()
+            print(f"DEBUG: Stored check-in message {message.id} for Guild {guild_id}, Channel {channel_id}.")
+        except (Exception, psycopg2.Error) as error:
+            print(f"ERROR: Error while storing check-in message {message.id} for guild {guild_id}, channel {channel_id}: {error}")
+            if conn:
+                conn.rollback()
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                conn.close()
+    else:
+        print("ERROR: Could not establish database connection for storing check-in message.")
 
 
 
 
+async def fetch_stored_checkins(guild_id, channel_id, start_time_utc, end_time_utc):
+    """
+    Loads stored check-ins for a channel with start_time_utc < created_at < end_time_utc, oldest first.
+    Each check-in is a dict with message_id, user_id, author_name, created_at, content and attachments.
+    Returns None on error.
+    """
+    conn = get_db_connection()
+    if conn:
+        cur = None
+        try:
+            cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cur.execute(
+                f"""
+                SELECT message_id, user_id, author_name, created_at, content, attachments
+                FROM {CHECKIN_MESSAGE_TABLE}
+                WHERE guild_id = %s AND channel_id = %s AND created_at > %s AND created_at < %s
+                ORDER BY created_at
+                """,
+                (guild_id, channel_id, start_time_utc, end_time_utc)
+            )
+            return [dict(row) for row in cur.fetchall()]
+        except (Exception, psycopg2.Error) as error:
+            print(f"ERROR: Error while fetching stored check-ins for guild {guild_id}, channel {channel_id}: {error}")
+            return None
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                conn.close()
+    else:
+        print("ERROR: Could not establish database connection for fetching stored check-ins.")
+        return None
 
-@bot.command()
-async def t(ctx):
-   """Checks who has sent a check-in today and who hasn't. This is channel-specific."""
-   data = await get_channel_data(ctx.guild.id, ctx.channel.id)
 
 
-   checked_users_names = []
-   for user_id in data.get("dailyCheckedUsers", []):
-       try:
-           user = await bot.fetch_user(user_id)
-           real_name = data["userToReal"].get(str(user_id), user.display_name)
-           checked_users_names.append(real_name)
-       except (discord.NotFound, discord.HTTPException):
-           checked_users_names.append(f"Unknown User ({user_id})")
-   checked_users_list_str = "\n".join(
-       checked_users_names) if checked_users_names else "No users checked in today in this channel."
 
+# Attachment downloads run concurrently and images are downscaled off the event loop before prompting
+ATTACHMENT_MAX_BYTES = int(os.getenv("ATTACHMENT_MAX_BYTES", str(8 * 1024 * 1024)))
+ATTACHMENT_DOWNLOAD_CONCURRENCY = int(os.getenv("ATTACHMENT_DOWNLOAD_CONCURRENCY", "8"))
+IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", "1024"))
+IMAGE_JPEG_QUALITY = 85
+attachment_download_semaphore = None  # Shared by all summaries; created on first use, inside the running event loop
 
-   unchecked_users_names = []
-   # Fetch current members from the guild, exclude bots and banned users
-   all_members_in_channel = [m for m in ctx.guild.members if not m.bot and m.id not in data.get("banned_users", set())]
+image_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="image")
 
 
-   for member in all_members_in_channel:
-       if member.id not in data.get("dailyCheckedUsers", []):
-           try:
-               user_name = data["userToReal"].get(str(member.id), member.display_name)
-           except (discord.NotFound, discord.HTTPException):
-               user_name = f"Unknown User ({member.id})"
-           unchecked_users_names.append(user_name)
-   unchecked_list_str = "\n".join(
-       unchecked_users_names) if unchecked_users_names else "Everyone checked in today in this channel!"
+async def read_limited_response(response, max_bytes):
+    """Reads an HTTP response body, raising ValueError as soon as it grows past max_bytes."""
+    if response.content_length and response.content_length > max_bytes:
+        raise ValueError(f"attachment is {response.content_length} bytes, over the {max_bytes} byte limit")
+    body = bytearray()
+    async for block in response.content.iter_chunked(64 * 1024):
+        body.extend(block)
+        if len(body) > max_bytes:
+            raise ValueError(f"attachment is over the {max_bytes} byte limit")
+    return bytes(body)
 
 
-   await ctx.send(f"**Users who checked in today in #{ctx.channel.name}:**\n{checked_users_list_str}"
-                  f"\n\n**Users who have yet to check-in today in #{ctx.channel.name}:**\n{unchecked_list_str}")
+async def read_stored_attachment(channel, checkin, attachment):
+    """
+    Downloads a stored attachment of at most ATTACHMENT_MAX_BYTES. Discord CDN URLs expire, so if the
+    stored URL no longer works the message is fetched again for a fresh URL. Returns the bytes or raises.
+    """
+    global attachment_http_session
+    if (attachment.get("size") or 0) > ATTACHMENT_MAX_BYTES:
+        raise ValueError(f"attachment is {attachment['size']} bytes, over the {ATTACHMENT_MAX_BYTES} byte limit")
+    if attachment_http_session is None or attachment_http_session.closed:
+        attachment_http_session = aiohttp.ClientSession()
 
+    async with attachment_http_session.get(attachment["url"]) as response:
+        if response.status == 200:
+            return await read_limited_response(response, ATTACHMENT_MAX_BYTES)
 
+    message = await channel.fetch_message(checkin["message_id"])
+    for fresh_attachment in message.attachments:
+        if fresh_attachment.id == attachment["id"]:
+            if fresh_attachment.size > ATTACHMENT_MAX_BYTES:
+                raise ValueError(f"attachment is {fresh_attachment.size} bytes, over the {ATTACHMENT_MAX_BYTES} byte limit")
+            return await fresh_attachment.read()
+    raise ValueError(f"attachment {attachment['filename']} is no longer on message {checkin['message_id']}")
 
 
-@bot.command()
-async def n(ctx, *, realNames=None):
-   """
-   Tracks users and allows mapping Discord user IDs to real names.
-   If no arguments, it tracks all current non-banned members. This is channel-specific.
-   Prioritizes user IDs for robust mapping.
-   """
-   data = await get_channel_data(ctx.guild.id, ctx.channel.id)
-   if not await is_admin(ctx):
-       await ctx.send(f"{ctx.author.mention}, this command is only accessible to admins.")
-       return
+def compute_image_dhash(image):
+    """Returns the 64-bit difference hash of a PIL image: one bit per horizontally adjacent pixel pair of a 9x8 grayscale."""
+    pixels = list(image.convert("L").resize((9, 8), Image.LANCZOS).getdata())
+    image_hash = 0
+    for row in range(8):
+        for col in range(8):
+            image_hash = (image_hash << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return image_hash
 
 
-   if realNames:
-       pairs = [pair.strip() for pair in realNames.split(",")]
-       for pair in pairs:
-           try:
-               parts = pair.split(":")
-               if len(parts) != 2:
-                   await ctx.send(f"Invalid format for '{pair}'. Use 'UserID:RealName' or '@Mention:RealName' format.")
-                   return
+def image_hash_distance(hash_a, hash_b):
+    """Number of differing bits between two dHashes."""
+    return bin(hash_a ^ hash_b).count("1")
 
 
-               identifier, real_name = parts[0].strip(), parts[1].strip()
-               target_user_id = None
+def preprocess_image_bytes(image_bytes):
+    """
+    Decodes an image, downscales it to fit IMAGE_MAX_DIMENSION and re-encodes it as JPEG.
+    Returns (blob, dhash); the blob is a Gemini inline blob, since the SDK would otherwise
+    re-encode PIL images as lossless WebP. Runs in image_executor, never on the event loop.
+    """
+    image = Image.open(BytesIO(image_bytes))
+    image.draft("RGB", (IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION))  # Lets JPEG decoding skip straight to a smaller scale
+    image = image.convert("RGB")
+    image.thumbnail((IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION))
+    output = BytesIO()
+    image.save(output, format="JPEG", quality=IMAGE_JPEG_QUALITY)
+    return {"mime_type": "image/jpeg", "data": output.getvalue()}, compute_image_dhash(image)
 
 
-               if identifier.startswith('<@') and identifier.endswith('>'):
-                   try:
-                       target_user_id = int(identifier.strip('<@!>'))
-                   except ValueError:
-                       pass  # Not a valid mention ID
-               elif identifier.isdigit():
-                   target_user_id = int(identifier)
-               else:
-                   # If not a mention or ID, try to find by exact display name (less reliable)
-                   member = discord.utils.get(ctx.guild.members, display_name=identifier)
-                   if member:
-                       target_user_id = member.id
+def first_image_attachment(checkin):
+    """Returns the first image attachment of a stored check-in, or None."""
+    for attachment in checkin["attachments"]:
+        if 'image' in (attachment.get("content_type") or ""):
+            return attachment
+    return None
 
 
-               if target_user_id:
-                   # Check for existing real name mapping to a different user
-                   # This helps prevent accidental overwrites or confusion
-                   for existing_user_id_str, existing_real_name in list(
-                           data["realPeople"].items()):  # Use list() to iterate over a copy
-                       if existing_real_name == real_name and int(existing_user_id_str) != target_user_id:
-                           # Warn but still allow the mapping
-                           await ctx.send(
-                               f"Warning: The real name '{real_name}' is already mapped to <@{existing_user_id_str}>. "
-                               f"Mapping <@{target_user_id}> to '{real_name}' will allow both to use this name in leaderboards. "
-                               f"Consider using a unique real name for each user if you want distinct leaderboard entries.")
-                           break
+async def load_checkin_image(channel, checkin):
+    """
+    Returns (image_part, failed_filenames, image_key) for the first image attachment of a stored check-in
+    that can be downloaded and decoded. image_part is a downscaled JPEG blob and image_key is
+    (attachment_id, dhash), both None if there is no image.
+    """
+    failed_filenames = []
+    for attachment in checkin["attachments"]:
+        if 'image' not in (attachment.get("content_type") or ""):
+            continue
+        try:
+            image_bytes = await read_stored_attachment(channel, checkin, attachment)
+            image_part, image_hash = await asyncio.get_running_loop().run_in_executor(
+                image_executor, preprocess_image_bytes, image_bytes)
+            return image_part, failed_filenames, (attachment["id"], image_hash)
+        except Exception as e:
+            failed_filenames.append(attachment["filename"])
+            print(f"ERROR: Could not load image for {checkin['author_name']}'s check-in ({attachment['filename']}): {e}")
+    return None, failed_filenames, None
 
 
-                   data["userToReal"][str(target_user_id)] = real_name
-                   data["realPeople"][str(target_user_id)] = real_name  # Store by ID for consistency
-                   print(f"INFO: Mapped {target_user_id} to '{real_name}' in channel {ctx.channel.id}.")
-               else:
-                   await ctx.send(
-                       f"Could not find user for identifier '{identifier}'. Please use a mention, user ID, or exact Discord display name.")
-                   return
+# Hashes at most this many bits apart are treated as the same picture
+IMAGE_DUPLICATE_MAX_DISTANCE = 6
+IMAGE_DESCRIPTION_INTERVAL_MINUTES = 2
+IMAGE_DESCRIPTION_BATCH_SIZE = 10
+IMAGE_DESCRIPTION_PENDING_MAX = 200
+IMAGE_DESCRIPTION_PROMPT = (
+    "Describe this image from a daily check-in in one or two sentences. Focus on what it shows about the "
+    "person's work or progress (code, designs, notes, results); transcribe any short visible headings."
+)
 
+# Images sent to the model that have no stored description yet, described later by describeCheckinImages
+# Structure: {attachment_id: (guild_id, dhash, image_part)}
+pending_image_descriptions = {}
 
-           except ValueError:
-               await ctx.send(f"Invalid format for '{pair}'. Use 'UserID:RealName' or '@Mention:RealName' format.")
-               return
-   else:
-       # If no arguments, track all current non-bot, non-banned members in this channel's context
-       # This will refresh the mappings to current display names
-       data["userToReal"] = {}
-       data["realPeople"] = {}
-       for member in ctx.guild.members:
-           if not member.bot and member.id not in data["banned_users"]:
-               data["userToReal"][str(member.id)] = member.display_name
-               data["realPeople"][str(member.id)] = member.display_name
-       print(f"INFO: Refreshed all user-to-real name mappings for channel {ctx.channel.id}.")
 
+def signed_image_hash(image_hash):
+    """Maps an unsigned 64-bit dHash onto Postgres BIGINT range."""
+    return image_hash - (1 << 64) if image_hash >= (1 << 63) else image_hash
 
-   user_mappings = "\n".join([f"<@{user_id}> -> {real_name}" for user_id, real_name in data["realPeople"].items()])
-   await ctx.send(f"User IDs mapped to real names in #{ctx.channel.name}:\n{user_mappings}")
-   await save_specific_data_to_db(ctx.guild.id, ctx.channel.id, data)  # Save changes
+
+async def load_image_descriptions(guild_id, attachment_ids, image_hashes):
+    """
+    Loads stored image descriptions of a guild matching any of the attachment ids or exact dHashes.
+    Returns ({attachment_id: (dhash, description)}, {dhash: description}); both empty on error.
+    """
+    if not attachment_ids and not image_hashes:
+        return {}, {}
+    conn = get_db_connection()
+    if conn:
+        cur = None
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                f"""
+                SELECT attachment_id, image_hash, description FROM {IMAGE_DESCRIPTION_TABLE}
+                WHERE guild_id = %s AND (attachment_id = ANY(%s) OR image_hash = ANY(%s))
+                """,
+                (guild_id, list(attachment_ids), [signed_image_hash(image_hash) for image_hash in image_hashes])
+            )
+            by_attachment, by_hash = {}, {}
+            for attachment_id, image_hash, description in cur.fetchall():
+                image_hash &= (1 << 64) - 1
+                by_attachment[attachment_id] = (image_hash, description)
+                by_hash[image_hash] = description
+            return by_attachment, by_hash
+        except (Exception, psycopg2.Error) as error:
+            print(f"ERROR: Error while loading image descriptions for guild {guild_id}: {error}")
+            return {}, {}
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                conn.close()
+    else:
+        print("ERROR: Could not establish database connection for loading image descriptions.")
+        return {}, {}
+
+
+async def save_image_description(guild_id, attachment_id, image_hash, description):
+    """Stores the model-written description of a check-in image."""
+    conn = get_db_connection()
+    if conn:
+        cur = None
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                f"""
+                INSERT INTO {IMAGE_DESCRIPTION_TABLE} (attachment_id, guild_id, image_hash, description)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (attachment_id) DO UPDATE SET description = EXCLUDED.description
+                """,
+                (attachment_id, guild_id, signed_image_hash(image_hash), description)
+            )
+            conn.commit()
+        except (Exception, psycopg2.Error) as error:
+            print(f"ERROR: Error while saving image description for attachment {attachment_id}: {error}")
+            if conn:
+                conn.rollback()
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                conn.close()
+    else:
+        print("ERROR: Could not establish database connection for saving image description.")
+
+
+async def load_checkin_images(channel, stored_checkins):
+    """
+    Builds the image part of every check-in in a window. Images with a stored description (by attachment id,
+    or by dHash for re-posts) are replaced by that text; near-duplicates of an earlier image in the window
+    collapse to a reference to it; the rest are downloaded concurrently, at most ATTACHMENT_DOWNLOAD_CONCURRENCY
+    at a time across all summaries, and queued for a description. Returns {message_id: (image_part, failed_filenames)}.
+    """
+    global attachment_download_semaphore
+    guild_id = channel.guild.id
+    with_images = [checkin for checkin in stored_checkins if first_image_attachment(checkin)]
+    described, _ = await load_image_descriptions(
+        guild_id, [first_image_attachment(checkin)["id"] for checkin in with_images], [])
+
+    if attachment_download_semaphore is None:
+        attachment_download_semaphore = asyncio.Semaphore(ATTACHMENT_DOWNLOAD_CONCURRENCY)
+
+    async def load_one(checkin):
+        async with attachment_download_semaphore:
+            return await load_checkin_image(channel, checkin)
+
+    to_download = [checkin for checkin in with_images if first_image_attachment(checkin)["id"] not in described]
+    downloaded = dict(zip(
+        [checkin["message_id"] for checkin in to_download],
+        await asyncio.gather(*(load_one(checkin) for checkin in to_download))))
+    _, described_by_hash = await load_image_descriptions(
+        guild_id, [], [image_key[1] for _, _, image_key in downloaded.values() if image_key])
+
+    checkin_images = {}
+    seen_images = []  # (dhash, label) of images already in this window, in posting order
+    for checkin in with_images:
+        if checkin["message_id"] in downloaded:
+            image_part, failed_filenames, image_key = downloaded[checkin["message_id"]]
+            if image_key is None:
+                checkin_images[checkin["message_id"]] = (None, failed_filenames)
+                continue
+            attachment_id, image_hash = image_key
+            if image_hash in described_by_hash:
+                image_part = f"[Image: {described_by_hash[image_hash]}]"
+        else:
+            failed_filenames = []
+            attachment_id = first_image_attachment(checkin)["id"]
+            image_hash, description = described[attachment_id]
+            image_part = f"[Image: {description}]"
+
+        for seen_hash, label in seen_images:
+            if image_hash_distance(seen_hash, image_hash) <= IMAGE_DUPLICATE_MAX_DISTANCE:
+                image_part = f"[Same image as {label}]"
+                break
+        else:
+            seen_images.append((image_hash, f"{checkin['author_name']}'s check-in at {checkin['created_at'].strftime('%H:%M')}"))
+            if not isinstance(image_part, str) and len(pending_image_descriptions) < IMAGE_DESCRIPTION_PENDING_MAX:
+                pending_image_descriptions[attachment_id] = (guild_id, image_hash, image_part)
+        checkin_images[checkin["message_id"]] = (image_part, failed_filenames)
+    return checkin_images
+
+
+
+
+# --- Backfilling the message store from channel history ---
+BACKFILL_PAGE_SIZE = 100  # Discord returns at most 100 messages per history request
+BACKFILL_PAGE_DELAY_SECONDS = 1.0  # Pause between pages, on top of discord.py's own rate limit handling
+
+# Channel ids with a backfill currently running, started by c.backfill or resumed at startup
+backfill_channels_running = set()
+
+
+def parse_checkin_message(message):
+    """Returns the check-in text of a historical `c.c` message (prefix and command stripped), or None if it is not one."""
+    if message.author.bot:
+        return None
+    match = re.match(rf"^\s*(?:[cC]\.|<@!?{bot.user.id}>\s*)c(?:\s+|$)(.*)$", message.content, re.DOTALL)
+    return match.group(1).strip() if match else None
+
+
+async def load_backfill_checkpoint(guild_id, channel_id):
+    """Loads a channel's backfill checkpoint as a dict, or None if there is none (or on error)."""
+    conn = get_db_connection()
+    if conn:
+        cur = None
+        try:
+            cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cur.execute(
+                f"SELECT * FROM {BACKFILL_CHECKPOINT_TABLE} WHERE guild_id = %s AND channel_id = %s",
+                (guild_id, channel_id)
+            )
+            row = cur.fetchone()
+            return dict(row) if row else None
+        except (Exception, psycopg2.Error) as error:
+            print(f"ERROR: Error while loading backfill checkpoint for guild {guild_id}, channel {channel_id}: {error}")
+            return None
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                conn.close()
+    else:
+        print("ERROR: Could not establish database connection for loading backfill checkpoint.")
+        return None
+
+
+async def load_running_backfills():
+    """Loads the checkpoints of backfills that were still running when the bot stopped. Returns [] on error."""
+    conn = get_db_connection()
+    if conn:
+        cur = None
+        try:
+            cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cur.execute(f"SELECT * FROM {BACKFILL_CHECKPOINT_TABLE} WHERE status = 'running'")
+            return [dict(row) for row in cur.fetchall()]
+        except (Exception, psycopg2.Error) as error:
+            print(f"ERROR: Error while loading running backfills: {error}")
+            return []
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                conn.close()
+    else:
+        print("ERROR: Could not establish database connection for loading running backfills.")
+        return []
+
+
+async def save_backfill_page(checkpoint, rows):
+    """
+    Bulk-inserts one page of historical check-ins with COPY (through a temp table, so existing messages are
+    skipped) and advances the checkpoint in the same transaction. Returns the number of new rows, or None on error.
+    """
+    conn = get_db_connection()
+    if conn:
+        cur = None
+        try:
+            cur = conn.cursor()
+            stored = 0
+            if rows:
+                # csv.writer leaves empty strings unquoted, which COPY would read as NULL; FORCE_NOT_NULL keeps
+                # them empty, so an image-only `c.c` doesn't fail the page
+                buffer = StringIO()
+                writer = csv.writer(buffer)
+                for row in rows:
+                    writer.writerow(row)
+                buffer.seek(0)
+                cur.execute(f"CREATE TEMP TABLE backfill_rows (LIKE {CHECKIN_MESSAGE_TABLE} INCLUDING DEFAULTS) ON COMMIT DROP")
+                cur.copy_expert(
+                    "COPY backfill_rows (message_id, guild_id, channel_id, user_id, author_name, created_at, content, attachments) "
+                    "FROM STDIN WITH (FORMAT csv, FORCE_NOT_NULL (author_name, content))",
+                    buffer
+                )
+                cur.execute(
+                    f"""
+                    INSERT INTO {CHECKIN_MESSAGE_TABLE}
+                        (message_id, guild_id, channel_id, user_id, author_name, created_at, content, attachments)
+                    SELECT message_id, guild_id, channel_id, user_id, author_name, created_at, content, attachments
+                    FROM backfill_rows
+                    ON CONFLICT (message_id) DO NOTHING
+                    """
+                )
+                stored = cur.rowcount
+            cur.execute(
+                f"""
+                INSERT INTO {BACKFILL_CHECKPOINT_TABLE}
+                    (guild_id, channel_id, since, cursor_message_id, scanned, stored, status, updated_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, NOW())
+                ON CONFLICT (guild_id, channel_id) DO UPDATE
+                SET since = EXCLUDED.since, cursor_message_id = EXCLUDED.cursor_message_id,
+                    scanned = EXCLUDED.scanned, stored = EXCLUDED.stored, status = EXCLUDED.status, updated_at = NOW()
+                """,
+                (checkpoint["guild_id"], checkpoint["channel_id"], checkpoint["since"], checkpoint["cursor_message_id"],
+                 checkpoint["scanned"], checkpoint["stored"] + stored, checkpoint["status"])
+            )
+            conn.commit()
+            checkpoint["stored"] += stored
+            return stored
+        except (Exception, psycopg2.Error) as error:
+            print(f"ERROR: Error while saving backfill page for guild {checkpoint['guild_id']}, "
+                  f"channel {checkpoint['channel_id']}: {error}")
+            if conn:
+                conn.rollback()
+            return None
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                conn.close()
+    else:
+        print("ERROR: Could not establish database connection for saving backfill page.")
+        return None
+
+
+async def run_backfill(channel, checkpoint, on_progress):
+    """
+    Pages through channel history oldest first from the checkpoint cursor (or checkpoint["since"]), storing
+    check-in messages and checkpointing after every page, so an interrupted backfill resumes where it stopped.
+    on_progress(text) is awaited after each page.
+    """
+    checkpoint["status"] = "running"
+    backfill_channels_running.add(channel.id)
+    try:
+        while True:
+            if checkpoint["cursor_message_id"]:
+                after = discord.Object(id=checkpoint["cursor_message_id"])
+            else:
+                after = checkpoint["since"]
+            rows = []
+            page_count, page_cursor = 0, checkpoint["cursor_message_id"]
+            async for message in channel.history(limit=BACKFILL_PAGE_SIZE, after=after, oldest_first=True):
+                page_count += 1
+                page_cursor = message.id
+                checkin_text = parse_checkin_message(message)
+                if checkin_text is None:
+                    continue
+                attachments = [
+                    {"id": attachment.id, "url": attachment.url, "filename": attachment.filename,
+                     "content_type": attachment.content_type, "size": attachment.size}
+                    for attachment in message.attachments
+                ]
+                rows.append((message.id, channel.guild.id, channel.id, message.author.id,
+                             message.author.display_name[:255], message.created_at.isoformat(), checkin_text,
+                             json.dumps(attachments)))
+            # The cursor only moves together with the page's rows, so a cancelled page is scanned again on resume
+            checkpoint["cursor_message_id"] = page_cursor
+            checkpoint["scanned"] += page_count
+            if page_count < BACKFILL_PAGE_SIZE:
+                checkpoint["status"] = "done"
+            stored = await save_backfill_page(checkpoint, rows)
+            if stored is None:
+                raise RuntimeError("could not save backfilled check-ins to the database")
+            if stored:
+                # Archived summaries of these days predate the new rows; a day either side covers any guild timezone
+                created_days = [datetime.fromisoformat(row[5]).date() for row in rows]
+                await invalidate_archived_summaries(channel.guild.id, channel.id, min(created_days) - timedelta(days=1),
+                                                    max(created_days) + timedelta(days=1))
+
+            last_seen = discord.utils.snowflake_time(checkpoint["cursor_message_id"]).strftime('%Y-%m-%d') \
+                if checkpoint["cursor_message_id"] else "start"
+            await on_progress(f"scanned {checkpoint['scanned']} message(s), stored {checkpoint['stored']} "
+                              f"check-in(s), up to {last_seen}")
+            if checkpoint["status"] == "done":
+                break
+            await asyncio.sleep(BACKFILL_PAGE_DELAY_SECONDS)
+    except asyncio.CancelledError:
+        checkpoint["status"] = "cancelled"
+        await save_backfill_page(checkpoint, [])
+        raise
+    finally:
+        backfill_channels_running.discard(channel.id)
+        # The search index for this channel is rebuilt from the store on next use
+        checkin_search_index.pop((channel.guild.id, channel.id), None)
+    print(f"INFO: Backfill finished for channel {channel.id} in guild {channel.guild.id}: "
+          f"{checkpoint['scanned']} scanned, {checkpoint['stored']} stored.")
+
+
+async def resume_backfills():
+    """Restarts, in the background, backfills that were interrupted by a crash or restart."""
+    for checkpoint in await load_running_backfills():
+        channel = bot.get_channel(checkpoint["channel_id"])
+        if channel is None or channel.id in backfill_channels_running:
+            continue  # on_ready also fires on reconnects, when the backfill is still running
+        print(f"INFO: Resuming backfill for channel {channel.id} in guild {channel.guild.id}.")
+
+        async def log_progress(text, channel_id=channel.id):
+            print(f"DEBUG: Backfill for channel {channel_id}: {text}")
+
+        resume_task = asyncio.create_task(run_backfill(channel, checkpoint, log_progress))
+        background_summary_tasks.add(resume_task)
+        resume_task.add_done_callback(background_summary_tasks.discard)
+
+
+@bot.command()
+async def backfill(ctx, *, since: str = None):
+    """
+    Admin: stores historical `c.c` check-ins of this channel so sum/topic/export can use them.
+    Without an argument it continues the previous backfill (or starts from the beginning of the channel);
+    with a date (MM-DD or YYYY-MM-DD) it starts over from that date. Runs as a background job.
+    """
+    if not await is_admin(ctx):
+        await ctx.send(f"{ctx.author.mention}, this command is only accessible to admins.")
+        return
+    if ctx.channel.id in backfill_channels_running or \
+            any(job["kind"] == "backfill" and job["channel_id"] == ctx.channel.id for job in jobs.values()):
+        await ctx.send("A backfill is already queued or running for this channel.")
+        return
+
+    checkpoint = None
+    if since:
+        guild_tz = ctx.guild_tz
+        since_date = parse_date_argument(since, guild_tz)
+        if since_date is None:
+            await ctx.send(f"Could not understand the date '{since}'. Please use `MM-DD` or `YYYY-MM-DD`.")
+            return
+        since_utc = guild_tz.localize(datetime.combine(since_date, time.min)).astimezone(pytz.utc)
+    else:
+        checkpoint = await load_backfill_checkpoint(ctx.guild.id, ctx.channel.id)
+        since_utc = checkpoint["since"] if checkpoint else None
+    if checkpoint is None:
+        checkpoint = {"guild_id": ctx.guild.id, "channel_id": ctx.channel.id, "since": since_utc,
+                      "cursor_message_id": None, "scanned": 0, "stored": 0, "status": "running"}
+
+    async def run(job):
+        async def on_progress(text):
+            await report_job_progress(job, text)
+        await run_backfill(ctx.channel, checkpoint, on_progress)
+
+    await submit_job(ctx, "backfill", run, pool="maintenance", show_status=True)
+
+
+
+
+# --- Exports of leaderboards and history as compressed CSV/JSONL attachments ---
+EXPORT_FETCH_SIZE = 2000  # Rows per round trip of the server-side cursor
+EXPORT_PART_MARGIN_BYTES = 512 * 1024  # Room for data still buffered in the compressor when a part is checked
+EXPORT_COLUMNS = {
+    "wl": ["user_id", "name", "checkins"],
+    "ll": ["user_id", "name", "missed_checkins"],
+    "history": ["date", "user_id", "name", "status"],
+}
+
+
+def build_export_query(board, guild_id, channel_id, start_date, end_date):
+    """Returns (sql, params) for an export. wl/ll without dates read the live leaderboard, otherwise the snapshots."""
+    if board in ("wl", "ll") and start_date is None and end_date is None:
+        table = LEADERBOARD_MISSED_TABLE if board == "ll" else LEADERBOARD_CHECKIN_TABLE
+        return (f"SELECT user_id, user_name, count FROM {table} "
+                f"WHERE guild_id = %s AND channel_id = %s ORDER BY count DESC, user_id",
+                (guild_id, channel_id))
+    date_filter = ("s.guild_id = %s AND s.channel_id = %s AND (%s::date IS NULL OR s.snapshot_date >= %s::date) "
+                   "AND (%s::date IS NULL OR s.snapshot_date <= %s::date)")
+    params = (guild_id, channel_id, start_date, start_date, end_date, end_date)
+    if board in ("wl", "ll"):
+        id_column = "missed_ids" if board == "ll" else "checked_ids"
+        return (f"SELECT uid, NULL, COUNT(*) FROM {DAILY_SNAPSHOT_TABLE} s, unnest(s.{id_column}) AS uid "
+                f"WHERE {date_filter} GROUP BY uid ORDER BY COUNT(*) DESC, uid", params)
+    return (f"SELECT s.snapshot_date, uid, NULL, 'checked_in' FROM {DAILY_SNAPSHOT_TABLE} s, unnest(s.checked_ids) AS uid "
+            f"WHERE {date_filter} "
+            f"UNION ALL "
+            f"SELECT s.snapshot_date, uid, NULL, 'missed' FROM {DAILY_SNAPSHOT_TABLE} s, unnest(s.missed_ids) AS uid "
+            f"WHERE {date_filter} ORDER BY 1, 4, 2", params + params)
+
+
+def remove_export_parts(paths):
+    """Deletes export part files, ignoring ones that are already gone."""
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def write_export_parts(sql, params, columns, export_format, names, max_part_bytes, on_rows, stop_event):
+    """
+    Streams an export query through a named (server-side) cursor into gzip-compressed temp files, starting a new
+    part once one nears max_part_bytes, so memory use stays at one fetch of rows. Every CSV part repeats the header,
+    so parts open independently. Names the query leaves empty come from `names` ({user_id str: name}).
+    Runs in a worker thread; on_rows(row_count) is called after each fetch, and setting stop_event stops it after
+    the current fetch. Returns (part paths, row count); on an error or a stop, the parts written so far are deleted.
+    """
+    name_index, user_index = columns.index("name"), columns.index("user_id")
+    paths, row_count = [], 0
+    part_file, part_text, part_writer = None, None, None
+
+    def close_part():
+        part_text.close()  # Flushes the compressor; the underlying temp file stays open
+        part_file.close()
+
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError("could not connect to the database")
+    try:
+        cur = conn.cursor(name="checkin_export")
+        cur.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(EXPORT_FETCH_SIZE)
+            if stop_event.is_set():
+                raise RuntimeError("export was cancelled")
+            if not rows:
+                break
+            for row in rows:
+                row = list(row)
+                if row[name_index] is None:
+                    row[name_index] = names.get(str(row[user_index]), "")
+                if part_file is None or part_file.tell() >= max_part_bytes - EXPORT_PART_MARGIN_BYTES:
+                    if part_file is not None:
+                        close_part()
+                    part_file = tempfile.NamedTemporaryFile(suffix=f".{export_format}.gz", delete=False)
+                    paths.append(part_file.name)
+                    part_text = gzip.open(part_file, "wt", encoding="utf-8", newline="")
+                    part_writer = csv.writer(part_text) if export_format == "csv" else None
+                    if part_writer:
+                        part_writer.writerow(columns)
+                if part_writer:
+                    part_writer.writerow(row)
+                else:
+                    row[user_index] = str(row[user_index])  # Snowflakes exceed the integer precision of JSON readers
+                    part_text.write(json.dumps(dict(zip(columns, row)), default=str) + "\n")
+                row_count += 1
+            on_rows(row_count)
+        cur.close()
+    except BaseException:
+        if part_file is not None:
+            close_part()
+            part_file = None
+        remove_export_parts(paths)
+        raise
+    finally:
+        if part_file is not None:
+            close_part()
+        conn.close()
+    return paths, row_count
+
+
+@bot.command()
+async def export(ctx, board: str = "history", *args):
+    """
+    Admin: exports this channel's data as a gzip-compressed CSV (default) or JSONL attachment.
+    `c.export wl|ll` exports the current leaderboard; with dates, counts from the recorded history.
+    `c.export history [MM-DD [MM-DD]] [csv|jsonl]` exports who checked in or missed on each recorded day.
+    Large exports are split into several files to fit the upload limit. Runs as a background job.
+    """
+    if not await is_admin(ctx):
+        await ctx.send(f"{ctx.author.mention}, this command is only accessible to admins.")
+        return
+    board = board.lower()
+    if board not in EXPORT_COLUMNS:
+        await ctx.send("Usage: `c.export [wl|ll|history] [MM-DD [MM-DD]] [csv|jsonl]`")
+        return
+
+    export_format, dates = "csv", []
+    guild_tz = ctx.guild_tz
+    for arg in args:
+        if arg.lower() in ("csv", "jsonl"):
+            export_format = arg.lower()
+            continue
+        parsed_date = parse_date_argument(arg, guild_tz)
+        if parsed_date is None or len(dates) == 2:
+            await ctx.send(f"Could not understand '{arg}'. Usage: `c.export [wl|ll|history] [MM-DD [MM-DD]] [csv|jsonl]`")
+            return
+        dates.append(parsed_date)
+    start_date = dates[0] if dates else None
+    end_date = dates[1] if len(dates) == 2 else (datetime.now(guild_tz).date() if dates else None)
+
+    data = ctx.channel_data
+    names = dict(data.get("userToReal", {}))
+    columns = EXPORT_COLUMNS[board]
+    sql, params = build_export_query(board, ctx.guild.id, ctx.channel.id, start_date, end_date)
+    range_label = f"_{start_date}_{end_date}" if start_date else ""
+    base_name = f"{ctx.channel.name}_{board}{range_label}"
+
+    async def run(job):
+        loop = asyncio.get_running_loop()
+
+        def on_rows(row_count):
+            loop.call_soon_threadsafe(job.__setitem__, "progress", f"{row_count} row(s) exported")
+
+        def remove_abandoned_parts(worker):
+            if not worker.cancelled() and worker.exception() is None:
+                remove_export_parts(worker.result()[0])
+
+        stop_event = threading.Event()
+        worker = asyncio.ensure_future(asyncio.to_thread(write_export_parts, sql, params, columns, export_format,
+                                                         names, ctx.guild.filesize_limit, on_rows, stop_event))
+        try:
+            # Shielded so the thread's outcome is still observed after a cancel: it stops at its next fetch
+            # and deletes its parts, or, if it had just finished, remove_abandoned_parts deletes them
+            paths, row_count = await asyncio.shield(worker)
+        except asyncio.CancelledError:
+            stop_event.set()
+            worker.add_done_callback(remove_abandoned_parts)
+            raise
+        try:
+            if not row_count:
+                await ctx.send(f"There is no recorded data to export for `{board}` in #{ctx.channel.name}.")
+            for index, path in enumerate(paths, start=1):
+                suffix = f"_part{index}of{len(paths)}" if len(paths) > 1 else ""
+                await report_job_progress(job, f"uploading file {index} of {len(paths)}")
+                await ctx.send(f"Export of `{board}` for #{ctx.channel.name} ({row_count} rows)"
+                               + (f", file {index} of {len(paths)}" if len(paths) > 1 else ""),
+                               file=discord.File(path, filename=f"{base_name}{suffix}.{export_format}.gz"))
+        finally:
+            remove_export_parts(paths)
+        await report_job_progress(job, f"{row_count} row(s) in {len(paths)} file(s)")
+
+    await submit_job(ctx, "export", run, pool="maintenance", show_status=True)
+
+
+
+
+# In-memory BM25 index over stored check-in text, used to preselect topic candidates
+# Structure: {(guild_id, channel_id): {"since": datetime, "docs": {message_id: (created_at, length)},
+#                                      "postings": {term: {message_id: term_frequency}}}}
+checkin_search_index = {}
+CHECKIN_INDEX_RETENTION_DAYS = 30
+BM25_K1 = 1.2
+BM25_B = 0.75
+TOPIC_MAX_CANDIDATES = 40
+SEARCH_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "i", "in", "is", "it", "my", "of", "on",
+    "or", "so", "that", "the", "this", "to", "was", "we", "with", "today", "did", "do", "have", "has",
+}
+
+
+def tokenize_for_search(text):
+    """Lowercases, splits on non-alphanumerics, drops stopwords and strips simple plurals."""
+    terms = []
+    for term in re.findall(r"[a-z0-9]+", (text or "").lower()):
+        if len(term) < 2 or term in SEARCH_STOPWORDS:
+            continue
+        if len(term) > 4 and term.endswith("ies"):
+            term = term[:-3] + "y"
+        elif len(term) > 3 and term.endswith("s") and not term.endswith("ss"):
+            term = term[:-1]
+        terms.append(term)
+    return terms
+
+
+def add_to_checkin_index(index, message_id, created_at, text):
+    """Adds one check-in's text to a channel index; re-adding a message id is a no-op."""
+    if message_id in index["docs"]:
+        return
+    terms = tokenize_for_search(text)
+    index["docs"][message_id] = (created_at, len(terms))
+    for term in terms:
+        postings = index["postings"].setdefault(term, {})
+        postings[message_id] = postings.get(message_id, 0) + 1
+
+
+def prune_checkin_index(index, cutoff):
+    """Drops check-ins created before cutoff from a channel index."""
+    expired = {message_id for message_id, (created_at, _) in index["docs"].items() if created_at < cutoff}
+    if not expired:
+        return
+    for message_id in expired:
+        del index["docs"][message_id]
+    for term in list(index["postings"]):
+        postings = index["postings"][term]
+        for message_id in expired & postings.keys():
+            del postings[message_id]
+        if not postings:
+            del index["postings"][term]
+    index["since"] = max(index["since"], cutoff)
+
+
+def index_checkin_message(guild_id, channel_id, message, checkin_text):
+    """Adds a just-accepted check-in to its channel's index, if that index has been built."""
+    index = checkin_search_index.get((guild_id, channel_id))
+    if index is not None:
+        add_to_checkin_index(index, message.id, message.created_at, checkin_text)
+
+
+async def get_checkin_index(guild_id, channel_id, start_time_utc):
+    """
+    Returns the channel's search index, (re)building it from the stored check-ins if it does not
+    cover start_time_utc yet. Returns None if the check-ins cannot be loaded.
+    """
+    key = (guild_id, channel_id)
+    index = checkin_search_index.get(key)
+    if index is not None:
+        prune_checkin_index(index, datetime.now(pytz.utc) - timedelta(days=CHECKIN_INDEX_RETENTION_DAYS))
+        if index["since"] <= start_time_utc:
+            return index
+
+    since = min(start_time_utc, datetime.now(pytz.utc) - timedelta(days=CHECKIN_INDEX_RETENTION_DAYS))
+    stored_checkins = await fetch_stored_checkins(guild_id, channel_id, since, datetime.now(pytz.utc))
+    if stored_checkins is None:
+        return None
+    index = {"since": since, "docs": {}, "postings": {}}
+    for checkin in stored_checkins:
+        add_to_checkin_index(index, checkin["message_id"], checkin["created_at"], checkin["content"])
+    checkin_search_index[key] = index
+    print(f"INFO: Built check-in search index for guild {guild_id}, channel {channel_id} ({len(index['docs'])} check-ins).")
+    return index
+
+
+def rank_checkins_bm25(index, query, message_ids):
+    """
+    Scores the given indexed check-ins against a query with BM25, with document frequencies and
+    average length taken over those check-ins only. Returns [(score, message_id)] with score > 0, best first.
+    """
+    candidate_ids = [message_id for message_id in message_ids if message_id in index["docs"]]
+    if not candidate_ids:
+        return []
+    candidate_set = set(candidate_ids)
+    doc_count = len(candidate_ids)
+    total_length = 0
+    for message_id in candidate_ids:
+        total_length += index["docs"][message_id][1]
+    average_length = (total_length / doc_count) or 1
+
+    scores = {}
+    for term in set(tokenize_for_search(query)):
+        postings = index["postings"].get(term, {})
+        matching = candidate_set & postings.keys()
+        if not matching:
+            continue
+        idf = np.log(1 + (doc_count - len(matching) + 0.5) / (len(matching) + 0.5))
+        for message_id in matching:
+            tf = postings[message_id]
+            length_norm = 1 - BM25_B + BM25_B * index["docs"][message_id][1] / average_length
+            scores[message_id] = scores.get(message_id, 0) + idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * length_norm)
+    return sorted(((score, message_id) for message_id, score in scores.items()), reverse=True)
+
+
+
+
+async def send_history_leaderboard(ctx, data, start_date, end_date, board, range_label):
+    """Sends a wl/ll style leaderboard built from the daily snapshot history."""
+    missed = board == "ll"
+    user_counts = await load_snapshot_counts(ctx.guild.id, ctx.channel.id, start_date, end_date, missed=missed)
+    if user_counts is None:
+        await ctx.send("Could not load check-in history from the database. Please try again later.")
+        return
+
+    unit = "missed check-in(s)" if missed else "check-in(s)"
+    lines = await format_leaderboard_lines(ctx.guild, data, user_counts, unit)
+    title = "Missed Check-ins Leaderboard" if missed else "Check-in Leaderboard"
+    embed = discord.Embed(
+        title=f"{title} for #{ctx.channel.name} ({range_label})",
+        color=discord.Color.red() if missed else discord.Color.green()
+    )
+    description = "\n".join(lines) if lines else "No recorded history for this range in this channel."
+    if len(description) > 4096:
+        description = description[:4093] + "..."
+    embed.description = description
+    await ctx.send(embed=embed)
+
+
+
+
+@bot.command()
+async def m(ctx):
+   """Displays the manual for all bot commands."""
+   await ctx.send("**Commands accessible by everyone**:"
+                  "\n`c.m` - Manual"
+                  "\n`c.c` - Post check-in (channel-specific)"
+                  "\n`c.t` - Check who sent a check-in today (channel-specific)"
+                  "\n`c.wl` - Leaderboard/Streak for checking in (channel-specific)"
+                  "\n`c.ll` - Leaderboard/Streak for NOT checking in (channel-specific)"
+                  "\n`c.cr` - Shows the current reset time for this channel and timezone for this guild"
+                  "\n`c.streak` - Shows your (or a mentioned user's) current streak, longest streak and attendance rate (channel-specific)"
+                  "\n`c.asof MM-DD [wl|ll]` - Leaderboard from recorded history up to a date (channel-specific)"
+                  "\n`c.range MM-DD MM-DD [wl|ll]` - Check-in or missed counts from recorded history between two dates (channel-specific)"
+                  "\n`c.stats [week|month|MM-DD]` - Check-in statistics for this week, this month or a single day (channel-specific)"
+                  "\n`c.insights` - Check-in distributions, miss rates, participation trend and check-in times for this channel and the guild"
+                  "\n`c.heatmap [@User|channel]` - Calendar heatmap of the last year of check-ins for you, a user or the whole channel (channel-specific)"
+                  "\n`c.jobs [cancel <id>]` - Lists queued and running background jobs (summaries, name refreshes), or cancels one of yours")
+   # Sent as two messages to stay under Discord's 2000 character limit
+   await ctx.send("**Commands only accessible by server admins**:"
+                  "\n`c.n [sync]` - Tracks certain users/changes usernames to their real names; `sync` keeps them current automatically (channel-specific)"
+                  "\n`c.a @User n [@User n ...]` - Adds/removes check-ins for one or more users (negative number to remove check-ins) (channel-specific)"
+                  "\n`c.z @User n [@User n ...]` - Adds/removes missed check-ins for one or more users (negative number to remove missed check-ins) (channel-specific)"
+                  "\n`c.r` - Sets the reset time for check-ins for this channel"
+                  "\n`c.e` - Requires evidence for check-ins (channel-specific)"
+                  "\n`c.d` - Manages banned users (ban, unban, list) (channel-specific)"
+                  "\n`c.g` - Manages server admins (guild-wide)"
+                  "\n`c.tz` - Lists all timezones available (guild-wide)"
+                  "\n`c.w` - Sets a minimum number of words required in the check-in (channel-specific)"
+                  "\n`c.lr` - Reset the leaderboard, type in 'wl' or 'll' to choose which leaderboard to reset (channel-specific)"
+                  "\n`c.rs` - Toggles keeping the since-last-reset summary updated in the background (channel-specific)"
+                  "\n`c.usage [days]` - Summarization model usage: latency/size percentiles and per-channel totals (guild-wide)"
+                  "\n`c.backfill [MM-DD]` - Stores check-ins from channel history for summaries, resuming where it left off (channel-specific)"
+                  "\n`c.export [wl|ll|history] [MM-DD [MM-DD]] [csv|jsonl]` - Exports leaderboards or history as compressed files (channel-specific)"
+                  "\n`c.import` + CSV attachment - Bulk name mappings and check-in/miss adjustments, validated and applied at once (channel-specific)")
+
+
+
+
+async def set_admin_for_guild(guild):
+   """
+   Sets the server admin for a guild. Prioritizes the inviter if available
+   from audit logs, otherwise defaults to the guild owner. This is a guild-wide setting.
+   """
+   guild_settings = await get_guild_settings(guild.id)
+
+
+   # If the server already has admins, do nothing
+   if guild_settings.get("server_admins"):  # Use .get() in case it's not initialized yet
+       print(f"INFO: Guild {guild.name} ({guild.id}) already has admins set. Skipping initial admin setup.")
+       return
+
+
+   inviter = None
+   try:
+       # Fetch audit logs to find who added the bot
+       async for entry in guild.audit_logs(action=discord.AuditLogAction.bot_add, limit=1):
+           if entry.target.id == bot.user.id:
+               inviter = entry.user
+               break
+   except discord.Forbidden:
+       print(
+           f"WARNING: Missing permissions to access audit logs in {guild.name} ({guild.id}). Cannot determine inviter.")
+
+
+   if inviter:
+       guild_settings["server_admins"].add(inviter.id)
+       print(f"INFO: Admin for {guild.name} ({guild.id}) set to inviter: {inviter.name} ({inviter.id})")
+   else:
+       # Fallback to guild owner if inviter cannot be determined
+       guild_settings["server_admins"].add(guild.owner_id)
+       print(f"INFO: Admin for {guild.name} ({guild.id}) set to owner: {guild.owner.name} ({guild.owner_id})")
+
+
+   await save_specific_data_to_db(guild.id, 0, guild_settings)  # Save guild-wide settings
+   print(f"INFO: Current admins for {guild.name}: {guild_settings['server_admins']}")
+
+
+
+
+@bot.event
+async def on_guild_join(guild):
+   """Event handler for when the bot joins a new server."""
+   print(f"INFO: Joined new guild: {guild.name} ({guild.id})")
+   await set_admin_for_guild(guild)
+
+
+
+
+@bot.command()
+async def g(ctx, action: str = None, member: discord.Member = None): # Make action optional
+   """
+   Manages server administrators: add, remove, or list.
+   Only existing admins (or guild owner) can use this command. This is a guild-wide setting.
+   """
+   guild_id = ctx.guild.id
+   guild_settings = ctx.guild_settings
+
+
+   if not await is_admin(ctx):  # Check if the author is an admin or owner
+       await ctx.send(f"{ctx.author.mention}, this command is only accessible to server admins.")
+       return
+
+
+   if action is None: # New check for no arguments
+       await ctx.send("Please specify an action. Usage: "
+                      "`c.g add @User` to add a server admin, "
+                      "`c.g remove @User` to remove a server admin, or "
+                      "`c.g list` to view current server admins.")
+       return
+
+
+   action = action.lower()
+
+
+   if action == "add" and member:
+       if member.id in guild_settings["server_admins"]:
+           await ctx.send(f"{member.mention} is already a server admin.")
+       else:
+           guild_settings["server_admins"].add(member.id)
+           await ctx.send(f"{member.mention} has been added as a server admin.")
+           await save_specific_data_to_db(guild_id, 0, guild_settings)  # Save changes
+           print(f"INFO: {member.display_name} ({member.id}) added as admin for guild {guild_id}.")
+   elif action == "remove" and member:
+       if member.id == ctx.guild.owner_id:
+           await ctx.send(f"{member.mention}, the guild owner cannot be removed from admin status.")
+       elif member.id in guild_settings["server_admins"]:
+           guild_settings["server_admins"].remove(member.id)
+           await ctx.send(f"{member.mention} has been removed as a server admin.")
+           await save_specific_data_to_db(guild_id, 0, guild_settings)  # Save changes
+           print(f"INFO: {member.display_name} ({member.id}) removed from admins for guild {guild_id}.")
+       else:
+           await ctx.send(f"{member.mention} is not currently a server admin.")
+   elif action == "list":
+       admin_list = []
+       for admin_id in guild_settings["server_admins"]:
+           try:
+               admin_user = await bot.fetch_user(admin_id)
+               admin_list.append(f"{admin_user.display_name} (<@{admin_id}>)")
+           except (discord.NotFound, discord.HTTPException):
+               admin_list.append(f"Unknown User (<@{admin_id}>)")
+       admins = "\n".join(admin_list) if admin_list else "No admins assigned."
+       await ctx.send(f"**Server Admins:**\n{admins}")
+   else: # This 'else' block will now only be hit if action is provided but is invalid (e.g., c.g invalid_action)
+       await ctx.send("Invalid command. Usage: "
+                      "`c.g add @User`, `c.g remove @User`, or `c.g list`.")
+
+
+
+
+@bot.command()
+async def c(ctx, *checkIn):
+    """Check-in command for users. Handles check-ins and saves to Postgres immediately."""
+    data = ctx.channel_data
+    guild_id = ctx.guild.id
+    channel_id = ctx.channel.id
+    user_id = ctx.author.id
+
+
+    # If banned
+    if user_id in data.get("banned_users", set()):
+        await ctx.send(f"{ctx.author.mention}, you are banned from checking in.")
+        return
+
+    # Ensure 'dailyCheckedUsers' is a list and 'users' is a dict, defensively
+    if not isinstance(data.get("dailyCheckedUsers"), list):
+        data["dailyCheckedUsers"] = []
+    if not isinstance(data.get("users"), dict):
+        data["users"] = {}
+
+    # If already checked in today
+    if user_id in data["dailyCheckedUsers"]:
+        await ctx.send(f"{ctx.author.mention}, you've already checked in today in this channel!")
+        return
+
+    # If require_media is set, check for attachments or links
+    if data.get("require_media", False):
+        has_attachment = bool(ctx.message.attachments)
+        has_link = "http://" in ctx.message.content or "https://" in ctx.message.content
+
+        if not (has_attachment or has_link):
+            await ctx.send(f"{ctx.author.mention}, you must attach an image/file or include a link in your check-in.")
+            return
+
+    # Minimum word count
+    word_min = data.get("word_min", 1)
+    if word_min > 1:
+        checkInText = " ".join(checkIn)
+        if len(checkInText.split()) < word_min:
+            await ctx.send(f"{ctx.author.mention}, your check-in must be at least {word_min} words.")
+            return
+
+    # Add user to today's check-ins and increment total
+    data["dailyCheckedUsers"].append(user_id)
+    data["users"][user_id] = data["users"].get(user_id, 0) + 1
+
+    # Save immediately
+    await save_specific_data_to_db(guild_id, channel_id, data)
+    print(f"INFO: User {user_id} checked in to channel {channel_id} in guild {guild_id}.")
+
+    now_guild_tz = datetime.now(ctx.guild_tz)
+
+    # Track last check-in timestamps
+    data.setdefault("last_checkins", {})
+    data["last_checkins"][str(user_id)] = now_guild_tz.astimezone(pytz.utc)
+
+    # Save again to update last_checkins
+    await save_specific_data_to_db(guild_id, channel_id, data)
+
+    # Keep the check-in itself so sum/topic can read it without crawling channel history
+    checkin_text = checkin_text_from_message(ctx)
+    await save_checkin_message(guild_id, channel_id, ctx.message, checkin_text)
+    index_checkin_message(guild_id, channel_id, ctx.message, checkin_text)
+
+    await ctx.send(f"{ctx.author.mention}, you've successfully checked in today in this channel!")
+
+
+
+
+
+@bot.command()
+async def e(ctx):
+   """Toggles the requirement for media (image/link) in check-ins. This is channel-specific."""
+   data = ctx.channel_data
+   if not await is_admin(ctx):
+       await ctx.send(f"{ctx.author.mention}, this command is only accessible to admins.")
+       return
+   data["require_media"] = not data["require_media"]
+   status = "no longer" if not data["require_media"] else "now"
+   await ctx.send(f"Check-ins in this channel **{status}** require evidence (an image or file).")
+   await save_specific_data_to_db(ctx.guild.id, ctx.channel.id, data)  # Save changes
+   print(f"INFO: Media requirement for channel {ctx.channel.id} set to {data['require_media']}.")
+
+
+
+
+@bot.command()
+async def wl(ctx):
+   """Displays the check-in leaderboard (who checked in most). This is channel-specific and aggregates by real name."""
+   data = ctx.channel_data
+
+
+   # Aggregate check-ins by real name
+   checkins_by_real_name = {}
+   for user_id, checkins in data.get("users", {}).items():
+       try:
+           user = await bot.fetch_user(user_id)
+           # Use userToReal for display names, falling back to discord display name
+           real_name = data["userToReal"].get(str(user_id), user.display_name)
+       except (discord.NotFound, discord.HTTPException):
+           real_name = f"Unknown User ({user_id})"
+       checkins_by_real_name[real_name] = checkins_by_real_name.get(real_name, 0) + checkins
+
+
+   sorted_checkins = sorted(checkins_by_real_name.items(), key=lambda x: x[1], reverse=True)
+
+
+   embed = discord.Embed(title=f"Check-in Leaderboard for #{ctx.channel.name}", color=discord.Color.green())
+   if not sorted_checkins:
+       embed.description = "No check-ins recorded yet in this channel!"
+   else:
+       embed.description = "\n".join(
+           f"{i + 1}. **{real_name}**: {checkins} check-in(s)"
+           for i, (real_name, checkins) in enumerate(sorted_checkins)
+       )
+   await ctx.send(embed=embed)
+
+
+
+
+@bot.command()
+async def ll(ctx):
+   """Displays the missed check-ins leaderboard. This is channel-specific and aggregates by real name."""
+   data = ctx.channel_data
+
+
+   # Aggregate missed check-ins by real name
+   missed_by_real_name = {}
+   for user_id, missed in data.get("missed_users", {}).items():
+       try:
+           user = await bot.fetch_user(user_id)
+           real_name = data["userToReal"].get(str(user_id), user.display_name)
+       except (discord.NotFound, discord.HTTPException):
+           real_name = f"Unknown User ({user_id})"
+       missed_by_real_name[real_name] = missed_by_real_name.get(real_name, 0) + missed
+
+
+   sorted_missed = sorted(missed_by_real_name.items(), key=lambda x: x[1], reverse=True)
+
+
+   embed = discord.Embed(
+       title=f"Missed Check-ins Leaderboard for #{ctx.channel.name}",
+       color=discord.Color.red()
+   )
+   if not sorted_missed:
+       embed.description = "No missed check-ins recorded yet in this channel!"
+   else:
+       embed.description = "\n".join(
+           f"{i + 1}. **{real_name}**: {missed} missed check-in(s)"
+           for i, (real_name, missed) in enumerate(sorted_missed)
+       )
+   await ctx.send(embed=embed)
+
+
+@bot.command()
+async def dl(ctx):
+    """Leaderboard showing the number of days since a user last checked in."""
+    channel_data = ctx.channel_data
+    if channel_data is None:
+        return await ctx.send("No data found for this channel.")
+
+    last_checkins = channel_data.get("last_checkins", {})
+    days_data = channel_data.get("days_since_last", {})
+    user_to_real = channel_data.get("userToReal", {})
+
+    leaderboard = []
+
+    tz = ctx.guild_tz
+    now_local = datetime.now(tz)
+
+    for real_id_str, user_id in user_to_real.items():
+        real_id_str = str(real_id_str)
+
+        user = ctx.guild.get_member(int(user_id))
+        if not user:
+            continue
+
+        if real_id_str in last_checkins:
+            last_time_str = last_checkins[real_id_str]
+            if isinstance(last_time_str, str):
+                try:
+                    last_time = datetime.fromisoformat(last_time_str).replace(tzinfo=pytz.UTC)
+                except:
+                    continue
+            else:
+                last_time = last_time_str
+
+            last_local = last_time.astimezone(tz)
+            day_diff = (now_local.date() - last_local.date()).days
+
+            # Respect stored data if it's higher
+            stored = days_data.get(user_id, 0)
+            day_count = max(day_diff, stored)
+
+            leaderboard.append((user.display_name, day_count))
+
+        else:
+            # Never checked in — represent as special case (None)
+            leaderboard.append((user.display_name, None))
+
+    # Sort: first by those with actual days (descending), then by Never Checked In at bottom
+    def sort_key(entry):
+        name, days = entry
+        if days is None:
+            return (-1, 0, name.lower())  # bottom
+        return (1, days, name.lower())  # top, sorted by days
+
+    leaderboard.sort(key=sort_key, reverse=True)
+
+    # Limit display
+    top_limit = min(50, len(leaderboard))
+    leaderboard = leaderboard[:top_limit]
+
+    if not leaderboard:
+        return await ctx.send("There is no data for this leaderboard yet.")
+
+    # GOLD FORMATTING
+    embed = discord.Embed(
+        title="📊 Days Since Last Check-In Leaderboard",
+        description="",
+        color=discord.Color.gold()
+    )
+
+    placement_emojis = ["🥇", "🥈", "🥉"]
+
+    for i, (name, days) in enumerate(leaderboard, start=1):
+        emoji = placement_emojis[i - 1] if i <= 3 else f"**{i}.**"
+
+        if days is None:
+            value = "Never checked in ❌"
+        else:
+            value = f"**{days}** days"
+
+        embed.description += f"{emoji} — **{name}**: {value}\n"
+
+    await ctx.send(embed=embed)
+
+
+
+
+
+
+
+
+
+@bot.command()
+async def streak(ctx, member: discord.Member = None):
+    """Shows the current streak, longest streak and attendance rate for a user. This is channel-specific."""
+    data = ctx.channel_data
+    member = member or ctx.author
+    guild_tz = ctx.guild_tz
+
+    bitmaps = await get_attendance_bitmaps(ctx.guild.id, ctx.channel.id)
+    entry = bitmaps.get(member.id)
+    real_name = data.get("userToReal", {}).get(str(member.id), member.display_name)
+
+    if not entry:
+        await ctx.send(f"No attendance history recorded yet for **{real_name}** in #{ctx.channel.name}.")
+        return
+
+    bits, periods, last_period = entry
+    last_reset_time = data.get("last_reset_time")
+    if isinstance(last_reset_time, datetime) and last_reset_time.tzinfo:
+        bits, periods = align_attendance_bits(bits, periods, last_period, last_reset_time.astimezone(guild_tz).date())
+
+    current_streak, longest_streak, attendance_rate = compute_streak_stats(bits, periods)
+
+    # Today's check-in is not in the bitmap until the next reset
+    if member.id in data.get("dailyCheckedUsers", []):
+        current_streak += 1
+        longest_streak = max(longest_streak, current_streak)
+
+    embed = discord.Embed(title=f"Check-in Streak for {real_name} in #{ctx.channel.name}", color=discord.Color.orange())
+    embed.add_field(name="Current Streak", value=f"**{current_streak}** day(s)", inline=True)
+    embed.add_field(name="Longest Streak", value=f"**{longest_streak}** day(s)", inline=True)
+    embed.add_field(name="Attendance Rate", value=f"**{attendance_rate:.0%}** of the last {periods} day(s)", inline=True)
+    await ctx.send(embed=embed)
+
+
+
+
+@bot.command()
+async def asof(ctx, date_str: str = None, board: str = "wl"):
+    """Shows the check-in (wl) or missed (ll) leaderboard as recorded up to a date. This is channel-specific."""
+    data = ctx.channel_data
+
+    if not date_str or board.lower() not in ("wl", "ll"):
+        await ctx.send("Usage: `c.asof MM-DD [wl|ll]` (e.g. `c.asof 03-15 ll`).")
+        return
+
+    as_of_date = parse_date_argument(date_str, ctx.guild_tz)
+    if not as_of_date:
+        await ctx.send(f"Could not understand the date '{date_str}'. Please use `MM-DD`.")
+        return
+
+    await send_history_leaderboard(ctx, data, None, as_of_date, board.lower(), f"as of {as_of_date.strftime('%Y-%m-%d')}")
+
+
+
+
+@bot.command(name="range")
+async def range_counts(ctx, start_str: str = None, end_str: str = None, board: str = "wl"):
+    """Shows check-in (wl) or missed (ll) counts between two dates (inclusive) from recorded history. This is channel-specific."""
+    data = ctx.channel_data
+
+    if not start_str or not end_str or board.lower() not in ("wl", "ll"):
+        await ctx.send("Usage: `c.range MM-DD MM-DD [wl|ll]` (e.g. `c.range 03-01 03-31`).")
+        return
+
+    guild_tz = ctx.guild_tz
+    start_date = parse_date_argument(start_str, guild_tz)
+    end_date = parse_date_argument(end_str, guild_tz)
+    if not start_date or not end_date:
+        await ctx.send(f"Could not understand the dates '{start_str}' and '{end_str}'. Please use `MM-DD`.")
+        return
+    if start_date > end_date:
+        start_date, end_date = end_date, start_date
+
+    await send_history_leaderboard(ctx, data, start_date, end_date, board.lower(),
+                                   f"{start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}")
+
+
+
+
+@bot.command()
+async def stats(ctx, *, period_str: str = "week"):
+    """
+    Shows check-in statistics for the current week, the current month or a single day (MM-DD),
+    read from the pre-aggregated rollups. This is channel-specific.
+    """
+    data = ctx.channel_data
+    guild_tz = ctx.guild_tz
+    today_local = datetime.now(guild_tz).date()
+
+    period_str = period_str.strip().lower()
+    if period_str in ("week", "1week", "7d", "7days"):
+        granularity = "week"
+        period_start = rollup_period_start(today_local, "week")
+        range_label = f"week of {period_start.strftime('%Y-%m-%d')}"
+    elif period_str in ("month", "1month", "30d", "30days"):
+        granularity = "month"
+        period_start = rollup_period_start(today_local, "month")
+        range_label = period_start.strftime("%B %Y")
+    else:
+        granularity = "day"
+        period_start = parse_date_argument(period_str, guild_tz)
+        if not period_start:
+            await ctx.send(f"Could not understand '{period_str}'. Usage: `c.stats [week|month|MM-DD]`.")
+            return
+        range_label = period_start.strftime("%Y-%m-%d")
+
+    rows = await load_period_stats(ctx.guild.id, ctx.channel.id, granularity, period_start)
+    if rows is None:
+        await ctx.send("Could not load statistics from the database. Please try again later.")
+        return
+
+    embed = discord.Embed(title=f"Check-in Stats for #{ctx.channel.name} ({range_label})", color=discord.Color.teal())
+    if not rows:
+        embed.description = "No recorded resets for this period yet. Stats update at each daily reset."
+        await ctx.send(embed=embed)
+        return
+
+    total_checkins = 0
+    total_misses = 0
+    checkin_counts = {}
+    miss_counts = {}
+    for user_id, checkins, misses in rows:
+        total_checkins += checkins
+        total_misses += misses
+        if checkins:
+            checkin_counts[user_id] = checkin_counts.get(user_id, 0) + checkins
+        if misses:
+            miss_counts[user_id] = miss_counts.get(user_id, 0) + misses
+
+    participation = total_checkins / (total_checkins + total_misses) if total_checkins + total_misses else 0.0
+    embed.description = (f"**{total_checkins}** check-in(s), **{total_misses}** missed, "
+                         f"**{participation:.0%}** participation across {len(checkin_counts.keys() | miss_counts.keys())} user(s).")
+
+    top_checkins = await format_leaderboard_lines(ctx.guild, data, checkin_counts.items(), "check-in(s)")
+    top_misses = await format_leaderboard_lines(ctx.guild, data, miss_counts.items(), "missed")
+    embed.add_field(name="Most Check-ins", value="\n".join(top_checkins[:10]) or "None", inline=False)
+    embed.add_field(name="Most Missed", value="\n".join(top_misses[:10]) or "None", inline=False)
+    embed.set_footer(text="Stats update at each daily reset.")
+    await ctx.send(embed=embed)
+
+
+
+
+INSIGHTS_TREND_DAYS = 14
+
+
+@bot.command()
+async def insights(ctx):
+    """
+    Shows per-channel and guild-wide check-in distributions: count percentiles, miss rates,
+    the participation trend over the last two weeks and a time-of-day histogram of last check-ins.
+    """
+    guild_tz = ctx.guild_tz
+    now_local = datetime.now(guild_tz)
+    trend_start_date = now_local.date() - timedelta(days=INSIGHTS_TREND_DAYS)
+
+    await ctx.typing()
+    loaded = await load_guild_insight_data(ctx.guild.id, trend_start_date)
+    if loaded is None:
+        await ctx.send("Could not load insight data from the database. Please try again later.")
+        return
+    leaderboard_rows, snapshot_rows = loaded
+
+    # Last check-in timestamps are kept per channel as datetimes or ISO strings
+    checkin_epochs = []
+    for channel_id, channel_data in guild_channel_data_cache.get(ctx.guild.id, {}).items():
+        if channel_id == 0:
+            continue
+        for value in channel_data.get("last_checkins", {}).values():
+            try:
+                timestamp = value if isinstance(value, datetime) else datetime.fromisoformat(value)
+            except (TypeError, ValueError):
+                continue
+            if timestamp.tzinfo is None:
+                timestamp = timestamp.replace(tzinfo=pytz.utc)
+            checkin_epochs.append(int(timestamp.timestamp()))
+
+    result = await asyncio.to_thread(compute_insights, leaderboard_rows, snapshot_rows, checkin_epochs,
+                                     int(now_local.utcoffset().total_seconds()), trend_start_date)
+
+    embed = discord.Embed(title=f"Check-in Insights for {ctx.guild.name}", color=discord.Color.dark_teal())
+    if result["guild"] is None:
+        embed.description = "No check-in data recorded in this guild yet."
+        await ctx.send(embed=embed)
+        return
+
+    channel_stats = result["channels"].get(ctx.channel.id)
+    embed.add_field(name=f"#{ctx.channel.name}",
+                    value=format_distribution(channel_stats) if channel_stats else "No check-in data for this channel.",
+                    inline=False)
+    embed.add_field(name="Guild-wide", value=format_distribution(result["guild"]), inline=False)
+
+    busiest_channels = sorted(result["channels"].items(), key=lambda item: item[1]["users"], reverse=True)
+    other_lines = []
+    for channel_id, stats in busiest_channels:
+        if channel_id == ctx.channel.id:
+            continue
+        if len(other_lines) == 5:
+            break
+        other_lines.append(f"<#{channel_id}>: {stats['users']} users, median **{stats['percentiles'][1]:.0f}** "
+                           f"check-ins, median miss rate **{stats['median_miss_rate']:.0%}**")
+    if other_lines:
+        embed.add_field(name="Other Channels", value="\n".join(other_lines), inline=False)
+
+    if result["trend"]:
+        direction = "rising" if result["trend_slope"] > 0.005 else "falling" if result["trend_slope"] < -0.005 else "flat"
+        trend_line = " ".join(f"{rate:.0%}" for _, rate in result["trend"][-INSIGHTS_TREND_DAYS:])
+        embed.add_field(name=f"Participation Trend (last {INSIGHTS_TREND_DAYS} days, {direction})",
+                        value=trend_line, inline=False)
+
+    hours = result["hours"]
+    peak = max(hours)
+    if peak:
+        histogram = "\n".join(f"{hour:02}:00 {'█' * round(10 * count / peak)} {count}"
+                              for hour, count in enumerate(hours) if count)
+        embed.add_field(name=f"Last Check-in Time of Day ({guild_tz.zone})", value=f"```{histogram}```", inline=False)
+
+    await ctx.send(embed=embed)
+
+
+
+
+@bot.command()
+async def heatmap(ctx, target: str = None):
+    """
+    Renders a calendar heatmap of the last year of check-ins for the author, a mentioned user,
+    or the whole channel ('channel'). This is channel-specific.
+    """
+    data = ctx.channel_data
+    guild_tz = ctx.guild_tz
+
+    member = None
+    if target is None:
+        member = ctx.author
+    elif target.lower() != "channel":
+        if target.startswith('<@') and target.endswith('>'):
+            try:
+                member = ctx.guild.get_member(int(target.strip('<@!>')))
+            except ValueError:
+                pass
+        elif target.isdigit():
+            member = ctx.guild.get_member(int(target))
+        if not member:
+            await ctx.send("Usage: `c.heatmap`, `c.heatmap @User` or `c.heatmap channel`.")
+            return
+
+    # History only changes at reset, so the last reset date identifies the period
+    last_reset_time = data.get("last_reset_time")
+    if isinstance(last_reset_time, datetime) and last_reset_time.tzinfo:
+        end_date = last_reset_time.astimezone(guild_tz).date()
+    else:
+        end_date = datetime.now(guild_tz).date()
+
+    cache_key = (ctx.guild.id, ctx.channel.id, member.id if member else 0, end_date)
+    png_bytes = heatmap_cache.get(cache_key)
+
+    if png_bytes is None:
+        day_values = {}
+        if member:
+            real_name = data.get("userToReal", {}).get(str(member.id), member.display_name)
+            title = f"Check-ins for {real_name} in #{ctx.channel.name} - last {HEATMAP_WEEKS} weeks"
+            bitmaps = await get_attendance_bitmaps(ctx.guild.id, ctx.channel.id)
+            entry = bitmaps.get(member.id)
+            if entry:
+                bits, periods = align_attendance_bits(entry[0], entry[1], entry[2], end_date)
+                for i in range(periods):
+                    day_values[end_date - timedelta(days=i)] = (bits >> i) & 1
+        else:
+            title = f"Check-in participation in #{ctx.channel.name} - last {HEATMAP_WEEKS} weeks"
+            rows = await load_snapshot_daily_counts(ctx.guild.id, ctx.channel.id,
+                                                    end_date - timedelta(weeks=HEATMAP_WEEKS), end_date)
+            if rows is None:
+                await ctx.send("Could not load check-in history from the database. Please try again later.")
+                return
+            for snapshot_date, checked_count, missed_count in rows:
+                if checked_count + missed_count:
+                    day_values[snapshot_date] = checked_count / (checked_count + missed_count)
+
+        if not day_values:
+            await ctx.send("No attendance history recorded yet. The heatmap fills in at each daily reset.")
+            return
+
+        # Rendering is CPU-bound, keep it off the event loop
+        png_bytes = await asyncio.to_thread(render_heatmap_png, day_values, end_date, title)
+        heatmap_cache[cache_key] = png_bytes
+        while len(heatmap_cache) > HEATMAP_CACHE_MAX_ENTRIES:
+            heatmap_cache.pop(next(iter(heatmap_cache)))
+
+    await ctx.send(file=discord.File(BytesIO(png_bytes), filename="heatmap.png"))
+
+
+
+
+@bot.command()
+async def t(ctx):
+   """Checks who has sent a check-in today and who hasn't. This is channel-specific."""
+   data = ctx.channel_data
+
+
+   checked_users_names = []
+   for user_id in data.get("dailyCheckedUsers", []):
+       try:
+           user = await bot.fetch_user(user_id)
+           real_name = data["userToReal"].get(str(user_id), user.display_name)
+           checked_users_names.append(real_name)
+       except (discord.NotFound, discord.HTTPException):
+           checked_users_names.append(f"Unknown User ({user_id})")
+   checked_users_list_str = "\n".join(
+       checked_users_names) if checked_users_names else "No users checked in today in this channel."
+
+
+   unchecked_users_names = []
+   # Fetch current members from the guild, exclude bots and banned users
+   all_members_in_channel = [m for m in ctx.guild.members if not m.bot and m.id not in data.get("banned_users", set())]
+
+
+   for member in all_members_in_channel:
+       if member.id not in data.get("dailyCheckedUsers", []):
+           try:
+               user_name = data["userToReal"].get(str(member.id), member.display_name)
+           except (discord.NotFound, discord.HTTPException):
+               user_name = f"Unknown User ({member.id})"
+           unchecked_users_names.append(user_name)
+   unchecked_list_str = "\n".join(
+       unchecked_users_names) if unchecked_users_names else "Everyone checked in today in this channel!"
+
+
+   await ctx.send(f"**Users who checked in today in #{ctx.channel.name}:**\n{checked_users_list_str}"
+                  f"\n\n**Users who have yet to check-in today in #{ctx.channel.name}:**\n{unchecked_list_str}")
+
+
+
+
+@bot.command()
+async def n(ctx, *, realNames=None):
+   """
+   Tracks users and allows mapping Discord user IDs to real names.
+   If no arguments, it tracks all current non-banned members. `c.n sync` toggles keeping
+   auto-mapped names in step with display name changes and new members. This is channel-specific.
+   Prioritizes user IDs for robust mapping.
+   """
+   data = ctx.channel_data
+   if not await is_admin(ctx):
+       await ctx.send(f"{ctx.author.mention}, this command is only accessible to admins.")
+       return
+
+
+   if realNames and realNames.strip().lower() == "sync":
+       await toggle_name_sync(ctx, data)
+       return
+
+
+   if realNames:
+       pairs = [pair.strip() for pair in realNames.split(",")]
+       for pair in pairs:
+           try:
+               parts = pair.split(":")
+               if len(parts) != 2:
+                   await ctx.send(f"Invalid format for '{pair}'. Use 'UserID:RealName' or '@Mention:RealName' format.")
+                   return
+
+
+               identifier, real_name = parts[0].strip(), parts[1].strip()
+               target_user_id = None
+
+
+               if identifier.startswith('<@') and identifier.endswith('>'):
+                   try:
+                       target_user_id = int(identifier.strip('<@!>'))
+                   except ValueError:
+                       pass  # Not a valid mention ID
+               elif identifier.isdigit():
+                   target_user_id = int(identifier)
+               else:
+                   # If not a mention or ID, try to find by exact display name (less reliable)
+                   member = discord.utils.get(ctx.guild.members, display_name=identifier)
+                   if member:
+                       target_user_id = member.id
+
+
+               if target_user_id:
+                   # Check for existing real name mapping to a different user
+                   # This helps prevent accidental overwrites or confusion
+                   for existing_user_id_str, existing_real_name in list(
+                           data["realPeople"].items()):  # Use list() to iterate over a copy
+                       if existing_real_name == real_name and int(existing_user_id_str) != target_user_id:
+                           # Warn but still allow the mapping
+                           await ctx.send(
+                               f"Warning: The real name '{real_name}' is already mapped to <@{existing_user_id_str}>. "
+                               f"Mapping <@{target_user_id}> to '{real_name}' will allow both to use this name in leaderboards. "
+                               f"Consider using a unique real name for each user if you want distinct leaderboard entries.")
+                           break
+
+
+                   data["userToReal"][str(target_user_id)] = real_name
+                   data["realPeople"][str(target_user_id)] = real_name  # Store by ID for consistency
+                   print(f"INFO: Mapped {target_user_id} to '{real_name}' in channel {ctx.channel.id}.")
+               else:
+                   await ctx.send(
+                       f"Could not find user for identifier '{identifier}'. Please use a mention, user ID, or exact Discord display name.")
+                   return
+
+
+           except ValueError:
+               await ctx.send(f"Invalid format for '{pair}'. Use 'UserID:RealName' or '@Mention:RealName' format.")
+               return
+   else:
+       # If no arguments, track all current non-bot, non-banned members in this channel's context
+       # This runs as a background job, since it walks every member of the guild
+       await submit_job(ctx, "n", lambda job: refresh_real_names(ctx, job), pool="maintenance", show_status=True)
+       return
+
+
+   user_mappings = "\n".join([f"<@{user_id}> -> {real_name}" for user_id, real_name in data["realPeople"].items()])
+   await ctx.send(f"User IDs mapped to real names in #{ctx.channel.name}:\n{user_mappings}")
+   await save_specific_data_to_db(ctx.guild.id, ctx.channel.id, data)  # Save changes
+
+
+
+
+async def refresh_real_names(ctx, job):
+    """
+    Body of `c.n` without arguments, run as a job: maps every non-bot, non-banned member to their
+    current display name, replacing the channel's mappings, then lists them.
+    """
+    data = ctx.channel_data
+    members = [member for member in ctx.guild.members if not member.bot and member.id not in data["banned_users"]]
+    user_to_real = {}
+    for index, member in enumerate(members, start=1):
+        user_to_real[str(member.id)] = member.display_name
+        if index % 200 == 0:
+            await report_job_progress(job, f"{index}/{len(members)} members mapped")
+            await asyncio.sleep(0)  # Yields to the event loop between batches on large guilds
+    data["userToReal"] = user_to_real
+    data["realPeople"] = dict(user_to_real)
+    print(f"INFO: Refreshed all user-to-real name mappings for channel {ctx.channel.id}.")
+
+    await report_job_progress(job, f"{len(members)} members mapped, saving", force=True)
+    await save_specific_data_to_db(ctx.guild.id, ctx.channel.id, data)  # Save changes
+    await report_job_progress(job, f"mapped {len(members)} member(s) in #{ctx.channel.name}")
+
+    # The listing is split to stay under Discord's 2000 character message limit
+    message_text = f"User IDs mapped to real names in #{ctx.channel.name}:"
+    for user_id, real_name in data["realPeople"].items():
+        line = f"<@{user_id}> -> {real_name}"
+        if len(message_text) + len(line) + 1 > 1900:
+            await ctx.send(message_text)
+            message_text = ""
+        message_text = f"{message_text}\n{line}" if message_text else line
+    if message_text:
+        await ctx.send(message_text)
+
+
+
+
+async def toggle_name_sync(ctx, data):
+    """Body of `c.n sync`: toggles name sync for the channel."""
+    data["name_sync"] = not data.get("name_sync", False)
+    if data["name_sync"]:
+        hint = "" if data["userToReal"] else " Run `c.n` once to map the current members."
+        await ctx.send(f"Real names in #{ctx.channel.name} will **now** follow display name changes and new members; "
+                       f"custom names are left alone.{hint}")
+    else:
+        await ctx.send(f"Real names in #{ctx.channel.name} will **no longer** be synced automatically.")
+    await save_specific_data_to_db(ctx.guild.id, ctx.channel.id, data)  # Save changes
+    print(f"INFO: Name sync for channel {ctx.channel.id} set to {data['name_sync']}.")
+
+
+async def sync_member_name(member, previous_display_name=None):
+    """
+    Updates a member's mapping in every cached channel of their guild with name sync on.
+    A joining member (previous_display_name None) is mapped only if they have no mapping yet; on a rename,
+    only mappings still equal to the old display name are auto-mapped, anything else was customized.
+    """
+    if member.bot:
+        return
+    for channel_id, data in list(guild_channel_data_cache.get(member.guild.id, {}).items()):
+        if channel_id == 0 or not data.get("name_sync") or member.id in data.get("banned_users", set()):
+            continue
+        current = data.get("userToReal", {}).get(str(member.id))
+        if current != previous_display_name or current == member.display_name:
+            continue
+        data.setdefault("userToReal", {})[str(member.id)] = member.display_name
+        data.setdefault("realPeople", {})[str(member.id)] = member.display_name
+        await save_name_mapping_deltas(member.guild.id, channel_id, {member.id: member.display_name})
+        print(f"INFO: Synced real name of {member.id} to '{member.display_name}' in channel {channel_id}.")
+
+
+@bot.event
+async def on_member_update(before, after):
+    """Keeps auto-mapped real names current when a member's display name changes."""
+    if before.display_name != after.display_name:
+        await sync_member_name(after, before.display_name)
+
+
+@bot.event
+async def on_user_update(before, after):
+    """
+    Global display name changes of members without a server nickname only reach on_user_update
+    (before and after members share one user object), so they are synced here for each mutual guild.
+    """
+    if before.display_name == after.display_name:
+        return
+    for guild in after.mutual_guilds:
+        member = guild.get_member(after.id)
+        if member is not None and member.nick is None:
+            await sync_member_name(member, before.display_name)
+
+
+@bot.event
+async def on_member_join(member):
+    """Maps new members in channels with name sync on."""
+    await sync_member_name(member)
+
+
+
+
+# --- Batch leaderboard adjustments and bans (c.a, c.z, c.d) ---
+BATCH_EMBED_LINES = 20  # Lines listed in a batch confirmation embed before summarizing the rest
+
+
+def resolve_batch_user(ctx, token, require_member=True):
+    """
+    Resolves a mention, user ID or username (less reliable) to (user_id, member).
+    Returns (None, None) if the user can't be found, or isn't in the guild when require_member is set.
+    """
+    user_id = None
+    member = None
+    if token.startswith('<@') and token.endswith('>'):
+        try:
+            user_id = int(token.strip('<@!>'))
+        except ValueError:
+            pass
+    elif token.isdigit():
+        user_id = int(token)
+    else:
+        member = discord.utils.get(ctx.guild.members, name=token)
+        if member:
+            user_id = member.id
+    if user_id and member is None:
+        member = ctx.guild.get_member(user_id)
+    if not user_id or (require_member and member is None):
+        return None, None
+    return user_id, member
+
+
+def parse_count_batch(ctx, args, require_member=True):
+    """
+    Parses `<user> <count> [<user> <count> ...]` into {user_id: (member, delta)}, merging repeated users.
+    Returns (deltas, errors); callers apply nothing if there are errors.
+    """
+    if not args or len(args) % 2:
+        return {}, ["expected one or more pairs of a user and a count"]
+    deltas, errors = {}, []
+    for token, count in zip(args[::2], args[1::2]):
+        try:
+            delta = int(count)
+        except ValueError:
+            errors.append(f"'{count}' is not a whole number (for {token})")
+            continue
+        user_id, member = resolve_batch_user(ctx, token, require_member)
+        if not user_id:
+            errors.append(f"user '{token}' was not found in this server")
+            continue
+        deltas[user_id] = (member, deltas.get(user_id, (member, 0))[1] + delta)
+    return deltas, errors
+
+
+def batch_display_name(data, user_id, member):
+    """Real name if mapped, else the member's display name, else a placeholder."""
+    return data.get("userToReal", {}).get(str(user_id)) or (member.display_name if member else f"Unknown User ({user_id})")
+
+
+async def send_batch_confirmation(ctx, title, lines, color):
+    """Sends the single confirmation embed for a batch, listing up to BATCH_EMBED_LINES lines."""
+    description = "\n".join(lines[:BATCH_EMBED_LINES])
+    if len(lines) > BATCH_EMBED_LINES:
+        description += f"\n...and {len(lines) - BATCH_EMBED_LINES} more"
+    await ctx.send(embed=discord.Embed(title=title, description=description, color=color))
+
+
+async def apply_count_batch(ctx, args, field, label, usage):
+    """
+    Shared body of c.a and c.z: validates every user/count pair, applies the deltas to data[field]
+    (clamped at zero, zero entries removed), persists just those rows in one transaction and
+    confirms with one embed.
+    """
+    if not await is_admin(ctx):
+        await ctx.send(f"{ctx.author.mention}, this command is only accessible to admins.")
+        return
+    deltas, errors = parse_count_batch(ctx, args, require_member=(field == "users"))
+    if errors:
+        await ctx.send("Nothing was changed: " + "; ".join(errors) + f".\nUsage: {usage}")
+        return
+
+    data = ctx.channel_data
+    counts = data.setdefault(field, {})
+    lines = []
+    for user_id, (member, delta) in deltas.items():
+        before = counts.get(user_id, 0)
+        after = max(0, before + delta)
+        if after:
+            counts[user_id] = after
+        else:
+            counts.pop(user_id, None)
+        lines.append(f"**{batch_display_name(data, user_id, member)}**: {before} → {after} ({delta:+})")
+
+    await save_leaderboard_deltas(ctx.guild.id, ctx.channel.id, data, list(deltas))
+    await send_batch_confirmation(ctx, f"{label} updated in #{ctx.channel.name}", lines, discord.Color.blue())
+    adjustments = {user_id: delta for user_id, (member, delta) in deltas.items()}
+    print(f"INFO: {label} adjusted in channel {ctx.channel.id}: {adjustments}")
+
+
+@bot.command()
+async def a(ctx, *args: str):
+   """
+   Adds or removes check-ins for one or more users. This is channel-specific.
+   c.a <user> <count> [<user> <count> ...] - accepts user mentions or IDs; negative counts remove check-ins.
+   """
+   await apply_count_batch(ctx, args, "users", "Check-ins", "`c.a @User 2 [@Other -1 ...]`")
+
+@bot.command(name="z")
+async def z(ctx, *args: str):
+    """
+    c.z <user> <count> [<user> <count> ...]
+    Adds (positive) or removes (negative) missed check-ins for one or more users on the missed leaderboard.
+    Works like c.a but applies to channel_data['missed_users'].
+    """
+    await apply_count_batch(ctx, args, "missed_users", "Missed check-ins", "`c.z @User 2 [123456789 -1 ...]`")
+
+
+
+
+# --- Bulk import of name mappings and check-in/miss adjustments from a CSV attachment ---
+IMPORT_MAX_BYTES = 1024 * 1024
+IMPORT_COLUMNS = ["user", "name", "checkins", "missed"]
+IMPORT_REPORT_LINES = 15  # Diff lines shown in the reply; the full diff is attached
+
+
+def build_roster_index(guild):
+    """
+    Indexes a guild's member roster for resolving import rows: {"ids": set of member ids,
+    "names": {lowercased username/display name: set of member ids}}.
+    """
+    roster = {"ids": set(), "names": {}}
+    for member in guild.members:
+        if member.bot:
+            continue
+        roster["ids"].add(member.id)
+        for name in {member.name.lower(), member.display_name.lower()}:
+            roster["names"].setdefault(name, set()).add(member.id)
+    return roster
+
+
+def resolve_roster_user(roster, identifier):
+    """Resolves a mention, user ID or unique username/display name to a member id. Returns (user_id, error)."""
+    identifier = identifier.strip()
+    if identifier.startswith("<@") and identifier.endswith(">"):
+        identifier = identifier.strip("<@!>")
+    if identifier.isdigit():
+        user_id = int(identifier)
+        return (user_id, None) if user_id in roster["ids"] else (None, f"user ID {user_id} is not a member of this server")
+    matches = roster["names"].get(identifier.lower(), set())
+    if len(matches) == 1:
+        return next(iter(matches)), None
+    if matches:
+        return None, f"'{identifier}' matches {len(matches)} members; use a user ID instead"
+    return None, f"no member is named '{identifier}'"
+
+
+def parse_import_rows(text, roster):
+    """
+    Validates an import CSV with a header of user plus any of name, checkins, missed (signed adjustments).
+    Returns (changes, errors): changes is {user_id: {"name": str or None, "checkins": int, "missed": int}},
+    with repeated users merged; errors lists "line N: problem" strings.
+    """
+    reader = csv.DictReader(StringIO(text))
+    header = [column.strip().lower() for column in (reader.fieldnames or [])]
+    if "user" not in header or not set(header) & {"name", "checkins", "missed"}:
+        return {}, [f"the header must contain `user` and at least one of `name`, `checkins`, `missed` (got: {', '.join(header) or 'nothing'})"]
+    unknown = [column for column in header if column not in IMPORT_COLUMNS]
+    if unknown:
+        return {}, [f"unknown column(s): {', '.join(unknown)}"]
+    reader.fieldnames = header
+
+    changes, errors = {}, []
+    for row in reader:
+        line = reader.line_num
+        user_id, error = resolve_roster_user(roster, row.get("user") or "")
+        if error:
+            errors.append(f"line {line}: {error}")
+            continue
+        change = changes.setdefault(user_id, {"name": None, "checkins": 0, "missed": 0})
+        name = (row.get("name") or "").strip()
+        if name:
+            if len(name) > 255:
+                errors.append(f"line {line}: name is longer than 255 characters")
+            change["name"] = name
+        for column in ("checkins", "missed"):
+            value = (row.get(column) or "").strip()
+            if not value:
+                continue
+            try:
+                change[column] += int(value)
+            except ValueError:
+                errors.append(f"line {line}: {column} must be a whole number, got '{value}'")
+    return changes, errors
+
+
+def apply_import_changes(data, changes):
+    """
+    Applies validated import changes to channel data, clamping counts at zero like c.a/c.z.
+    Returns diff rows (user_id, field, before, after) for everything that actually changed.
+    """
+    diff = []
+    for user_id, change in changes.items():
+        if change["name"] is not None:
+            before = data["userToReal"].get(str(user_id))
+            if before != change["name"]:
+                data["userToReal"][str(user_id)] = change["name"]
+                data["realPeople"][str(user_id)] = change["name"]
+                diff.append((user_id, "name", before or "", change["name"]))
+        for column, counts in (("checkins", data["users"]), ("missed", data["missed_users"])):
+            if not change[column]:
+                continue
+            before = counts.get(user_id, 0)
+            after = max(0, before + change[column])
+            if after:
+                counts[user_id] = after
+            else:
+                counts.pop(user_id, None)
+            if after != before:
+                diff.append((user_id, column, before, after))
+    return diff
+
+
+@bot.command(name="import")
+async def import_command(ctx):
+    """
+    Admin: applies a CSV attachment of name mappings and check-in/miss adjustments to this channel.
+    Columns: `user` (mention, ID or unique name) and any of `name`, `checkins`, `missed` (signed adjustments).
+    Every row is validated first; nothing is applied unless all rows are valid. Replies with a diff.
+    """
+    if not await is_admin(ctx):
+        await ctx.send(f"{ctx.author.mention}, this command is only accessible to admins.")
+        return
+    if not ctx.message.attachments:
+        await ctx.send("Please attach a CSV file with a header of `user` and any of `name`, `checkins`, `missed`.")
+        return
+    attachment = ctx.message.attachments[0]
+    if attachment.size > IMPORT_MAX_BYTES:
+        await ctx.send(f"The attachment is too large to import (limit {IMPORT_MAX_BYTES // 1024} KB).")
+        return
+    try:
+        text = (await attachment.read()).decode("utf-8-sig")
+    except (discord.HTTPException, UnicodeDecodeError) as e:
+        await ctx.send(f"Could not read the attachment as UTF-8 CSV: {e}")
+        return
+
+    changes, errors = parse_import_rows(text, build_roster_index(ctx.guild))
+    if errors:
+        shown = "\n".join(errors[:IMPORT_REPORT_LINES])
+        more = f"\n...and {len(errors) - IMPORT_REPORT_LINES} more" if len(errors) > IMPORT_REPORT_LINES else ""
+        await ctx.send(f"Nothing was imported; {len(errors)} row(s) are invalid:\n{shown}{more}")
+        return
+    if not changes:
+        await ctx.send("The attachment has no rows to import.")
+        return
+
+    # Everything is applied in memory, then persisted by a single save (one database transaction)
+    data = ctx.channel_data
+    diff = apply_import_changes(data, changes)
+    if not diff:
+        await ctx.send(f"All {len(changes)} user(s) in the attachment already match; nothing changed.")
+        return
+    await save_specific_data_to_db(ctx.guild.id, ctx.channel.id, data)
+    print(f"INFO: Imported {len(diff)} change(s) for {len(changes)} user(s) in channel {ctx.channel.id}.")
+
+    report = StringIO()
+    writer = csv.writer(report)
+    writer.writerow(["user_id", "field", "before", "after"])
+    writer.writerows(diff)
+    lines = [f"<@{user_id}> {field}: {before} → {after}" for user_id, field, before, after in diff[:IMPORT_REPORT_LINES]]
+    if len(diff) > IMPORT_REPORT_LINES:
+        lines.append(f"...and {len(diff) - IMPORT_REPORT_LINES} more (see the attached report)")
+    embed = discord.Embed(title=f"Import into #{ctx.channel.name}",
+                          description=f"Applied **{len(diff)}** change(s) for **{len(changes)}** user(s).\n\n" + "\n".join(lines),
+                          color=discord.Color.teal())
+    await ctx.send(embed=embed, file=discord.File(BytesIO(report.getvalue().encode("utf-8")), filename="import_diff.csv"))
+
+
+
+
+@bot.command()
+async def w(ctx, min_lim: int):
+   """Sets a minimum number of words required in a check-in message. This is channel-specific."""
+   data = ctx.channel_data
+   if not await is_admin(ctx):
+       await ctx.send(f"{ctx.author.mention}, this command is only accessible to admins.")
+       return
+   if min_lim <= 0:
+       await ctx.send(f"{ctx.author.mention}, please enter a positive number (greater than zero).")
+       return
+   try:
+       data["word_min"] = min_lim
+       await ctx.send(f"Word minimum set to **{data['word_min']}** words for #{ctx.channel.name}.")
+       await save_specific_data_to_db(ctx.guild.id, ctx.channel.id, data)  # Save changes
+       print(f"INFO: Word minimum for channel {ctx.channel.id} set to {min_lim}.")
+   except ValueError:
+       await ctx.send(f"{ctx.author.mention}, please enter a valid number.")
+
+
+
+
+@bot.command()
+async def d(ctx, *args: str):
+   """
+   Manages banned users for check-ins in this channel: ban, unban, or list.
+   Accepts user mentions or IDs. This is channel-specific.
+   When a user is banned, they are also removed from all leaderboards.
+   """
+   data = ctx.channel_data
+   if not await is_admin(ctx):
+       await ctx.send(f"{ctx.author.mention}, this command is only accessible to admins.")
+       return
+   if not args:
+       await ctx.send(
+           f"Usage: `c.d @User1 @User2 ...` to ban users, `c.d -u @User1 @User2 ...` to unban, or `c.d -list` to view banned users for #{ctx.channel.name}.")
+       return
+
+
+   if args[0].lower() == "-list":
+       if data["banned_users"]:
+           banned_mentions = []
+           for user_id in data["banned_users"]:
+               try:
+                   user = await bot.fetch_user(user_id)
+                   banned_mentions.append(f"{user.display_name} (<@{user_id}>)")
+               except (discord.NotFound, discord.HTTPException):
+                   banned_mentions.append(f"Unknown User (<@{user_id}>)")
+           banned_list = '\n'.join(banned_mentions)
+           await ctx.send(f"**Banned users for #{ctx.channel.name}**:\n{banned_list}")
+       else:
+           await ctx.send(f"No users are currently banned from checking in this channel.")
+       return
+
+
+   # Determine if it's an unban operation based on the first argument
+   is_unban = args[0].lower() == "-u"
+   users_to_process = args[1:] if is_unban else args
+
+
+   if not users_to_process:
+       await ctx.send("No users specified.")
+       return
+
+
+   # Resolve every argument before changing anything, so a typo doesn't leave a partial batch
+   target_user_ids = set()
+   unresolved = []
+   for arg in users_to_process:
+       user_id, _ = resolve_batch_user(ctx, arg, require_member=False)
+       if user_id:
+           target_user_ids.add(user_id)
+       else:
+           unresolved.append(f"'{arg}'")
+   if unresolved:
+       await ctx.send(f"Could not find user(s) {', '.join(unresolved)}. Please use mentions or user IDs; nothing was changed.")
+       return
+
+
+   if is_unban:
+       unbanned_ids = target_user_ids.intersection(data["banned_users"])
+       if not unbanned_ids:
+           await ctx.send("No matching users were banned in this channel.")
+           return
+       data["banned_users"] -= unbanned_ids
+       await save_leaderboard_deltas(ctx.guild.id, ctx.channel.id, data, [], save_core=True)
+       await send_batch_confirmation(ctx, f"Unbanned users for #{ctx.channel.name}",
+                                     [f"<@{uid}>" for uid in unbanned_ids], discord.Color.green())
+       print(f"INFO: Unbanned users {unbanned_ids} from channel {ctx.channel.id}.")
+   else:  # Ban users
+       data["banned_users"].update(target_user_ids)
+       # Banned users are also removed from both leaderboards, in the same transaction as the ban list
+       for user_id_to_ban in target_user_ids:
+           data["users"].pop(user_id_to_ban, None)
+           data["missed_users"].pop(user_id_to_ban, None)
+       await save_leaderboard_deltas(ctx.guild.id, ctx.channel.id, data, list(target_user_ids), save_core=True)
+       await send_batch_confirmation(ctx, f"Banned users for #{ctx.channel.name}",
+                                     [f"<@{uid}>" for uid in target_user_ids], discord.Color.red())
+       print(f"INFO: Banned users {target_user_ids} from channel {ctx.channel.id} and removed them from leaderboards.")
 
 
 
 
 @bot.command()
-async def a(ctx, user_mention_or_id: str, count: int):
+async def tz(ctx, *timezoneset):
    """
-   Adds or removes a certain number of check-ins to a user's count. This is channel-specific.
-   Accepts user mention or ID.
+   Sets the timezone for the guild's check-in resets. This is a guild-wide setting.
+   Use 'list' to see all available timezones.
    """
-   data = await get_channel_data(ctx.guild.id, ctx.channel.id)
+   guild_settings = ctx.guild_settings
    if not await is_admin(ctx):
        await ctx.send(f"{ctx.author.mention}, this command is only accessible to admins.")
        return
+   if not timezoneset:
+       await ctx.send(f"Usage: `c.tz list` to view all timezones or `c.tz [timezone]` to set one.")
+       return
+   if timezoneset[0].lower() == "list":
+       tz_list = "\n".join(pytz.all_timezones)
+       file_path = "/tmp/timezones.txt"  # Temporary file for sending
+       with open(file_path, "w", encoding="utf-8") as file:
+           file.write(tz_list)
+       try:
+           await ctx.send(f"**List of available timezones:**", file=discord.File(file_path))
+       except discord.errors.HTTPException as e:
+           await ctx.send(f"Could not send timezone list (file too large or other error): {e}")
+       finally:
+           if os.path.exists(file_path):
+               os.remove(file_path)
+       return
+   if timezoneset:
+       tz_string = " ".join(timezoneset)
+       if tz_string in pytz.all_timezones:
+           guild_settings["timezone"] = tz_string
+           await ctx.send(f"Guild timezone set to **{tz_string}**.")
+           await save_specific_data_to_db(ctx.guild.id, 0, guild_settings)  # Save guild-wide settings
+           print(f"INFO: Guild {ctx.guild.id} timezone set to {tz_string}.")
+       else:
+           await ctx.send(f"Invalid timezone. Use `c.tz list` to see valid timezones.")
 
 
-   member = None
-   user_id = None
 
 
-   # Try to resolve member from mention or ID
-   if user_mention_or_id.startswith('<@') and user_mention_or_id.endswith('>'):
-       try:
-           user_id = int(user_mention_or_id.strip('<@!>'))
-           member = ctx.guild.get_member(user_id)
-       except ValueError:
-           pass
-   elif user_mention_or_id.isdigit():
-       user_id = int(user_mention_or_id)
-       member = ctx.guild.get_member(user_id)
-   else:  # Fallback to searching by name (less reliable)
-       member = discord.utils.get(ctx.guild.members, name=user_mention_or_id)
-       if member:
-           user_id = member.id
-
-
-   if not member or not user_id:
-       await ctx.send(f"User '{user_mention_or_id}' not found in the server. Please use a mention or user ID.")
+@bot.command()
+async def lr(ctx, *leader_input):
+   """Resets either the check-in leaderboard (wl) or the missed check-in leaderboard (ll). This is channel-specific."""
+   data = ctx.channel_data
+   if not await is_admin(ctx):
+       await ctx.send(f"{ctx.author.mention}, this command is only accessible to admins.")
        return
+   if not leader_input:
+       await ctx.send("Please select a leaderboard to reset (either 'wl' or 'll').")
+       return
+   elif leader_input[0].lower() == "wl":
+       data["users"] = {}
+       await ctx.send("Check-in leaderboard for this channel has been reset.")
+       await save_specific_data_to_db(ctx.guild.id, ctx.channel.id, data)  # Save changes
+       print(f"INFO: Check-in leaderboard for channel {ctx.channel.id} reset.")
+   elif leader_input[0].lower() == "ll":
+       data["missed_users"] = {}
+       await ctx.send("Missed check-in leaderboard for this channel has been reset.")
+       await save_specific_data_to_db(ctx.guild.id, ctx.channel.id, data)  # Save changes
+       print(f"INFO: Missed check-in leaderboard for channel {ctx.channel.id} reset.")
+   else:
+       await ctx.send(
+           "Invalid leaderboard specified. Use 'wl' to reset the check-in leaderboard or 'll' to reset the missed check-in leaderboard.")
 
 
-   data["users"][user_id] = data["users"].get(user_id, 0) + count
-   # Ensure check-in count doesn't go below zero, and remove from dict if it becomes 0
-   if data["users"][user_id] < 0:
-       data["users"][user_id] = 0
-   if data["users"][user_id] == 0:
-       data["users"].pop(user_id, None)
 
 
-   action_text = "added to" if count >= 0 else "removed from"
-   await ctx.send(
-       f"**{abs(count)}** check-in(s) have been {action_text} **{member.display_name}** in #{ctx.channel.name}.")
-   await save_specific_data_to_db(ctx.guild.id, ctx.channel.id, data)  # Save changes
-   print(f"INFO: {count} check-ins {action_text} {member.display_name} ({user_id}) in channel {ctx.channel.id}.")
+@bot.command()
+async def r(ctx, resetTime: str):
+   """
+   Sets the daily reset time for check-ins in HHMMSS format (e.g., 235959 for 11:59:59 PM) for this channel.
+   """
+   data = ctx.channel_data
+   if not await is_admin(ctx):
+       await ctx.send(f"{ctx.author.mention}, this command is only accessible to admins.")
+       return
+   if len(resetTime) != 6 or not resetTime.isdigit():
+       await ctx.send(f"{ctx.author.mention}, please enter a 6-digit number (e.g., 235959 for 11:59:59 PM).")
+       return
 
-@bot.command(name="z")
-async def z(ctx, user_mention_or_id: str, count: str):
+
+   try:
+       hours = int(resetTime[:2])
+       minutes = int(resetTime[2:4])
+       seconds = int(resetTime[4:])
+
+
+       if not (0 <= hours <= 23 and 0 <= minutes <= 59 and 0 <= seconds <= 59):
+           await ctx.send(f"{ctx.author.mention}, please ensure the time is valid (HH:00-23, MM:00-59, SS:00-59).")
+           return
+
+
+       data["reset_time"] = resetTime
+       await ctx.send(f"Reset time for this channel set to **{hours:02}:{minutes:02}:{seconds:02}**.")
+       await save_specific_data_to_db(ctx.guild.id, ctx.channel.id, data)  # Save changes
+       print(f"INFO: Reset time for channel {ctx.channel.id} set to {resetTime}.")
+   except ValueError:
+       await ctx.send(f"{ctx.author.mention}, invalid time format. Please use a 6-digit number.")
+
+
+
+
+@bot.command()
+async def cr(ctx):
+   """Shows the current daily reset time for this channel and the guild's timezone."""
+   data = ctx.channel_data
+   reset_time_str = data.get("reset_time")
+   guild_settings = ctx.guild_settings
+   timezone_str = guild_settings.get("timezone", "America/Los_Angeles")  # Provide default
+
+
+   if not reset_time_str:
+       await ctx.send(f"No reset time configured for this channel. The guild timezone is **{timezone_str}**.")
+       return
+
+
+   try:
+       reset_hour = int(reset_time_str[:2])
+       reset_minute = int(reset_time_str[2:4])
+       reset_second = int(reset_time_str[4:])
+
+
+       period = "AM"
+       reset_hour_12 = reset_hour
+       if reset_hour == 0:
+           reset_hour_12 = 12
+       elif reset_hour == 12:
+           period = "PM"
+       elif reset_hour > 12:
+           reset_hour_12 = reset_hour - 12
+           period = "PM"
+
+
+       formatted_reset_time = f"{reset_hour_12:02}:{reset_minute:02}:{reset_second:02} {period}"
+       await ctx.send(f"The reset time for this channel is **{formatted_reset_time}** ({timezone_str}).")
+
+
+   except ValueError:
+       await ctx.send(
+           f"Error: Invalid reset time format stored for this channel ({reset_time_str}). Please contact an admin to fix it using `c.r`.")
+   except Exception as e:
+       await ctx.send(f"An unexpected error occurred: {e}")
+
+
+@bot.command()
+async def rs(ctx):
     """
-    c.z <user_mention_or_id> <count>
-    Adds (positive) or removes (negative) missed check-ins for a user on the missed leaderboard.
-    Works similarly to c.a but applies to channel_data['missed_users'].
+    Toggles the rolling summary mode for this channel: the 'since last reset' summary is kept up to date
+    in the background, so `c.sum` without arguments answers immediately. This is channel-specific.
     """
-    # Permission check (same as c.a)
+    data = ctx.channel_data
     if not await is_admin(ctx):
         await ctx.send(f"{ctx.author.mention}, this command is only accessible to admins.")
         return
+    data["rolling_summary"] = not data.get("rolling_summary", False)
+    status = "now" if data["rolling_summary"] else "no longer"
+    await ctx.send(f"The check-in summary for #{ctx.channel.name} is **{status}** updated in the background "
+                   f"(every {ROLLING_SUMMARY_INTERVAL_MINUTES} minutes).")
+    await save_specific_data_to_db(ctx.guild.id, ctx.channel.id, data)  # Save changes
+    print(f"INFO: Rolling summary for channel {ctx.channel.id} set to {data['rolling_summary']}.")
 
-    # Resolve and validate count (manual conversion to avoid discord converter raising BadArgument)
-    try:
-        count_int = int(count)
-    except ValueError:
-        await ctx.send(f"{ctx.author.mention}, please provide a valid integer for the count (e.g. `c.z @User 2` or `c.z 123456789  -1`).")
+
+@bot.command()
+async def usage(ctx, days: int = 7):
+    """
+    Shows this guild's summarization model usage: rolling p50/p95/max of prompt size, queue wait, model latency
+    and response size over the most recent calls, plus per-channel totals for the last `days` days.
+    """
+    if not await is_admin(ctx):
+        await ctx.send(f"{ctx.author.mention}, this command is only accessible to admins.")
         return
+    days = max(1, min(days, 365))
+
+    embed = discord.Embed(title=f"Summarization Usage for {ctx.guild.name}", color=discord.Color.dark_gold())
+    recent_calls = list(summary_metrics_window.get(ctx.guild.id, []))
+    if recent_calls:
+        lines = []
+        for metric, label, unit in [("estimated_tokens", "Prompt tokens (est.)", ""), ("image_count", "Images", ""),
+                                    ("queue_wait", "Queue wait", "s"), ("model_latency", "Model latency", "s"),
+                                    ("response_chars", "Response chars", "")]:
+            p50, p95, peak = summary_metric_percentiles(recent_calls, metric)
+            precision = 1 if unit == "s" else 0
+            lines.append(f"{label}: p50 **{p50:.{precision}f}{unit}**, p95 **{p95:.{precision}f}{unit}**, "
+                         f"max **{peak:.{precision}f}{unit}**")
+        embed.add_field(name=f"Last {len(recent_calls)} call(s) since startup", value="\n".join(lines), inline=False)
+    else:
+        embed.add_field(name="Recent calls", value="No model calls recorded since the bot started.", inline=False)
+
+    usage_rows = await load_summary_usage(ctx.guild.id, datetime.now(pytz.utc) - timedelta(days=days))
+    if usage_rows is None:
+        embed.add_field(name=f"Last {days} day(s)", value="Could not load usage from the database.", inline=False)
+    elif not usage_rows:
+        embed.add_field(name=f"Last {days} day(s)", value="No model calls recorded.", inline=False)
+    else:
+        lines = []
+        for row in usage_rows[:10]:
+            channel_label = f"<#{row['channel_id']}>" if row["channel_id"] else "background"
+            failures = f", {row['failures']} failed" if row["failures"] else ""
+            lines.append(f"{channel_label} `{row['command']}`: {row['calls']} call(s){failures}, "
+                         f"~{row['estimated_tokens']:,} tokens, {row['image_count']} image(s) "
+                         f"({row['image_bytes'] / 1e6:.1f} MB), {row['model_seconds']:.0f}s model time, "
+                         f"{row['response_chars']:,} chars out")
+        embed.add_field(name=f"Last {days} day(s), by model time", value="\n".join(lines), inline=False)
+    await ctx.send(embed=embed)
+
+
+MAX_EMBED_FIELD_LENGTH = 1024
+
+
+# --- Shared Gemini client used by sum and topic ---
+GEMINI_MODEL_NAME = "gemini-1.5-flash"
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "4"))
+GEMINI_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "90"))
+
+# Model calls run on their own pool so they never starve other asyncio.to_thread work
+gemini_executor = ThreadPoolExecutor(max_workers=GEMINI_MAX_CONCURRENCY, thread_name_prefix="gemini")
+gemini_semaphore = None  # Created on first use, inside the running event loop
+gemini_models = {}  # {model_name: genai.GenerativeModel}, reset if the API key changes
+gemini_configured_api_key = None
+
+
+def get_gemini_model(model_name=GEMINI_MODEL_NAME):
+    """Returns a shared GenerativeModel, configuring the API key only when it is first seen or has changed."""
+    global gemini_configured_api_key
+    google_api_key = os.getenv("GOOGLE_API_KEY")
+    if google_api_key != gemini_configured_api_key:
+        genai.configure(api_key=google_api_key)
+        gemini_configured_api_key = google_api_key
+        gemini_models.clear()
+    if model_name not in gemini_models:
+        gemini_models[model_name] = genai.GenerativeModel(model_name)
+    return gemini_models[model_name]
+
+
+async def generate_with_gemini(prompt_content, model_name=GEMINI_MODEL_NAME, timeout=GEMINI_TIMEOUT_SECONDS, on_text=None):
+    """
+    Calls generate_content off the event loop, under the global concurrency cap and a per-request timeout.
+    If on_text is given the response is streamed and on_text(text_so_far) is called on the event loop
+    as chunks arrive. Returns (response_text, timings) where timings holds queue_wait and model_latency
+    in seconds. Raises asyncio.TimeoutError if the model does not answer in time.
+    """
+    global gemini_semaphore
+    if gemini_semaphore is None:
+        gemini_semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+
+    semaphore = gemini_semaphore
+    model = get_gemini_model(model_name)
+    loop = asyncio.get_running_loop()
+    abandoned = False  # Set once the caller stops waiting; a streaming call then stops early
+
+    def generate():
+        if on_text is None:
+            return model.generate_content(prompt_content, request_options={"timeout": timeout}).text
+        text = ""
+        for chunk in model.generate_content(prompt_content, stream=True, request_options={"timeout": timeout}):
+            if abandoned:
+                break
+            if not chunk.parts:
+                continue  # e.g. a trailing chunk that only carries the finish reason
+            text += chunk.text
+            loop.call_soon_threadsafe(on_text, text)
+        return text
+
+    def release_slot(future):
+        semaphore.release()
+        if not future.cancelled():
+            future.exception()  # Retrieved so an abandoned call's error isn't logged as unhandled
+
+    queued_at = time_module.perf_counter()
+    response_text, outcome = "", "error"
+    await semaphore.acquire()
+    started_at = time_module.perf_counter()
+    try:
+        model_future = loop.run_in_executor(gemini_executor, generate)
+    except BaseException:
+        semaphore.release()
+        raise
+    # The slot is held until the executor thread finishes, not just until this caller stops waiting, so a
+    # timed-out or cancelled call still counts against GEMINI_MAX_CONCURRENCY and later callers never
+    # queue silently behind it in gemini_executor
+    model_future.add_done_callback(release_slot)
+    try:
+        response_text = await asyncio.wait_for(asyncio.shield(model_future), timeout)
+        outcome = "ok"
+    except asyncio.TimeoutError:
+        outcome = "timeout"
+        raise
+    finally:
+        abandoned = not model_future.done()
+        timings = {"queue_wait": started_at - queued_at, "model_latency": time_module.perf_counter() - started_at}
+        print(f"INFO: Gemini call ({model_name}) queue wait {timings['queue_wait']:.2f}s, "
+              f"model latency {timings['model_latency']:.2f}s.")
+        record_summary_call_metrics(prompt_content, timings, response_text, outcome)
+    return response_text.strip(), timings
+
+
+# --- Per-guild accounting of model usage ---
+SUMMARY_METRICS_WINDOW = 500  # Most recent calls per guild kept in memory for percentiles
+
+# (guild_id, channel_id, command) of the sum/topic/background job making model calls. Set by the entry
+# point; asyncio tasks it spawns inherit it, so generate_with_gemini can attribute calls without extra arguments.
+summary_metrics_context = contextvars.ContextVar("summary_metrics_context", default=(0, 0, "other"))
+
+# Structure: {guild_id: deque of metrics dicts, newest last}
+summary_metrics_window = {}
+
+
+def record_summary_call_metrics(prompt_content, timings, response_text, outcome):
+    """Measures one model call, adds it to its guild's rolling window and persists it in the background."""
+    guild_id, channel_id, command = summary_metrics_context.get()
+    prompt_chars, image_count, image_bytes = 0, 0, 0
+    for part in prompt_content:
+        if isinstance(part, str):
+            prompt_chars += len(part)
+        else:
+            image_count += 1
+            if isinstance(part, dict):
+                image_bytes += len(part.get("data", b""))
+    metrics = {
+        "guild_id": guild_id, "channel_id": channel_id, "command": command, "outcome": outcome,
+        "prompt_chars": prompt_chars, "estimated_tokens": estimate_prompt_tokens(prompt_content),
+        "image_count": image_count, "image_bytes": image_bytes,
+        "queue_wait": timings["queue_wait"], "model_latency": timings["model_latency"],
+        "response_chars": len(response_text),
+    }
+    summary_metrics_window.setdefault(guild_id, deque(maxlen=SUMMARY_METRICS_WINDOW)).append(metrics)
+    save_task = asyncio.create_task(save_summary_call_metrics(metrics))
+    background_summary_tasks.add(save_task)
+    save_task.add_done_callback(background_summary_tasks.discard)
+
+
+async def save_summary_call_metrics(metrics):
+    """Persists the metrics of one model call."""
+    conn = get_db_connection()
+    if conn:
+        cur = None
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                f"""
+                INSERT INTO {SUMMARY_METRICS_TABLE}
+                    (guild_id, channel_id, command, outcome, prompt_chars, estimated_tokens, image_count,
+                     image_bytes, queue_wait, model_latency, response_chars)
+                VALUES (%(guild_id)s, %(channel_id)s, %(command)s, %(outcome)s, %(prompt_chars)s, %(estimated_tokens)s,
+                        %(image_count)s, %(image_bytes)s, %(queue_wait)s, %(model_latency)s, %(response_chars)s)
+                """,
+                metrics
+            )
+            conn.commit()
+        except (Exception, psycopg2.Error) as error:
+            print(f"ERROR: Error while saving summary call metrics for guild {metrics['guild_id']}: {error}")
+            if conn:
+                conn.rollback()
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                conn.close()
+    else:
+        print("ERROR: Could not establish database connection for saving summary call metrics.")
 
-    # Resolve the member / user id
-    member = None
-    user_id = None
 
-    # Try mention format
-    if user_mention_or_id.startswith('<@') and user_mention_or_id.endswith('>'):
+async def load_summary_usage(guild_id, since_utc):
+    """
+    Loads per-channel, per-command model usage totals of a guild since since_utc, busiest first.
+    Returns a list of dicts, or None on error.
+    """
+    conn = get_db_connection()
+    if conn:
+        cur = None
         try:
-            user_id = int(user_mention_or_id.strip('<@!>'))
-            member = ctx.guild.get_member(user_id)
-        except ValueError:
-            pass
-    # Try plain ID
-    elif user_mention_or_id.isdigit():
-        user_id = int(user_mention_or_id)
-        member = ctx.guild.get_member(user_id)
+            cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cur.execute(
+                f"""
+                SELECT channel_id, command, COUNT(*) AS calls,
+                       COUNT(*) FILTER (WHERE outcome <> 'ok') AS failures,
+                       SUM(estimated_tokens) AS estimated_tokens, SUM(image_count) AS image_count,
+                       SUM(image_bytes) AS image_bytes, SUM(model_latency) AS model_seconds,
+                       SUM(response_chars) AS response_chars
+                FROM {SUMMARY_METRICS_TABLE}
+                WHERE guild_id = %s AND created_at >= %s
+                GROUP BY channel_id, command
+                ORDER BY SUM(model_latency) DESC
+                """,
+                (guild_id, since_utc)
+            )
+            return [dict(row) for row in cur.fetchall()]
+        except (Exception, psycopg2.Error) as error:
+            print(f"ERROR: Error while loading summary usage for guild {guild_id}: {error}")
+            return None
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                conn.close()
     else:
-        # Fallback to searching by exact display name (less reliable, matches c.a)
-        member = discord.utils.get(ctx.guild.members, name=user_mention_or_id)
-        if member:
-            user_id = member.id
+        print("ERROR: Could not establish database connection for loading summary usage.")
+        return None
 
-    if not user_id:
-        await ctx.send(f"User '{user_mention_or_id}' not found in this server. Please use a mention or user ID.")
-        return
 
-    # Load channel data
-    channel_data = await get_channel_data(ctx.guild.id, ctx.channel.id)
-    missed = channel_data.get("missed_users", {})
+def summary_metric_percentiles(calls, metric):
+    """Returns (p50, p95, max) of one metric over a list of call metrics dicts."""
+    values = np.array([call[metric] for call in calls], dtype=float)
+    p50, p95 = np.percentile(values, [50, 95])
+    return p50, p95, values.max()
+
 
-    # Update missed count
-    current = missed.get(user_id, 0)
-    new_count = current + count_int
+# --- Map-reduce summarization for large windows ---
+SUMMARY_CHUNK_TOKEN_BUDGET = int(os.getenv("SUMMARY_CHUNK_TOKEN_BUDGET", "12000"))
+SUMMARY_CHUNK_MAX_IMAGES = int(os.getenv("SUMMARY_CHUNK_MAX_IMAGES", "8"))
+GEMINI_IMAGE_TOKEN_ESTIMATE = 258  # Gemini bills a typical image as 258 tokens
+CHARS_PER_TOKEN_ESTIMATE = 4
 
-    # Prevent negative counts
-    if new_count <= 0:
-        # Remove entry if it exists and becomes zero or negative
-        if user_id in missed:
-            missed.pop(user_id, None)
-            action_text = "removed from"
+
+def estimate_prompt_tokens(prompt_parts):
+    """Roughly estimates the input tokens of a list of prompt parts (strings and PIL images)."""
+    tokens = 0
+    for part in prompt_parts:
+        if isinstance(part, str):
+            tokens += len(part) // CHARS_PER_TOKEN_ESTIMATE + 1
         else:
-            # nothing to remove; set to zero effectively
-            action_text = "no change (was already zero)"
-            new_count = 0
+            tokens += GEMINI_IMAGE_TOKEN_ESTIMATE
+    return tokens
+
+
+def chunk_checkin_entries(checkin_entries, token_budget=SUMMARY_CHUNK_TOKEN_BUDGET, max_images=SUMMARY_CHUNK_MAX_IMAGES):
+    """
+    Greedily packs check-in entries (each a list of prompt parts) into consecutive batches that stay
+    under token_budget and max_images. Text parts are capped at a third of the budget, so an oversized
+    entry is truncated and any two entries always fit together (which keeps the reduce stages shrinking).
+    Returns a list of flat prompt-part lists.
+    """
+    max_chars = token_budget * CHARS_PER_TOKEN_ESTIMATE
+    chunks = []
+    current_chunk, current_tokens, current_images = [], 0, 0
+    for entry in checkin_entries:
+        entry = [part[:max_chars // 3] if isinstance(part, str) else part for part in entry]
+        entry_tokens = estimate_prompt_tokens(entry)
+        entry_images = len([part for part in entry if not isinstance(part, str)])
+        if current_chunk and (current_tokens + entry_tokens > token_budget or current_images + entry_images > max_images):
+            chunks.append(current_chunk)
+            current_chunk, current_tokens, current_images = [], 0, 0
+        current_chunk.extend(entry)
+        current_tokens += entry_tokens
+        current_images += entry_images
+    if current_chunk:
+        chunks.append(current_chunk)
+    return chunks
+
+
+def new_summary_timings():
+    """Returns an empty timings dict for a summary built from one or more model calls."""
+    return {"queue_wait": 0.0, "model_latency": 0.0, "calls": 0}
+
+
+def add_stage_timings(timings, stage_timings):
+    """Adds one stage of concurrent calls to timings: the slowest call bounds the stage's wait and latency."""
+    if not stage_timings:
+        return
+    timings["queue_wait"] += max(stage["queue_wait"] for stage in stage_timings)
+    timings["model_latency"] += max(stage["model_latency"] for stage in stage_timings)
+    for stage in stage_timings:
+        timings["calls"] += stage.get("calls", 1)
+
+
+async def merge_partial_summaries(instructions, partial_summaries, on_text=None):
+    """
+    Merges partial summaries into one that follows instructions, in token-budgeted rounds until a
+    single summary is left. One partial summary is returned as-is. The final round is streamed to
+    on_text, if given. Returns (summary_text, timings).
+    """
+    timings = new_summary_timings()
+    while len(partial_summaries) > 1:
+        reduce_entries = [[f"\n--- Partial summary {index + 1} ---\n{text}"] for index, text in enumerate(partial_summaries)]
+        reduce_header = (f"The following are partial summaries of consecutive batches of Discord check-ins. "
+                         f"Merge them into a single summary that follows these original instructions exactly, "
+                         f"combining entries for the same user and removing repetition:\n{instructions}\n")
+        chunks = chunk_checkin_entries(reduce_entries)
+        results = await asyncio.gather(*(
+            generate_with_gemini([reduce_header] + chunk, on_text=on_text if len(chunks) == 1 else None)
+            for chunk in chunks
+        ))
+        add_stage_timings(timings, [call_timings for _, call_timings in results])
+        partial_summaries = [text for text, _ in results]
+    return (partial_summaries[0] if partial_summaries else ""), timings
+
+
+async def summarize_map_reduce(prompt_header, checkin_entries, on_text=None):
+    """
+    Summarizes check-in entries with the instructions in prompt_header. Small windows take a single call;
+    larger ones are split into token-budgeted batches summarized concurrently (map), then the partial
+    summaries are merged (reduce), repeating the reduce until the merge fits in one batch.
+    The call producing the final text is streamed to on_text, if given.
+    Returns (summary_text, timings) with queue_wait/model_latency summed over the sequential stages.
+    """
+    instructions = "".join(part for part in prompt_header if isinstance(part, str))
+    timings = new_summary_timings()
+
+    chunks = chunk_checkin_entries(checkin_entries)
+    if len(chunks) <= 1:
+        summary_text, call_timings = await generate_with_gemini(list(prompt_header) + (chunks[0] if chunks else []),
+                                                                on_text=on_text)
+        add_stage_timings(timings, [call_timings])
+        return summary_text, timings
+
+    print(f"INFO: Summarizing {len(checkin_entries)} check-ins in {len(chunks)} batches.")
+    results = await asyncio.gather(*(
+        generate_with_gemini([f"{instructions}\n(This is batch {index + 1} of {len(chunks)} from a longer period. "
+                              f"Summarize only these check-ins; the batches will be merged afterwards.)\n"] + chunk)
+        for index, chunk in enumerate(chunks)
+    ))
+    add_stage_timings(timings, [call_timings for _, call_timings in results])
+
+    summary_text, merge_timings = await merge_partial_summaries(instructions, [text for text, _ in results], on_text)
+    add_stage_timings(timings, [merge_timings])
+    return summary_text, timings
+
+
+# --- Summary archive: daily summaries rolled up into week/month windows ---
+SUM_PROMPT_HEADER = [
+    f"Provide a concise summary of the following daily check-ins from Discord users. "
+    f"Start with an 'Overall Summary' (1-3 bullet points on key themes). "
+    f"Then, add a section titled 'Individual Contributions'. "
+    f"For each user, provide a concise summary of their specific check-in, detailing their main activity/update. "
+    f"[... instructions truncated for brevity ...]\n"
+    f"Here are the check-ins:\n"
+]
+SUM_PROMPT_INSTRUCTIONS = "".join(SUM_PROMPT_HEADER)
+
+# Keeps references to fire-and-forget summary tasks so they are not garbage collected mid-run
+background_summary_tasks = set()
+
+
+async def build_sum_checkin_entries(channel, stored_checkins):
+    """Turns stored check-ins into per-check-in prompt entries (text plus first image) for the sum prompt."""
+    checkin_entries = []
+    checkin_images = await load_checkin_images(channel, stored_checkins)
+    for checkin in stored_checkins:
+        actual_checkin_content = checkin["content"]
+        checkin_header = (f"\n--- Check-in by {checkin['author_name']} "
+                          f"({checkin['created_at'].strftime('%H:%M')}):\n")
+        entry_parts = []
+
+        image_part, failed_filenames = checkin_images.get(checkin["message_id"], (None, []))
+
+        if not actual_checkin_content and checkin["attachments"]:
+            for filename in failed_filenames:
+                entry_parts.append(f"[Error loading image for image-only check-in: {filename}]")
+            if image_part:
+                entry_parts.append(checkin_header + "[No text provided in check-in message. Summarize based on image.]")
+                entry_parts.append(image_part)
+            else:
+                entry_parts.append(checkin_header + "[No text or valid image provided in check-in message, skipping.]")
+        elif actual_checkin_content:
+            entry_parts.append(checkin_header + actual_checkin_content)
+            for filename in failed_filenames:
+                entry_parts.append(f"[Error loading image: {filename}]")
+            entry_parts.append(image_part if image_part else "[No image provided with check-in.]")
+
+        if entry_parts:
+            checkin_entries.append(entry_parts)
+    return checkin_entries
+
+
+def day_bounds_utc(day, guild_tz):
+    """Returns the UTC (start, end) datetimes of a calendar day in the guild timezone."""
+    start_utc = guild_tz.localize(datetime.combine(day, time.min)).astimezone(pytz.utc)
+    end_utc = guild_tz.localize(datetime.combine(day + timedelta(days=1), time.min)).astimezone(pytz.utc)
+    return start_utc, end_utc
+
+
+async def load_archived_summaries(guild_id, channel_id, level, first_period, last_period):
+    """Loads archived summaries of one level between two period starts. Returns {period_start: summary}, or None on error."""
+    conn = get_db_connection()
+    if conn:
+        cur = None
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                f"""
+                SELECT period_start, summary FROM {SUMMARY_ARCHIVE_TABLE}
+                WHERE guild_id = %s AND channel_id = %s AND level = %s AND period_start BETWEEN %s AND %s
+                """,
+                (guild_id, channel_id, level, first_period, last_period)
+            )
+            return dict(cur.fetchall())
+        except (Exception, psycopg2.Error) as error:
+            print(f"ERROR: Error while loading archived {level} summaries for guild {guild_id}, channel {channel_id}: {error}")
+            return None
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                conn.close()
     else:
-        missed[user_id] = new_count
-        action_text = "updated"
+        print("ERROR: Could not establish database connection for loading archived summaries.")
+        return None
 
-    channel_data["missed_users"] = missed
-    await save_specific_data_to_db(ctx.guild.id, ctx.channel.id, channel_data)  # Persist change
 
-    # Prepare display name for message
-    try:
-        user_obj = await bot.fetch_user(user_id)
-        display_name = channel_data.get("userToReal", {}).get(str(user_id), user_obj.display_name)
-    except (discord.NotFound, discord.HTTPException):
-        display_name = f"Unknown User ({user_id})"
-
-    # Confirmation
-    if action_text == "updated":
-        await ctx.send(f"Missed check-ins for **{display_name}** have been set to **{new_count}** (change: {count_int:+}).")
-        print(f"INFO: Missed check-ins for {display_name} ({user_id}) changed by {count_int} in channel {ctx.channel.id}. New total: {new_count}")
-    elif action_text == "removed":
-        await ctx.send(f"**{display_name}** has been removed from the missed-checkin leaderboard (was {current}).")
-        print(f"INFO: Removed {display_name} ({user_id}) from missed leaderboard in channel {ctx.channel.id}.")
+async def save_archived_summary(guild_id, channel_id, level, period_start, summary_text, checkin_count):
+    """Stores (or replaces) one archived summary."""
+    conn = get_db_connection()
+    if conn:
+        cur = None
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                f"""
+                INSERT INTO {SUMMARY_ARCHIVE_TABLE} (guild_id, channel_id, level, period_start, summary, checkin_count)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                ON CONFLICT (guild_id, channel_id, level, period_start) DO UPDATE
+                SET summary = EXCLUDED.summary, checkin_count = EXCLUDED.checkin_count, created_at = NOW()
+                """,
+                (guild_id, channel_id, level, period_start, summary_text, checkin_count)
+            )
+            conn.commit()
+            print(f"DEBUG: Archived {level} summary for Guild {guild_id}, Channel {channel_id}, {period_start}.")
+        except (Exception, psycopg2.Error) as error:
+            print(f"ERROR: Error while archiving {level} summary for guild {guild_id}, channel {channel_id}: {error}")
+            if conn:
+                conn.rollback()
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                conn.close()
     else:
-        await ctx.send(f"No change was made for **{display_name}**; missed-checkin count remains at 0.")
-        print(f"INFO: No change for {display_name} ({user_id}) in missed leaderboard (already 0).")
+        print("ERROR: Could not establish database connection for archiving summary.")
 
 
+async def invalidate_archived_summaries(guild_id, channel_id, first_day, last_day):
+    """
+    Deletes archived summaries whose period overlaps first_day..last_day (day rows and the covering
+    week/month windows), so they are regenerated from the store, e.g. after a backfill added check-ins.
+    """
+    conn = get_db_connection()
+    if conn:
+        cur = None
+        try:
+            cur = conn.cursor()
+            overlaps = " OR ".join(["(level = %s AND period_start BETWEEN %s AND %s)"] * len(SUMMARY_ARCHIVE_LEVEL_DAYS))
+            params = [guild_id, channel_id]
+            for level, span_days in SUMMARY_ARCHIVE_LEVEL_DAYS.items():
+                params += [level, first_day - timedelta(days=span_days - 1), last_day]
+            cur.execute(f"DELETE FROM {SUMMARY_ARCHIVE_TABLE} WHERE guild_id = %s AND channel_id = %s AND ({overlaps})",
+                        params)
+            conn.commit()
+            print(f"DEBUG: Invalidated {cur.rowcount} archived summaries for Guild {guild_id}, Channel {channel_id}, "
+                  f"{first_day} to {last_day}.")
+        except (Exception, psycopg2.Error) as error:
+            print(f"ERROR: Error while invalidating archived summaries for guild {guild_id}, channel {channel_id}: {error}")
+            if conn:
+                conn.rollback()
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                conn.close()
+    else:
+        print("ERROR: Could not establish database connection for invalidating archived summaries.")
 
 
-@bot.command()
-async def w(ctx, min_lim: int):
-   """Sets a minimum number of words required in a check-in message. This is channel-specific."""
-   data = await get_channel_data(ctx.guild.id, ctx.channel.id)
-   if not await is_admin(ctx):
-       await ctx.send(f"{ctx.author.mention}, this command is only accessible to admins.")
-       return
-   if min_lim <= 0:
-       await ctx.send(f"{ctx.author.mention}, please enter a positive number (greater than zero).")
-       return
-   try:
-       data["word_min"] = min_lim
-       await ctx.send(f"Word minimum set to **{data['word_min']}** words for #{ctx.channel.name}.")
-       await save_specific_data_to_db(ctx.guild.id, ctx.channel.id, data)  # Save changes
-       print(f"INFO: Word minimum for channel {ctx.channel.id} set to {min_lim}.")
-   except ValueError:
-       await ctx.send(f"{ctx.author.mention}, please enter a valid number.")
+async def get_or_create_daily_summary(guild_id, channel, guild_tz, day, on_text=None):
+    """
+    Returns (summary_text, timings) for one completed calendar day, summarizing its stored check-ins
+    and archiving the result the first time. summary_text is "" for a day without check-ins; such days
+    are not archived, since a later backfill can still store check-ins for them.
+    """
+    archived = await load_archived_summaries(guild_id, channel.id, "day", day, day)
+    if archived and archived.get(day):
+        return archived[day], new_summary_timings()
 
+    start_utc, end_utc = day_bounds_utc(day, guild_tz)
+    stored_checkins = await fetch_stored_checkins(guild_id, channel.id, start_utc, end_utc)
+    if stored_checkins is None:
+        raise RuntimeError("could not load check-ins from the database")
 
+    summary_text, timings = "", new_summary_timings()
+    checkin_entries = await build_sum_checkin_entries(channel, stored_checkins)
+    if checkin_entries:
+        summary_text, timings = await summarize_map_reduce(SUM_PROMPT_HEADER, checkin_entries, on_text)
+        await save_archived_summary(guild_id, channel.id, "day", day, summary_text, len(stored_checkins))
+    return summary_text, timings
 
 
-@bot.command()
-async def d(ctx, *args: str):
-   """
-   Manages banned users for check-ins in this channel: ban, unban, or list.
-   Accepts user mentions or IDs. This is channel-specific.
-   When a user is banned, they are also removed from all leaderboards.
-   """
-   data = await get_channel_data(ctx.guild.id, ctx.channel.id)
-   if not await is_admin(ctx):
-       await ctx.send(f"{ctx.author.mention}, this command is only accessible to admins.")
-       return
-   if not args:
-       await ctx.send(
-           f"Usage: `c.d @User1 @User2 ...` to ban users, `c.d -u @User1 @User2 ...` to unban, or `c.d -list` to view banned users for #{ctx.channel.name}.")
-       return
+async def summarize_days_hierarchically(guild_id, channel, guild_tz, days, level, on_text=None):
+    """
+    Summarizes the last `days` completed days plus today so far. The completed part is a merge of the
+    archived daily summaries and is itself archived under `level`; only today's check-ins are read raw.
+    Returns (summary_text, timings); summary_text is "" if there were no check-ins at all.
+    """
+    timings = new_summary_timings()
+    today = datetime.now(guild_tz).date()
+    first_day = today - timedelta(days=days)
+    last_day = today - timedelta(days=1)
+
+    archived_window = await load_archived_summaries(guild_id, channel.id, level, first_day, first_day)
+    if archived_window and first_day in archived_window:
+        completed_text = archived_window[first_day]
+    else:
+        daily_summaries = await load_archived_summaries(guild_id, channel.id, "day", first_day, last_day) or {}
+        # Empty archived days (from before they were skipped) are checked again, too
+        missing_days = [first_day + timedelta(days=i) for i in range(days)
+                        if not daily_summaries.get(first_day + timedelta(days=i))]
+        if missing_days:
+            print(f"INFO: Generating {len(missing_days)} missing daily summaries for channel {channel.id}.")
+            results = await asyncio.gather(*(
+                get_or_create_daily_summary(guild_id, channel, guild_tz, day) for day in missing_days
+            ))
+            add_stage_timings(timings, [day_timings for _, day_timings in results])
+            daily_summaries.update({day: text for day, (text, _) in zip(missing_days, results)})
+
+        labelled_summaries = [f"Summary for {day.strftime('%Y-%m-%d')}:\n{daily_summaries[day]}"
+                              for day in sorted(daily_summaries) if daily_summaries[day]]
+        completed_text, merge_timings = await merge_partial_summaries(SUM_PROMPT_INSTRUCTIONS, labelled_summaries)
+        add_stage_timings(timings, [merge_timings])
+        await save_archived_summary(guild_id, channel.id, level, first_day, completed_text, len(labelled_summaries))
+
+    parts = []
+    if completed_text:
+        parts.append(f"Summary for {first_day.strftime('%Y-%m-%d')} to {last_day.strftime('%Y-%m-%d')}:\n{completed_text}")
+
+    today_start_utc, _ = day_bounds_utc(today, guild_tz)
+    today_checkins = await fetch_stored_checkins(guild_id, channel.id, today_start_utc, datetime.now(pytz.utc))
+    if today_checkins is None:
+        raise RuntimeError("could not load check-ins from the database")
+    today_entries = await build_sum_checkin_entries(channel, today_checkins)
+    if today_entries:
+        today_text, today_timings = await summarize_map_reduce(SUM_PROMPT_HEADER, today_entries)
+        add_stage_timings(timings, [today_timings])
+        parts.append(f"Summary for {today.strftime('%Y-%m-%d')} (so far):\n{today_text}")
+
+    summary_text, merge_timings = await merge_partial_summaries(SUM_PROMPT_INSTRUCTIONS, parts, on_text)
+    add_stage_timings(timings, [merge_timings])
+    return summary_text, timings
+
+
+async def archive_daily_summary_in_background(guild_id, channel, guild_tz, day):
+    """Generates and archives a day's summary after a reset, logging instead of raising on failure."""
+    summary_metrics_context.set((guild_id, channel.id, "archive"))
+    try:
+        await get_or_create_daily_summary(guild_id, channel, guild_tz, day)
+    except Exception as e:
+        print(f"ERROR: Could not archive daily summary for channel {channel.id} in guild {guild_id} ({day}): {e}")
 
 
-   if args[0].lower() == "-list":
-       if data["banned_users"]:
-           banned_mentions = []
-           for user_id in data["banned_users"]:
-               try:
-                   user = await bot.fetch_user(user_id)
-                   banned_mentions.append(f"{user.display_name} (<@{user_id}>)")
-               except (discord.NotFound, discord.HTTPException):
-                   banned_mentions.append(f"Unknown User (<@{user_id}>)")
-           banned_list = '\n'.join(banned_mentions)
-           await ctx.send(f"**Banned users for #{ctx.channel.name}**:\n{banned_list}")
-       else:
-           await ctx.send(f"No users are currently banned from checking in this channel.")
-       return
+# --- Local extractive fallback when the model is unavailable, slow or failing ---
+SUMMARY_LATENCY_BUDGET_SECONDS = float(os.getenv("SUMMARY_LATENCY_BUDGET_SECONDS", "45"))
+EXTRACTIVE_OVERALL_SENTENCES = 3
+EXTRACTIVE_SENTENCES_PER_USER = 2
+EXTRACTIVE_MAX_SENTENCE_LENGTH = 300
 
 
-   target_user_ids = set()
-   # Determine if it's an unban operation based on the first argument
-   is_unban = args[0].lower() == "-u"
-   users_to_process = args[1:] if is_unban else args
+def split_sentences(text):
+    """Splits check-in text into sentences at sentence punctuation and line breaks."""
+    return [sentence.strip() for sentence in re.split(r"(?<=[.!?])\s+|\n+", text or "") if len(sentence.strip()) >= 3]
 
 
-   if not users_to_process:
-       await ctx.send("No users specified.")
-       return
+def extractive_summary(stored_checkins, query=None):
+    """
+    Builds a summary from the check-ins' own sentences, without any model. Sentences are ranked by
+    centrality: how many other sentences share their terms. With a query, only sentences mentioning
+    a query term are kept, and more matches rank higher. Returns "" if no sentence qualifies.
+    """
+    query_terms = set(tokenize_for_search(query)) if query else set()
+    sentences = []  # (author, position, sentence, unique terms)
+    sentence_frequency = {}
+    for checkin in stored_checkins:
+        for sentence in split_sentences(checkin["content"]):
+            terms = set(tokenize_for_search(sentence))
+            if not terms or (query_terms and not query_terms & terms):
+                continue
+            sentences.append((checkin["author_name"], len(sentences), sentence, terms))
+            for term in terms:
+                sentence_frequency[term] = sentence_frequency.get(term, 0) + 1
+    if not sentences:
+        return ""
+
+    scores = {}
+    for author, position, sentence, terms in sentences:
+        shared = 0
+        for term in terms:
+            shared += sentence_frequency[term] - 1
+        scores[position] = (shared / len(terms) ** 0.5) * (1 + len(query_terms & terms))
+
+    def clip(sentence):
+        if len(sentence) > EXTRACTIVE_MAX_SENTENCE_LENGTH:
+            return sentence[:EXTRACTIVE_MAX_SENTENCE_LENGTH - 3] + "..."
+        return sentence
+
+    ranked = sorted(sentences, key=lambda item: scores[item[1]], reverse=True)
+    lines = ["**Overall Summary**"]
+    for author, _, sentence, _ in ranked[:EXTRACTIVE_OVERALL_SENTENCES]:
+        lines.append(f"• {author}: {clip(sentence)}")
+
+    lines.extend(["", "**Individual Contributions**"])
+    authors = []
+    for author, _, _, _ in sentences:
+        if author not in authors:
+            authors.append(author)
+    for author in authors:
+        best = [item for item in ranked if item[0] == author][:EXTRACTIVE_SENTENCES_PER_USER]
+        best.sort(key=lambda item: item[1])  # Back in posting order
+        lines.append(f"• **{author}**: " + " ".join(clip(sentence) for _, _, sentence, _ in best))
+    return "\n".join(lines)
+
+
+async def run_with_fallback(model_call, fallback):
+    """
+    Runs model_call() (returning ((summary_text, timings), from_cache)) within SUMMARY_LATENCY_BUDGET_SECONDS.
+    Without an API key, past the budget, or on a model error, fallback() provides the text instead.
+    Returns (((summary_text, timings), from_cache), fallback_reason); fallback_reason is None when the model
+    answered. A call that misses the budget keeps running in the background, so its result still reaches the cache.
+    """
+    if not os.getenv("GOOGLE_API_KEY"):
+        fallback_reason = "GOOGLE_API_KEY is not set"
+    else:
+        model_task = asyncio.ensure_future(model_call())
+        try:
+            done, _ = await asyncio.wait({model_task}, timeout=SUMMARY_LATENCY_BUDGET_SECONDS)
+        except asyncio.CancelledError:
+            # The job was cancelled (c.jobs cancel, deleted command message); don't leave the model call running
+            model_task.cancel()
+            raise
+        if not done:
+            fallback_reason = f"Google Gemini did not answer within {SUMMARY_LATENCY_BUDGET_SECONDS:.0f}s"
+            background_summary_tasks.add(model_task)
+            model_task.add_done_callback(background_summary_tasks.discard)
+            model_task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        elif model_task.exception() is not None:
+            fallback_reason = f"Google Gemini failed: {model_task.exception()}"
+        else:
+            return model_task.result(), None
+
+    print(f"WARNING: Using extractive summary fallback: {fallback_reason}.")
+    return ((await fallback(), new_summary_timings()), False), fallback_reason
 
 
-   for arg in users_to_process:
-       user_id = None
-       if arg.startswith('<@') and arg.endswith('>'):
-           try:
-               user_id = int(arg.strip('<@!>'))
-           except ValueError:
-               pass
-       elif arg.isdigit():
-           user_id = int(arg)
-       else:  # Try to find by name (less reliable)
-           member = discord.utils.get(ctx.guild.members, name=arg)
-           if member:
-               user_id = member.id
+async def fallback_summary_for_window(guild_id, channel_id, start_time_utc, end_time_utc, query=None):
+    """Extractive summary of a window's stored check-ins, optionally restricted to a topic. Raises if they cannot be loaded."""
+    stored_checkins = await fetch_stored_checkins(guild_id, channel_id, start_time_utc, end_time_utc)
+    if stored_checkins is None:
+        raise RuntimeError("could not load check-ins from the database")
+    return extractive_summary(stored_checkins, query)
 
 
-       if user_id:
-           target_user_ids.add(user_id)
-       else:
-           await ctx.send(f"Could not find user for argument '{arg}'. Please use a mention or user ID.")
-           return
+# --- Progressive summary replies: a placeholder embed edited as streamed text arrives ---
+SUMMARY_PAGE_LENGTH = 4000  # Embed descriptions allow 4096 characters
+STREAM_EDIT_INTERVAL_SECONDS = 1.5  # Keeps edits well inside Discord's per-channel rate limit
 
 
-   if is_unban:
-       unbanned_ids = target_user_ids.intersection(data["banned_users"])
-       if unbanned_ids:
-           data["banned_users"] -= unbanned_ids
-           unbanned_mentions = [f"<@{uid}>" for uid in unbanned_ids]
-           await ctx.send(f"**Unbanned users for #{ctx.channel.name}**:\n{', '.join(unbanned_mentions)}")
-           print(f"INFO: Unbanned users {unbanned_ids} from channel {ctx.channel.id}.")
-       else:
-           await ctx.send("No matching users were banned in this channel.")
-   else:  # Ban users
-       banning_ids = target_user_ids
-       if banning_ids:
-           data["banned_users"].update(banning_ids)
-           # --- NEW: Remove banned users from leaderboards ---
-           for user_id_to_ban in banning_ids:
-               data["users"].pop(user_id_to_ban, None)
-               data["missed_users"].pop(user_id_to_ban, None)
-               print(f"INFO: Removed user {user_id_to_ban} from leaderboards in channel {ctx.channel.id} due to ban.")
-           # --- END NEW ---
-           banned_mentions = [f"<@{uid}>" for uid in banning_ids]
-           await ctx.send(f"**Banned users for #{ctx.channel.name}**:\n{', '.join(banned_mentions)}")
-           print(f"INFO: Banned users {banning_ids} from channel {ctx.channel.id}.")
-       else:
-           await ctx.send("No valid users specified to ban in this channel.")
-   await save_specific_data_to_db(ctx.guild.id, ctx.channel.id, data)  # Save changes
+def paginate_summary(text, page_length=SUMMARY_PAGE_LENGTH):
+    """Splits text into pages of at most page_length characters, breaking at line ends where possible."""
+    pages = []
+    while len(text) > page_length:
+        cut = text.rfind("\n", 0, page_length)
+        if cut <= 0:
+            cut = page_length
+        pages.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    pages.append(text)
+    return pages
 
 
+async def start_summary_reply(ctx, title, color):
+    """Sends the placeholder embed of a summary reply and starts its throttled editor. Returns the reply state."""
+    message = await ctx.send(embed=discord.Embed(title=title, description="*Summarizing check-ins...*", color=color))
+    reply = {"ctx": ctx, "title": title, "color": color, "messages": [message], "pages": [],
+             "text": "", "rendered_text": "", "editor": None}
+    reply["editor"] = asyncio.create_task(edit_summary_reply_periodically(reply))
+    return reply
 
 
-@bot.command()
-async def tz(ctx, *timezoneset):
-   """
-   Sets the timezone for the guild's check-in resets. This is a guild-wide setting.
-   Use 'list' to see all available timezones.
-   """
-   guild_settings = await get_guild_settings(ctx.guild.id)
-   if not await is_admin(ctx):
-       await ctx.send(f"{ctx.author.mention}, this command is only accessible to admins.")
-       return
-   if not timezoneset:
-       await ctx.send(f"Usage: `c.tz list` to view all timezones or `c.tz [timezone]` to set one.")
-       return
-   if timezoneset[0].lower() == "list":
-       tz_list = "\n".join(pytz.all_timezones)
-       file_path = "/tmp/timezones.txt"  # Temporary file for sending
-       with open(file_path, "w", encoding="utf-8") as file:
-           file.write(tz_list)
-       try:
-           await ctx.send(f"**List of available timezones:**", file=discord.File(file_path))
-       except discord.errors.HTTPException as e:
-           await ctx.send(f"Could not send timezone list (file too large or other error): {e}")
-       finally:
-           if os.path.exists(file_path):
-               os.remove(file_path)
-       return
-   if timezoneset:
-       tz_string = " ".join(timezoneset)
-       if tz_string in pytz.all_timezones:
-           guild_settings["timezone"] = tz_string
-           await ctx.send(f"Guild timezone set to **{tz_string}**.")
-           await save_specific_data_to_db(ctx.guild.id, 0, guild_settings)  # Save guild-wide settings
-           print(f"INFO: Guild {ctx.guild.id} timezone set to {tz_string}.")
-       else:
-           await ctx.send(f"Invalid timezone. Use `c.tz list` to see valid timezones.")
+def update_summary_reply(reply, text):
+    """on_text callback for a streamed summary: records the text so far for the next throttled edit."""
+    reply["text"] = text
 
 
+async def render_summary_reply(reply, text, footer=None):
+    """Shows text across the reply's embeds, editing only pages that changed and sending new ones for overflow."""
+    pages = paginate_summary(text)
+    for index, page in enumerate(pages):
+        title = reply["title"] if len(pages) == 1 else f"{reply['title']} ({index + 1}/{len(pages)})"
+        page_footer = footer if index == len(pages) - 1 else None
+        if index < len(reply["pages"]) and reply["pages"][index] == (title, page, page_footer):
+            continue
+        embed = discord.Embed(title=title, description=page, color=reply["color"])
+        if page_footer:
+            embed.set_footer(text=page_footer)
+        if index < len(reply["messages"]):
+            await reply["messages"][index].edit(embed=embed)
+        else:
+            reply["messages"].append(await reply["ctx"].send(embed=embed))
+    for message in reply["messages"][len(pages):]:
+        await message.delete()
+    reply["messages"] = reply["messages"][:len(pages)]
+    reply["pages"] = [
+        (reply["title"] if len(pages) == 1 else f"{reply['title']} ({index + 1}/{len(pages)})", page,
+         footer if index == len(pages) - 1 else None)
+        for index, page in enumerate(pages)
+    ]
 
 
-@bot.command()
-async def lr(ctx, *leader_input):
-   """Resets either the check-in leaderboard (wl) or the missed check-in leaderboard (ll). This is channel-specific."""
-   data = await get_channel_data(ctx.guild.id, ctx.channel.id)
-   if not await is_admin(ctx):
-       await ctx.send(f"{ctx.author.mention}, this command is only accessible to admins.")
-       return
-   if not leader_input:
-       await ctx.send("Please select a leaderboard to reset (either 'wl' or 'll').")
-       return
-   elif leader_input[0].lower() == "wl":
-       data["users"] = {}
-       await ctx.send("Check-in leaderboard for this channel has been reset.")
-       await save_specific_data_to_db(ctx.guild.id, ctx.channel.id, data)  # Save changes
-       print(f"INFO: Check-in leaderboard for channel {ctx.channel.id} reset.")
-   elif leader_input[0].lower() == "ll":
-       data["missed_users"] = {}
-       await ctx.send("Missed check-in leaderboard for this channel has been reset.")
-       await save_specific_data_to_db(ctx.guild.id, ctx.channel.id, data)  # Save changes
-       print(f"INFO: Missed check-in leaderboard for channel {ctx.channel.id} reset.")
-   else:
-       await ctx.send(
-           "Invalid leaderboard specified. Use 'wl' to reset the check-in leaderboard or 'll' to reset the missed check-in leaderboard.")
+async def edit_summary_reply_periodically(reply):
+    """Renders newly streamed text at most every STREAM_EDIT_INTERVAL_SECONDS until cancelled."""
+    while True:
+        await asyncio.sleep(STREAM_EDIT_INTERVAL_SECONDS)
+        text = reply["text"]
+        if not text or text == reply["rendered_text"]:
+            continue
+        try:
+            await render_summary_reply(reply, text + " \u258c")
+            reply["rendered_text"] = text
+        except discord.HTTPException as e:
+            print(f"WARNING: Could not update streamed summary in channel {reply['ctx'].channel.id}: {e}")
 
 
+async def finish_summary_reply(reply, text, footer):
+    """Stops streaming edits and shows the final text with its footer."""
+    reply["editor"].cancel()
+    await render_summary_reply(reply, text, footer)
 
 
-@bot.command()
-async def r(ctx, resetTime: str):
-   """
-   Sets the daily reset time for check-ins in HHMMSS format (e.g., 235959 for 11:59:59 PM) for this channel.
-   """
-   data = await get_channel_data(ctx.guild.id, ctx.channel.id)
-   if not await is_admin(ctx):
-       await ctx.send(f"{ctx.author.mention}, this command is only accessible to admins.")
-       return
-   if len(resetTime) != 6 or not resetTime.isdigit():
-       await ctx.send(f"{ctx.author.mention}, please enter a 6-digit number (e.g., 235959 for 11:59:59 PM).")
-       return
+async def abort_summary_reply(reply):
+    """Stops streaming edits and removes the reply's messages, for when an error or notice is sent instead."""
+    reply["editor"].cancel()
+    for message in reply["messages"]:
+        try:
+            await message.delete()
+        except discord.HTTPException:
+            pass
 
 
-   try:
-       hours = int(resetTime[:2])
-       minutes = int(resetTime[2:4])
-       seconds = int(resetTime[4:])
+# --- Result cache and single-flight deduplication for sum/topic ---
+SUMMARY_RESULT_CACHE_MAX_ENTRIES = 256
 
+# Structure: {(command, guild_id, channel_id, normalized range or topic): (fingerprint, result)}
+summary_result_cache = {}
+# Structure: {(cache_key, fingerprint): {"task": asyncio.Task, "waiters": int}} for computations currently running
+summary_inflight = {}
 
-       if not (0 <= hours <= 23 and 0 <= minutes <= 59 and 0 <= seconds <= 59):
-           await ctx.send(f"{ctx.author.mention}, please ensure the time is valid (HH:00-23, MM:00-59, SS:00-59).")
-           return
 
+async def load_checkin_fingerprint(guild_id, channel_id, start_time_utc, end_time_utc):
+    """
+    Returns a cheap fingerprint (count, newest message id) of the stored check-ins in a window,
+    which changes as soon as a new check-in lands in it. Returns None on error.
+    """
+    conn = get_db_connection()
+    if conn:
+        cur = None
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                f"""
+                SELECT COUNT(*), COALESCE(MAX(message_id), 0) FROM {CHECKIN_MESSAGE_TABLE}
+                WHERE guild_id = %s AND channel_id = %s AND created_at > %s AND created_at < %s
+                """,
+                (guild_id, channel_id, start_time_utc, end_time_utc)
+            )
+            return tuple(cur.fetchone())
+        except (Exception, psycopg2.Error) as error:
+            print(f"ERROR: Error while fingerprinting check-ins for guild {guild_id}, channel {channel_id}: {error}")
+            return None
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                conn.close()
+    else:
+        print("ERROR: Could not establish database connection for fingerprinting check-ins.")
+        return None
 
-       data["reset_time"] = resetTime
-       await ctx.send(f"Reset time for this channel set to **{hours:02}:{minutes:02}:{seconds:02}**.")
-       await save_specific_data_to_db(ctx.guild.id, ctx.channel.id, data)  # Save changes
-       print(f"INFO: Reset time for channel {ctx.channel.id} set to {resetTime}.")
-   except ValueError:
-       await ctx.send(f"{ctx.author.mention}, invalid time format. Please use a 6-digit number.")
 
+async def run_single_flight(cache_key, fingerprint, compute):
+    """
+    Returns (result, shared). A cached result with the same fingerprint is returned as-is; an identical
+    computation already in flight is awaited instead of started again; otherwise compute() runs and its
+    result is cached. shared is True when this caller did not run compute() itself.
+    A None fingerprint (lookup failed) always computes and caches nothing.
+    """
+    if fingerprint is None:
+        return await compute(), False
+
+    cached = summary_result_cache.get(cache_key)
+    if cached and cached[0] == fingerprint:
+        return cached[1], True
+
+    flight_key = (cache_key, fingerprint)
+    flight = summary_inflight.get(flight_key)
+    shared = flight is not None
+    if flight is None:
+        async def compute_and_cache():
+            try:
+                result = await compute()
+            finally:
+                if summary_inflight.get(flight_key) is flight:
+                    summary_inflight.pop(flight_key, None)
+            summary_result_cache.pop(cache_key, None)
+            summary_result_cache[cache_key] = (fingerprint, result)
+            while len(summary_result_cache) > SUMMARY_RESULT_CACHE_MAX_ENTRIES:
+                summary_result_cache.pop(next(iter(summary_result_cache)))
+            return result
+
+        # The computation runs as its own task, so it outlives whichever caller started it as long
+        # as someone is still waiting for it
+        flight = {"task": None, "waiters": 0}
+        flight["task"] = asyncio.ensure_future(compute_and_cache())
+        flight["task"].add_done_callback(lambda task: task.cancelled() or task.exception())
+        summary_inflight[flight_key] = flight
+
+    flight["waiters"] += 1
+    try:
+        # Shielded so a cancelled caller only stops the computation when nobody else is waiting for it
+        return await asyncio.shield(flight["task"]), shared
+    except asyncio.CancelledError:
+        if flight["waiters"] == 1 and not flight["task"].done():
+            flight["task"].cancel()
+            if summary_inflight.get(flight_key) is flight:
+                summary_inflight.pop(flight_key, None)  # Later callers start afresh rather than join a cancelled one
+        raise
+    finally:
+        flight["waiters"] -= 1
+
+
+# --- Rolling "since last reset" summaries ---
+ROLLING_SUMMARY_INTERVAL_MINUTES = int(os.getenv("ROLLING_SUMMARY_INTERVAL_MINUTES", "10"))
+ROLLING_SUMMARY_BATCH_SIZE = 20
+
+# Structure: {(guild_id, channel_id): {"window_start", "summary", "last_message_at", "checkin_count", "updated_at"}}
+rolling_summary_cache = {}
+rolling_summary_locks = {}  # {(guild_id, channel_id): asyncio.Lock}, so a channel is never folded twice at once
+
+
+async def load_rolling_summary(guild_id, channel_id):
+    """Loads the rolling summary state for a guild-channel pair. Returns None if there is none or on error."""
+    conn = get_db_connection()
+    if conn:
+        cur = None
+        try:
+            cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cur.execute(
+                f"SELECT window_start, summary, last_message_at, checkin_count, updated_at FROM {ROLLING_SUMMARY_TABLE} "
+                f"WHERE guild_id = %s AND channel_id = %s",
+                (guild_id, channel_id))
+            record = cur.fetchone()
+            return dict(record) if record else None
+        except (Exception, psycopg2.Error) as error:
+            print(f"ERROR: Error while loading rolling summary for guild {guild_id}, channel {channel_id}: {error}")
+            return None
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                conn.close()
+    else:
+        print("ERROR: Could not establish database connection for loading rolling summary.")
+        return None
 
 
+async def save_rolling_summary(guild_id, channel_id, state):
+    """Saves the rolling summary state for a guild-channel pair and updates the cache."""
+    rolling_summary_cache[(guild_id, channel_id)] = state
+    conn = get_db_connection()
+    if conn:
+        cur = None
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                f"""
+                INSERT INTO {ROLLING_SUMMARY_TABLE}
+                    (guild_id, channel_id, window_start, summary, last_message_at, checkin_count, updated_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (guild_id, channel_id) DO UPDATE
+                SET window_start = EXCLUDED.window_start, summary = EXCLUDED.summary,
+                    last_message_at = EXCLUDED.last_message_at, checkin_count = EXCLUDED.checkin_count,
+                    updated_at = EXCLUDED.updated_at
+                """,
+                (guild_id, channel_id, state["window_start"], state["summary"], state["last_message_at"],
+                 state["checkin_count"], state["updated_at"])
+            )
+            conn.commit()
+        except (Exception, psycopg2.Error) as error:
+            print(f"ERROR: Error while saving rolling summary for guild {guild_id}, channel {channel_id}: {error}")
+            if conn:
+                conn.rollback()
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                conn.close()
+    else:
+        print("ERROR: Could not establish database connection for saving rolling summary.")
 
-@bot.command()
-async def cr(ctx):
-   """Shows the current daily reset time for this channel and the guild's timezone."""
-   data = await get_channel_data(ctx.guild.id, ctx.channel.id)
-   reset_time_str = data.get("reset_time")
-   guild_settings = await get_guild_settings(ctx.guild.id)
-   timezone_str = guild_settings.get("timezone", "America/Los_Angeles")  # Provide default
 
+async def get_rolling_summary(guild_id, channel_id):
+    """Retrieves the rolling summary state from the cache, loading from DB if not present."""
+    key = (guild_id, channel_id)
+    if key not in rolling_summary_cache:
+        state = await load_rolling_summary(guild_id, channel_id)
+        if state is None:
+            return None
+        rolling_summary_cache[key] = state
+    return rolling_summary_cache[key]
 
-   if not reset_time_str:
-       await ctx.send(f"No reset time configured for this channel. The guild timezone is **{timezone_str}**.")
-       return
 
+async def fold_rolling_summary(guild_id, channel, window_start):
+    """
+    Folds check-ins that arrived since the last fold into the channel's rolling summary, in batches of
+    ROLLING_SUMMARY_BATCH_SIZE. A new window_start (a reset happened) starts a fresh summary.
+    """
+    key = (guild_id, channel.id)
+    summary_metrics_context.set((guild_id, channel.id, "rolling"))
+    async with rolling_summary_locks.setdefault(key, asyncio.Lock()):
+        state = await get_rolling_summary(guild_id, channel.id)
+        if not state or state["window_start"] != window_start:
+            state = {"window_start": window_start, "summary": "", "last_message_at": window_start,
+                     "checkin_count": 0, "updated_at": None}
+
+        new_checkins = await fetch_stored_checkins(guild_id, channel.id, state["last_message_at"], datetime.now(pytz.utc))
+        if not new_checkins:
+            return state
+
+        for batch_start in range(0, len(new_checkins), ROLLING_SUMMARY_BATCH_SIZE):
+            batch = new_checkins[batch_start:batch_start + ROLLING_SUMMARY_BATCH_SIZE]
+            checkin_entries = await build_sum_checkin_entries(channel, batch)
+            if checkin_entries:
+                if state["summary"]:
+                    fold_header = [
+                        f"{SUM_PROMPT_INSTRUCTIONS}\n"
+                        f"Below is the running summary of earlier check-ins from the same period, followed by new "
+                        f"check-ins. Return the complete updated summary in the same format, integrating the new "
+                        f"check-ins into it.\n--- Running summary ---\n{state['summary']}\n--- New check-ins ---\n"
+                    ]
+                else:
+                    fold_header = SUM_PROMPT_HEADER
+                state["summary"], _ = await summarize_map_reduce(fold_header, checkin_entries)
+            state["last_message_at"] = batch[-1]["created_at"]
+            state["checkin_count"] += len(batch)
+            state["updated_at"] = datetime.now(pytz.utc)
+            await save_rolling_summary(guild_id, channel.id, state)
+        print(f"INFO: Folded {len(new_checkins)} check-ins into the rolling summary of channel {channel.id}.")
+        return state
+
+
+async def fold_rolling_summary_in_background(guild_id, channel, window_start):
+    """Runs fold_rolling_summary, logging instead of raising on failure."""
+    try:
+        await fold_rolling_summary(guild_id, channel, window_start)
+    except Exception as e:
+        print(f"ERROR: Could not update rolling summary for channel {channel.id} in guild {guild_id}: {e}")
+
+
+# --- Background jobs: bounded worker pools, status messages and c.jobs ---
+# Summary jobs share the model's concurrency; maintenance jobs (name refreshes, backfills, exports) get their own workers
+JOB_POOL_SIZES = {"summary": GEMINI_MAX_CONCURRENCY, "maintenance": 2}
+JOB_PROGRESS_INTERVAL_SECONDS = 2.0  # Minimum time between status message edits
+
+# Per-guild token buckets and priorities for summary jobs
+SUMMARY_BUCKET_CAPACITY = float(os.getenv("SUMMARY_BUCKET_CAPACITY", "10"))
+SUMMARY_BUCKET_REFILL_PER_MINUTE = float(os.getenv("SUMMARY_BUCKET_REFILL_PER_MINUTE", "0.5"))
+SUMMARY_PRIORITY_INTERACTIVE = 0  # Single-day sums and topics
+SUMMARY_PRIORITY_LONG_RANGE = 1  # Week/month sums
+SUMMARY_JOB_COSTS = {SUMMARY_PRIORITY_INTERACTIVE: 1, SUMMARY_PRIORITY_LONG_RANGE: 3}
+SUMMARY_ARCHIVE_LEVEL_DAYS = {"day": 1, "week": 7, "month": 30}  # Days covered by an archived summary of each level
+SUM_WEEK_ARGUMENTS = ["week", "1week", "7d", "7days"]
+SUM_MONTH_ARGUMENTS = ["month", "1month", "30d", "30days"]
+
+job_queues = {}  # {pool: asyncio.PriorityQueue of (priority, job id, job)}, created with the pool's workers on first use
+job_workers = []
+job_sequence = 0
+
+# Queued and running jobs
+# Structure: {job_id: {"id", "kind", "pool", "guild_id", "channel_id", "message_id", "author_id", "priority",
+#                      "status", "run", "task", "show_status", "status_message", "progress",
+#                      "progress_updated_at", "created_at"}}
+jobs = {}
+
+# Structure: {guild_id: [tokens, last refill (monotonic seconds)]}
+summary_token_buckets = {}
+
+
+def take_summary_tokens(guild_id, cost):
+    """Takes cost tokens from the guild's bucket. Returns 0 on success, otherwise the seconds until enough refill."""
+    now = time_module.monotonic()
+    bucket = summary_token_buckets.setdefault(guild_id, [SUMMARY_BUCKET_CAPACITY, now])
+    bucket[0] = min(SUMMARY_BUCKET_CAPACITY, bucket[0] + (now - bucket[1]) * SUMMARY_BUCKET_REFILL_PER_MINUTE / 60)
+    bucket[1] = now
+    if bucket[0] >= cost:
+        bucket[0] -= cost
+        return 0
+    return (cost - bucket[0]) * 60 / SUMMARY_BUCKET_REFILL_PER_MINUTE
+
+
+def queued_job_position(job):
+    """1-based position of a queued job in its pool, in the order workers will take them."""
+    position = 1
+    for other in jobs.values():
+        if other is not job and other["pool"] == job["pool"] and other["status"] == "queued" and \
+                (other["priority"], other["id"]) < (job["priority"], job["id"]):
+            position += 1
+    return position
+
+
+def describe_job(job):
+    """One-line description of a job for status messages and c.jobs."""
+    return f"Job #{job['id']} `{job['kind']}`"
+
+
+async def set_job_status_message(job, text):
+    """Edits a job's status message, or deletes it when text is None. Failures are only logged."""
+    if not job["status_message"]:
+        return
+    try:
+        if text is None:
+            await job["status_message"].delete()
+            job["status_message"] = None
+        else:
+            await job["status_message"].edit(content=text)
+    except discord.HTTPException as e:
+        print(f"WARNING: Could not update status message of job {job['id']}: {e}")
 
-   try:
-       reset_hour = int(reset_time_str[:2])
-       reset_minute = int(reset_time_str[2:4])
-       reset_second = int(reset_time_str[4:])
 
+async def report_job_progress(job, progress, force=False):
+    """Records a running job's progress and shows it on the status message, at most every JOB_PROGRESS_INTERVAL_SECONDS."""
+    job["progress"] = progress
+    now = time_module.monotonic()
+    if job["show_status"] and (force or now - job["progress_updated_at"] >= JOB_PROGRESS_INTERVAL_SECONDS):
+        job["progress_updated_at"] = now
+        await set_job_status_message(job, f"🛠️ {describe_job(job)} is running: {progress}")
 
-       period = "AM"
-       reset_hour_12 = reset_hour
-       if reset_hour == 0:
-           reset_hour_12 = 12
-       elif reset_hour == 12:
-           period = "PM"
-       elif reset_hour > 12:
-           reset_hour_12 = reset_hour - 12
-           period = "PM"
 
+async def run_job_worker(pool):
+    """Takes jobs off a pool's queue, highest priority first, and runs them one at a time."""
+    while True:
+        _, _, job = await job_queues[pool].get()
+        try:
+            if job["status"] == "cancelled":
+                continue
+            job["status"] = "running"
+            started_at = time_module.perf_counter()
+            if job["show_status"]:
+                await report_job_progress(job, "starting", force=True)
+            else:
+                await set_job_status_message(job, None)  # Only the "queued" notice; the job replies itself
+            job["task"] = asyncio.create_task(job["run"](job))
+            await asyncio.wait({job["task"]})
+
+            elapsed = time_module.perf_counter() - started_at
+            if job["task"].cancelled():
+                print(f"INFO: {describe_job(job)} in guild {job['guild_id']} was cancelled.")
+                if job["show_status"]:
+                    await set_job_status_message(job, f"🚫 {describe_job(job)} was cancelled.")
+            elif job["task"].exception():
+                print(f"ERROR: {describe_job(job)} in guild {job['guild_id']} failed: {job['task'].exception()}")
+                if job["show_status"]:
+                    await set_job_status_message(job, f"❌ {describe_job(job)} failed: {job['task'].exception()}")
+            elif job["show_status"]:
+                await set_job_status_message(job, f"✅ {describe_job(job)} finished in {elapsed:.0f}s: {job['progress']}")
+        finally:
+            jobs.pop(job["id"], None)
+            job_queues[pool].task_done()
+
+
+async def submit_job(ctx, kind, run, pool="summary", priority=0, cost=None, show_status=False):
+    """
+    Queues run(job) on a worker pool and returns the job straight away, or None if the guild is over its
+    summary quota (when cost is given). Jobs with show_status get a status message that reports progress;
+    others only get a "queued" notice when all of the pool's workers are busy.
+    """
+    global job_sequence
+    if cost is not None:
+        retry_after = take_summary_tokens(ctx.guild.id, cost)
+        if retry_after:
+            await ctx.send(f"{ctx.author.mention}, this server has used up its summary quota for now. "
+                           f"Please try again in about {max(1, round(retry_after / 60))} minute(s).")
+            return None
+
+    if pool not in job_queues:
+        job_queues[pool] = asyncio.PriorityQueue()
+        for _ in range(JOB_POOL_SIZES[pool]):
+            job_workers.append(asyncio.create_task(run_job_worker(pool)))
+
+    job_sequence += 1
+    job = {"id": job_sequence, "kind": kind, "pool": pool, "guild_id": ctx.guild.id, "channel_id": ctx.channel.id,
+           "message_id": ctx.message.id, "author_id": ctx.author.id, "priority": priority, "status": "queued",
+           "run": run, "task": None, "show_status": show_status, "status_message": None, "progress": "queued",
+           "progress_updated_at": 0.0, "created_at": datetime.now(pytz.utc)}
+    jobs[job["id"]] = job
+    workers_busy = len([other for other in jobs.values()
+                        if other["pool"] == pool and other["status"] == "running"]) >= JOB_POOL_SIZES[pool]
+    job_queues[pool].put_nowait((priority, job["id"], job))
+
+    if show_status or workers_busy:
+        position = f" (position {queued_job_position(job)})" if workers_busy else ""
+        job["status_message"] = await ctx.send(
+            f"⏳ {describe_job(job)} for {ctx.author.mention} is queued{position}. "
+            f"Delete your command message or use `c.jobs cancel {job['id']}` to cancel it.")
+        if job["status"] != "queued" and not show_status:
+            await set_job_status_message(job, None)  # A worker picked it up while the notice was being sent
+    return job
+
+
+async def cancel_job(job):
+    """Cancels a queued or running job."""
+    if job["status"] == "queued":
+        # The worker skips it when it reaches the queue entry; it's dropped from the registry now so
+        # c.jobs no longer lists it
+        job["status"] = "cancelled"
+        jobs.pop(job["id"], None)
+        if job["show_status"]:
+            await set_job_status_message(job, f"🚫 {describe_job(job)} was cancelled.")
+        else:
+            await set_job_status_message(job, None)
+    elif job["status"] == "running" and job["task"]:
+        job["task"].cancel()
 
-       formatted_reset_time = f"{reset_hour_12:02}:{reset_minute:02}:{reset_second:02} {period}"
-       await ctx.send(f"The reset time for this channel is **{formatted_reset_time}** ({timezone_str}).")
 
+@bot.event
+async def on_raw_message_delete(payload):
+    """Cancels the jobs started by a deleted command message."""
+    for job in list(jobs.values()):
+        if job["message_id"] == payload.message_id:
+            await cancel_job(job)
 
-   except ValueError:
-       await ctx.send(
-           f"Error: Invalid reset time format stored for this channel ({reset_time_str}). Please contact an admin to fix it using `c.r`.")
-   except Exception as e:
-       await ctx.send(f"An unexpected error occurred: {e}")
 
+@bot.command(name="jobs")
+async def jobs_command(ctx, action: str = None, job_id: int = None):
+    """
+    Lists this server's queued and running background jobs, or cancels one with `c.jobs cancel <id>`.
+    A job can be cancelled by whoever started it or by a server admin.
+    """
+    if action is None:
+        guild_jobs = sorted((job for job in jobs.values() if job["guild_id"] == ctx.guild.id),
+                            key=lambda job: (job["status"] != "running", job["priority"], job["id"]))
+        if not guild_jobs:
+            await ctx.send("No background jobs are queued or running in this server.")
+            return
+        now = datetime.now(pytz.utc)
+        lines = []
+        for job in guild_jobs[:20]:
+            state = job["progress"] if job["status"] == "running" else f"queued, position {queued_job_position(job)}"
+            lines.append(f"**#{job['id']}** `{job['kind']}` by <@{job['author_id']}> in <#{job['channel_id']}>, "
+                         f"{(now - job['created_at']).total_seconds():.0f}s ago: {state}")
+        embed = discord.Embed(title=f"Background Jobs in {ctx.guild.name}", description="\n".join(lines),
+                              color=discord.Color.blurple())
+        embed.set_footer(text="Use c.jobs cancel <id> to cancel a job.")
+        await ctx.send(embed=embed)
+        return
 
-MAX_EMBED_FIELD_LENGTH = 1024
+    if action.lower() != "cancel" or job_id is None:
+        await ctx.send("Usage: `c.jobs` to list jobs, or `c.jobs cancel <id>` to cancel one.")
+        return
+    job = jobs.get(job_id)
+    if not job or job["guild_id"] != ctx.guild.id:
+        await ctx.send(f"There is no queued or running job #{job_id} in this server.")
+        return
+    if job["author_id"] != ctx.author.id and not await is_admin(ctx):
+        await ctx.send(f"{ctx.author.mention}, only the user who started job #{job_id} or an admin can cancel it.")
+        return
+    await cancel_job(job)
+    await ctx.send(f"Cancelled {describe_job(job)}.")
 
 
 @bot.command()
@@ -1443,67 +5025,80 @@ async def sum(ctx, *, time_range_str: str = None):
 
     If no time range is provided, it summarizes check-ins since the last daily reset.
     """
-    data = await get_channel_data(ctx.guild.id, ctx.channel.id)
-    guild_settings = await get_guild_settings(ctx.guild.id)
-    timezone_str = guild_settings.get("timezone", "America/Los_Angeles")
-    reset_hour = guild_settings.get("reset_hour", 0)
-    reset_minute = guild_settings.get("reset_minute", 0)
+    if ctx.guild is None:
+        await ctx.send("This command can only be used in a server channel.")
+        return
+    long_range = bool(time_range_str) and time_range_str.strip().lower() in SUM_WEEK_ARGUMENTS + SUM_MONTH_ARGUMENTS
+    # Rejected before queueing, so a typo doesn't spend the guild's summary tokens
+    if time_range_str and not long_range:
+        error_message = parse_sum_target_date(time_range_str.strip())[1]
+        if error_message:
+            await ctx.send(error_message)
+            return
+    priority = SUMMARY_PRIORITY_LONG_RANGE if long_range else SUMMARY_PRIORITY_INTERACTIVE
+    await submit_job(ctx, "sum", lambda job: run_sum(ctx, time_range_str), priority=priority,
+                     cost=SUMMARY_JOB_COSTS[priority])
+
 
+def parse_sum_target_date(time_range_str):
+    """Parses a `c.sum` date (MM-DD, or anything dateutil understands). Returns (date, None) or (None, error message)."""
+    # Try MM-DD or M-D
+    match_mm_dd = re.match(r'^\s*(\d{1,2})-(\d{1,2})\s*$', time_range_str)
+    if match_mm_dd:
+        try:
+            month = int(match_mm_dd.group(1))
+            day = int(match_mm_dd.group(2))
+            return datetime(datetime.now().year, month, day).date(), None
+        except ValueError:
+            return None, f"Invalid date '{time_range_str}'. Please use `MM-DD` with a valid month/day."
+    # Fallback to dateutil parser
     try:
-        guild_tz = pytz.timezone(timezone_str)
-    except pytz.exceptions.UnknownTimeZoneError:
-        guild_tz = pytz.timezone("America/Los_Angeles")
+        return parser.parse(time_range_str).date(), None
+    except Exception:
+        return None, (f"Could not understand the time range '{time_range_str}'. "
+                      f"Please use a format like `MM-DD`, `week`, or `month`.")
 
-    google_api_key = os.getenv("GOOGLE_API_KEY")
-    if not google_api_key:
-        await ctx.send("ERROR: GOOGLE_API_KEY environment variable not set. Summary command will not work.")
-        return
+
+async def run_sum(ctx, time_range_str):
+    """Body of `c.sum`, run by a summary job worker."""
+    data = ctx.channel_data
+    guild_settings = ctx.guild_settings
+    reset_hour = guild_settings.get("reset_hour", 0)
+    reset_minute = guild_settings.get("reset_minute", 0)
+    guild_tz = ctx.guild_tz
 
     if ctx.guild is None:
         await ctx.send("This command can only be used in a server channel.")
         return
+    summary_metrics_context.set((ctx.guild.id, ctx.channel.id, "sum"))
 
     await ctx.typing()
 
     start_time_utc = None
     end_time_utc = datetime.now(pytz.utc)
     display_range_str = ""
-    checkin_command_string = f"{ctx.prefix}c"
+    range_days, range_level = None, None  # Set for week/month, which are built from archived daily summaries
+    target_date_local = None
+    use_rolling_summary = False
+    rolling_state = None  # Set when the channel's rolling summary already covers this window
 
     # --- Time Range Parsing ---
     if time_range_str:
         time_range_str = time_range_str.strip()
 
-        if time_range_str.lower() in ["week", "1week", "7d", "7days"]:
-            start_time_utc = end_time_utc - timedelta(days=7)
+        if time_range_str.lower() in SUM_WEEK_ARGUMENTS:
+            range_days, range_level = SUMMARY_ARCHIVE_LEVEL_DAYS["week"], "week"
             display_range_str = "the last week"
 
-        elif time_range_str.lower() in ["month", "1month", "30d", "30days"]:
-            start_time_utc = end_time_utc - timedelta(days=30)
+        elif time_range_str.lower() in SUM_MONTH_ARGUMENTS:
+            range_days, range_level = SUMMARY_ARCHIVE_LEVEL_DAYS["month"], "month"
             display_range_str = "the last month"
 
         else:
-            # Try MM-DD or M-D
-            match_mm_dd = re.match(r'^\s*(\d{1,2})-(\d{1,2})\s*$', time_range_str)
-            if match_mm_dd:
-                try:
-                    month = int(match_mm_dd.group(1))
-                    day = int(match_mm_dd.group(2))
-                    year = datetime.now().year
-                    target_date_local = datetime(year, month, day).date()
-                except ValueError:
-                    await ctx.send(f"Invalid date '{time_range_str}'. Please use `MM-DD` with a valid month/day.")
-                    return
-            else:
-                # Fallback to dateutil parser
-                try:
-                    parsed_datetime_naive = parser.parse(time_range_str)
-                    target_date_local = parsed_datetime_naive.date()
-                except Exception:
-                    await ctx.send(
-                        f"Could not understand the time range '{time_range_str}'. Please use a format like `MM-DD`, `week`, or `month`."
-                    )
-                    return
+            target_date_local, error_message = parse_sum_target_date(time_range_str)
+            if error_message:
+                await ctx.send(error_message)
+                return
 
             # Convert to UTC range
             start_of_target_day_naive = datetime.combine(target_date_local, time.min)
@@ -1524,6 +5119,11 @@ async def sum(ctx, *, time_range_str: str = None):
         if last_reset_time_utc and isinstance(last_reset_time_utc, datetime) and last_reset_time_utc.tzinfo:
             start_time_utc = last_reset_time_utc
             display_range_str = "Since Last Reset"
+            use_rolling_summary = data.get("rolling_summary", False)
+            if use_rolling_summary:
+                state = await get_rolling_summary(ctx.guild.id, ctx.channel.id)
+                if state and state["window_start"] == start_time_utc and state["summary"]:
+                    rolling_state = state
         else:
             now_guild_tz = datetime.now(guild_tz)
             current_day_start_local = now_guild_tz.replace(hour=reset_hour, minute=reset_minute, second=0, microsecond=0)
@@ -1534,94 +5134,89 @@ async def sum(ctx, *, time_range_str: str = None):
             start_time_utc = start_of_current_day_utc
             display_range_str = "Today (Start of Day, based on reset time)"
 
-    # --- Build Gemini Prompt ---
-    content_for_gemini_prompt = [
-        f"Provide a concise summary of the following daily check-ins from Discord users. "
-        f"Start with an 'Overall Summary' (1-3 bullet points on key themes). "
-        f"Then, add a section titled 'Individual Contributions'. "
-        f"For each user, provide a concise summary of their specific check-in, detailing their main activity/update. "
-        f"[... instructions truncated for brevity ...]\n"
-        f"Here are the check-ins:\n"
-    ]
+    # Window and normalized range used to cache and deduplicate identical requests
+    today_local = datetime.now(guild_tz).date()
+    if range_days:
+        fingerprint_start_utc, fingerprint_end_utc = day_bounds_utc(today_local - timedelta(days=range_days), guild_tz)[0], end_time_utc
+        cache_range = f"{range_level}:{today_local.isoformat()}"
+    elif target_date_local:
+        fingerprint_start_utc, fingerprint_end_utc = start_time_utc, end_time_utc
+        cache_range = f"day:{target_date_local.isoformat()}"
+    else:
+        fingerprint_start_utc, fingerprint_end_utc = start_time_utc, end_time_utc
+        cache_range = f"since:{start_time_utc.isoformat()}"
+
+    reply = await start_summary_reply(ctx, f"Check-in Summary for {display_range_str} in #{ctx.channel.name}",
+                                      discord.Color.purple())
+
+    def on_text(text):
+        update_summary_reply(reply, text)
+
+    async def compute_summary():
+        """Computes (summary_text, timings) for the parsed range; summary_text is "" without check-ins."""
+        if range_days:
+            return await summarize_days_hierarchically(ctx.guild.id, ctx.channel, guild_tz, range_days, range_level,
+                                                       on_text)
+        if target_date_local and target_date_local < today_local:
+            # Completed days are summarized once and served from the archive afterwards
+            return await get_or_create_daily_summary(ctx.guild.id, ctx.channel, guild_tz, target_date_local, on_text)
+
+        stored_checkins = await fetch_stored_checkins(ctx.guild.id, ctx.channel.id, start_time_utc, end_time_utc)
+        if stored_checkins is None:
+            raise RuntimeError("could not load check-ins from the database")
+        checkin_entries = await build_sum_checkin_entries(ctx.channel, stored_checkins)
+        if not checkin_entries:
+            return "", new_summary_timings()
+        summary_text, timings = await summarize_map_reduce(SUM_PROMPT_HEADER, checkin_entries, on_text)
+        if use_rolling_summary:
+            # Seed the rolling state with the summary just computed
+            await save_rolling_summary(ctx.guild.id, ctx.channel.id, {
+                "window_start": start_time_utc, "summary": summary_text,
+                "last_message_at": stored_checkins[-1]["created_at"],
+                "checkin_count": len(stored_checkins), "updated_at": datetime.now(pytz.utc)})
+        return summary_text, timings
 
     try:
-        async for message in ctx.channel.history(after=start_time_utc, before=end_time_utc, limit=500):
-            if not message.author.bot and (message.content or message.attachments):
-                cleaned_content = message.content.strip()
-                if cleaned_content.lower().startswith(checkin_command_string.lower()):
-                    actual_checkin_content = cleaned_content[len(checkin_command_string):].strip()
-
-                    if not actual_checkin_content and message.attachments:
-                        has_image_for_gemini = False
-                        for attachment in message.attachments:
-                            if 'image' in attachment.content_type:
-                                try:
-                                    image_bytes = await attachment.read()
-                                    pil_image = Image.open(BytesIO(image_bytes))
-                                    content_for_gemini_prompt.append(
-                                        f"\n--- Check-in by {message.author.display_name} ({message.created_at.strftime('%H:%M')}):\n"
-                                        f"[No text provided in check-in message. Summarize based on image.]"
-                                    )
-                                    content_for_gemini_prompt.append(pil_image)
-                                    has_image_for_gemini = True
-                                    break
-                                except Exception:
-                                    content_for_gemini_prompt.append(
-                                        f"[Error loading image for image-only check-in: {attachment.filename}]")
-                        if not has_image_for_gemini:
-                            content_for_gemini_prompt.append(
-                                f"\n--- Check-in by {message.author.display_name} ({message.created_at.strftime('%H:%M')}):\n"
-                                f"[No text or valid image provided in check-in message, skipping.]"
-                            )
-                    elif actual_checkin_content:
-                        content_for_gemini_prompt.append(
-                            f"\n--- Check-in by {message.author.display_name} ({message.created_at.strftime('%H:%M')}):\n"
-                            f"{actual_checkin_content}"
-                        )
-                        has_image_for_gemini = False
-                        if message.attachments:
-                            for attachment in message.attachments:
-                                if 'image' in attachment.content_type:
-                                    try:
-                                        image_bytes = await attachment.read()
-                                        pil_image = Image.open(BytesIO(image_bytes))
-                                        content_for_gemini_prompt.append(pil_image)
-                                        has_image_for_gemini = True
-                                        break
-                                    except Exception:
-                                        content_for_gemini_prompt.append(
-                                            f"[Error loading image: {attachment.filename}]")
-                        if not has_image_for_gemini:
-                            content_for_gemini_prompt.append("[No image provided with check-in.]")
-    except discord.errors.Forbidden:
-        await ctx.send("I don't have permission to read message history in this channel.")
-        return
-    except discord.errors.HTTPException as e:
-        await ctx.send(f"An error occurred while fetching messages: {e}")
-        return
-
-    if len(content_for_gemini_prompt) == 1:
-        await ctx.send(
-            f"No check-in messages (text or image) found for **{display_range_str}** in this channel to summarize.")
-        return
+        from_cache, fallback_reason = False, None
+        if rolling_state:
+            # Served straight from the background-maintained state; newer check-ins are folded in after replying
+            summary_text, timings = rolling_state["summary"], new_summary_timings()
+            fold_task = asyncio.create_task(fold_rolling_summary_in_background(ctx.guild.id, ctx.channel, start_time_utc))
+            background_summary_tasks.add(fold_task)
+            fold_task.add_done_callback(background_summary_tasks.discard)
+        else:
+            fingerprint = await load_checkin_fingerprint(ctx.guild.id, ctx.channel.id,
+                                                         fingerprint_start_utc, fingerprint_end_utc)
+            ((summary_text, timings), from_cache), fallback_reason = await run_with_fallback(
+                lambda: run_single_flight(("sum", ctx.guild.id, ctx.channel.id, cache_range), fingerprint, compute_summary),
+                lambda: fallback_summary_for_window(ctx.guild.id, ctx.channel.id,
+                                                    fingerprint_start_utc, fingerprint_end_utc))
+
+        if not summary_text:
+            await abort_summary_reply(reply)
+            await ctx.send(
+                f"No check-in messages (text or image) found for **{display_range_str}** in this channel to summarize.")
+            return
 
-    try:
-        genai.configure(api_key=google_api_key)
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        response = model.generate_content(content_for_gemini_prompt)
-        summary_text = response.text.strip()
-        if len(summary_text) > MAX_EMBED_FIELD_LENGTH:
-            summary_text = summary_text[:MAX_EMBED_FIELD_LENGTH - 3] + "..."
-
-        embed = discord.Embed(
-            title=f"Check-in Summary for {display_range_str} in #{ctx.channel.name}",
-            description=summary_text,
-            color=discord.Color.purple()
-        )
-        embed.set_footer(
-            text=f"Summary generated by Google Gemini on {datetime.now(pytz.utc).strftime('%Y-%m-%d %H:%M:%S UTC')}")
-        await ctx.send(embed=embed)
+        if rolling_state:
+            footer = (f"Rolling summary of {rolling_state['checkin_count']} check-in(s), updated by Google Gemini on "
+                      f"{rolling_state['updated_at'].astimezone(pytz.utc).strftime('%Y-%m-%d %H:%M:%S UTC')}")
+        elif fallback_reason:
+            footer = f"Extractive summary of the check-ins' own sentences ({fallback_reason})"
+        elif from_cache:
+            footer = "Summary generated by Google Gemini (cached, no new check-ins since)"
+        else:
+            footer = (f"Summary generated by Google Gemini on {datetime.now(pytz.utc).strftime('%Y-%m-%d %H:%M:%S UTC')} "
+                      f"(queued {timings['queue_wait']:.1f}s, model {timings['model_latency']:.1f}s)")
+        await finish_summary_reply(reply, summary_text, footer)
+    except asyncio.CancelledError:
+        await abort_summary_reply(reply)  # The command message was deleted
+        raise
+    except asyncio.TimeoutError:
+        await abort_summary_reply(reply)
+        await ctx.send(f"The Google Gemini API did not respond within {GEMINI_TIMEOUT_SECONDS:.0f} seconds. Please try again later.")
     except Exception as e:
+        await abort_summary_reply(reply)
         await ctx.send(f"An error occurred with the Google Gemini API: {e}")
 
 
@@ -1635,19 +5230,19 @@ async def topic(ctx, *, topic_query: str):
     `c.topic bot development`
     `c.topic "new features"`
     """
-    data = await get_channel_data(ctx.guild.id, ctx.channel.id)
+    if ctx.guild is None:
+        await ctx.send("This command can only be used in a server channel.")
+        return
+    if not topic_query.strip():
+        await ctx.send("Please provide a topic to summarize. Example: `c.topic project updates`")
+        return
+    await submit_job(ctx, "topic", lambda job: run_topic(ctx, topic_query), priority=SUMMARY_PRIORITY_INTERACTIVE,
+                     cost=SUMMARY_JOB_COSTS[SUMMARY_PRIORITY_INTERACTIVE])
 
-    guild_settings = await get_guild_settings(ctx.guild.id)
-    timezone_str = guild_settings.get("timezone", "America/Los_Angeles")
-    try:
-        guild_tz = pytz.timezone(timezone_str)
-    except pytz.exceptions.UnknownTimeZoneError:
-        guild_tz = pytz.timezone("America/Los_Angeles")
 
-    google_api_key = os.getenv("GOOGLE_API_KEY")
-    if not google_api_key:
-        await ctx.send("ERROR: GOOGLE_API_KEY environment variable not set. Topic command will not work.")
-        return
+async def run_topic(ctx, topic_query):
+    """Body of `c.topic`, run by a summary job worker."""
+    data = ctx.channel_data
 
     if ctx.guild is None:
         await ctx.send("This command can only be used in a server channel.")
@@ -1656,6 +5251,7 @@ async def topic(ctx, *, topic_query: str):
     if not topic_query:
         await ctx.send("Please provide a topic to summarize. Example: `c.topic project updates`")
         return
+    summary_metrics_context.set((ctx.guild.id, ctx.channel.id, "topic"))
 
     await ctx.typing()
 
@@ -1667,7 +5263,6 @@ async def topic(ctx, *, topic_query: str):
         print(f"DEBUG: No last_reset_time found for topic command, defaulting to 7 days ago: {start_time_utc}")
 
     end_time_utc = datetime.now(pytz.utc)
-    checkin_command_string = f"{ctx.prefix}c"
 
     # --- Initial prompt without detailed image instructions ---
     initial_gemini_prompt_base = [
@@ -1690,98 +5285,89 @@ async def topic(ctx, *, topic_query: str):
         f"5.  **Image Only Check-in & Topic:** If a check-in consists *only* of an image with no text, and the image itself clearly relates to '{topic_query}', summarize the content of the image as the user's check-in. State '✅ [Detailed description of image content as the check-in, clearly related to the topic. This was an image-only check-in.]'. If the image is not clearly related to the topic, ignore this check-in.\n"
     )
 
-    content_for_gemini_messages = []
-    has_checkin_messages_to_process = False  # Flag to indicate if any check-in messages were found
+    cache_key = ("topic", ctx.guild.id, ctx.channel.id, " ".join(topic_query.lower().split()), start_time_utc.isoformat())
+
+    async def compute_topic_summary():
+        """Builds the topic prompt from the stored check-ins and summarizes it. Returns None without check-ins."""
+        topic_checkin_entries = []  # One list of prompt parts per check-in
+        has_checkin_messages_to_process = False  # Flag to indicate if any check-in messages were found
+
+        stored_checkins = await fetch_stored_checkins(ctx.guild.id, ctx.channel.id, start_time_utc, end_time_utc)
+        if stored_checkins is None:
+            raise RuntimeError("could not load check-ins from the database")
+
+        # Only check-ins whose text matches the topic (plus image-only ones, which only the model can judge) are sent
+        search_index = await get_checkin_index(ctx.guild.id, ctx.channel.id, start_time_utc)
+        window_has_checkins = bool(stored_checkins)
+        if search_index is not None:
+            ranked = rank_checkins_bm25(search_index, topic_query,
+                                        [checkin["message_id"] for checkin in stored_checkins if checkin["content"]])
+            candidate_ids = {message_id for _, message_id in ranked[:TOPIC_MAX_CANDIDATES]}
+            print(f"DEBUG: Topic prefilter kept {len(candidate_ids)} of {len(stored_checkins)} check-in(s) for '{topic_query}'.")
+            stored_checkins = [checkin for checkin in stored_checkins
+                               if checkin["message_id"] in candidate_ids or not checkin["content"]]
+        checkin_images = await load_checkin_images(ctx.channel, stored_checkins)
+
+        for checkin in stored_checkins:
+            if not checkin["content"] and not checkin["attachments"]:
+                continue
 
-    try:
-        async for message in ctx.channel.history(after=start_time_utc, before=end_time_utc, limit=500):
-            if not message.author.bot and (message.content or message.attachments):
-                cleaned_content = message.content.strip()
-                if cleaned_content.lower().startswith(checkin_command_string.lower()):
-                    actual_checkin_content = cleaned_content[len(checkin_command_string):].strip()
-
-                    checkin_entry_parts = [
-                        f"\n--- Check-in by {message.author.display_name} ({message.created_at.strftime('%H:%M')}):\n"
-                    ]
-                    if actual_checkin_content:
-                        checkin_entry_parts.append(actual_checkin_content)
-                    else:
-                        checkin_entry_parts.append("[No text provided in check-in message.]")
-
-                    found_image_for_checkin = False
-                    if message.attachments:
-                        for attachment in message.attachments:
-                            if 'image' in attachment.content_type:
-                                try:
-                                    image_bytes = await attachment.read()
-                                    pil_image = Image.open(BytesIO(image_bytes))
-                                    checkin_entry_parts.append(pil_image)
-                                    found_image_for_checkin = True
-                                    print(
-                                        f"DEBUG: Found and prepared image for {message.author.display_name}'s check-in (topic).")
-                                    break
-                                except Exception as e:
-                                    checkin_entry_parts.append(f"[Error loading image: {attachment.filename}]")
-                                    print(
-                                        f"ERROR: Could not load image for Gemini for {message.author.display_name}'s check-in ({attachment.filename}): {e}")
-
-                    if not found_image_for_checkin:
-                        checkin_entry_parts.append("[No image provided with check-in.]")
-
-                    content_for_gemini_messages.extend(checkin_entry_parts)
-                    has_checkin_messages_to_process = True  # At least one check-in command was found
-
-    except discord.errors.Forbidden:
-        await ctx.send("I don't have permission to read message history in this channel.")
-        return
-    except discord.errors.HTTPException as e:
-        await ctx.send(f"An error occurred while fetching messages: {e}")
-        return
+            checkin_entry_parts = [
+                f"\n--- Check-in by {checkin['author_name']} ({checkin['created_at'].strftime('%H:%M')}):\n",
+                checkin["content"] or "[No text provided in check-in message.]"
+            ]
 
-    if not has_checkin_messages_to_process:
-        await ctx.send(
-            f"No check-in messages (text or image) found in the last 7 days for summarization in this channel.")
-        return
+            image_part, failed_filenames = checkin_images.get(checkin["message_id"], (None, []))
+            for filename in failed_filenames:
+                checkin_entry_parts.append(f"[Error loading image: {filename}]")
+            checkin_entry_parts.append(image_part if image_part else "[No image provided with check-in.]")
 
-    # Construct the final prompt based on whether check-in messages were found
-    final_gemini_prompt_content = []
-
-    # Always start with the base prompt.
-    final_gemini_prompt_content.extend(initial_gemini_prompt_base)
-
-    # Conditionally inject detailed image instructions IF check-in messages were found.
-    if has_checkin_messages_to_process:
-        # Find the placeholder for simplified image analysis in the base prompt
-        # and replace it with the detailed instructions.
-        found_placeholder_for_image_inst = False
-        for i, item in enumerate(final_gemini_prompt_content):
-            if isinstance(item, str) and "Image Analysis (Simplified for initial filter):" in item:
-                final_gemini_prompt_content[i] = detailed_image_instructions
-                found_placeholder_for_image_inst = True
-                break
-        # Fallback in case the exact placeholder string changes in initial_gemini_prompt_base
-        if not found_placeholder_for_image_inst:
-            final_gemini_prompt_content.insert(len(initial_gemini_prompt_base) - 1, detailed_image_instructions)
+            topic_checkin_entries.append(checkin_entry_parts)
+            has_checkin_messages_to_process = True  # At least one check-in was found
 
-    # Add the collected check-in messages (text and images) to the final prompt.
-    final_gemini_prompt_content.extend(content_for_gemini_messages)
+        if not has_checkin_messages_to_process:
+            # Check-ins exist but none matched the topic: an empty summary reports "nothing related" without a model call
+            return ("", new_summary_timings()) if window_has_checkins else None
 
-    try:
-        genai.configure(api_key=google_api_key)
-        model = genai.GenerativeModel('gemini-1.5-flash')
+        # Construct the final prompt based on whether check-in messages were found
+        final_gemini_prompt_content = []
+
+        # Always start with the base prompt.
+        final_gemini_prompt_content.extend(initial_gemini_prompt_base)
+
+        # Conditionally inject detailed image instructions IF check-in messages were found.
+        if has_checkin_messages_to_process:
+            # Find the placeholder for simplified image analysis in the base prompt
+            # and replace it with the detailed instructions.
+            found_placeholder_for_image_inst = False
+            for i, item in enumerate(final_gemini_prompt_content):
+                if isinstance(item, str) and "Image Analysis (Simplified for initial filter):" in item:
+                    final_gemini_prompt_content[i] = detailed_image_instructions
+                    found_placeholder_for_image_inst = True
+                    break
+            # Fallback in case the exact placeholder string changes in initial_gemini_prompt_base
+            if not found_placeholder_for_image_inst:
+                final_gemini_prompt_content.insert(len(initial_gemini_prompt_base) - 1, detailed_image_instructions)
 
-        # Function to call Gemini's generate_content in a separate thread
-        def _call_gemini_generate_content(prompt_content):
-            return model.generate_content(prompt_content)
+        # The collected check-ins (text and images) are batched behind the instructions
+        return await summarize_map_reduce(final_gemini_prompt_content, topic_checkin_entries, on_text)
 
-        # Execute the Gemini API call in a separate thread to prevent blocking the Discord event loop
-        response = await asyncio.to_thread(_call_gemini_generate_content, final_gemini_prompt_content)
+    reply = await start_summary_reply(ctx, f"Topic Summary: '{topic_query}' in #{ctx.channel.name}", discord.Color.green())
 
-        summary_text = response.text.strip()
+    def on_text(text):
+        update_summary_reply(reply, text)
 
-        if len(summary_text) > MAX_EMBED_FIELD_LENGTH:
-            summary_text = summary_text[:MAX_EMBED_FIELD_LENGTH - 3] + "..."
-            print(f"WARNING: Gemini topic summary truncated to {MAX_EMBED_FIELD_LENGTH} characters.")
+    try:
+        fingerprint = await load_checkin_fingerprint(ctx.guild.id, ctx.channel.id, start_time_utc, end_time_utc)
+        (result, from_cache), fallback_reason = await run_with_fallback(
+            lambda: run_single_flight(cache_key, fingerprint, compute_topic_summary),
+            lambda: fallback_summary_for_window(ctx.guild.id, ctx.channel.id, start_time_utc, end_time_utc, topic_query))
+        if result is None:
+            await abort_summary_reply(reply)
+            await ctx.send(
+                f"No check-in messages (text or image) found in the last 7 days for summarization in this channel.")
+            return
+        summary_text, timings = result
 
         # Check if Gemini indicates no relevant check-ins
         if "no check-ins directly related to" in summary_text.lower() or \
@@ -1789,19 +5375,27 @@ async def topic(ctx, *, topic_query: str):
                 len(summary_text) < 50:  # Arbitrary length for "too short" to indicate no content
             summary_text = f"No check-ins directly related to '{topic_query}' were found or summarized in this channel."
 
-        embed = discord.Embed(
-            title=f"Topic Summary: '{topic_query}' in #{ctx.channel.name}",
-            description=summary_text,
-            color=discord.Color.green()
-        )
-        embed.set_footer(
-            text=f"Summary generated by Google Gemini on {datetime.now(pytz.utc).strftime('%Y-%m-%d %H:%M:%S UTC')}")
-
-        await ctx.send(embed=embed)
+        if fallback_reason:
+            footer = f"Extractive summary of the check-ins' own sentences ({fallback_reason})"
+        elif from_cache:
+            footer = "Summary generated by Google Gemini (cached, no new check-ins since)"
+        else:
+            footer = (f"Summary generated by Google Gemini on {datetime.now(pytz.utc).strftime('%Y-%m-%d %H:%M:%S UTC')} "
+                      f"(queued {timings['queue_wait']:.1f}s, model {timings['model_latency']:.1f}s)")
+        await finish_summary_reply(reply, summary_text, footer)
         print(
             f"INFO: Successfully generated and sent topic summary for channel {ctx.channel.id} on topic '{topic_query}' using Google Gemini (multimodal).")
 
+    except asyncio.CancelledError:
+        await abort_summary_reply(reply)  # The command message was deleted
+        raise
+    except asyncio.TimeoutError:
+        await abort_summary_reply(reply)
+        await ctx.send(f"The Google Gemini API did not respond within {GEMINI_TIMEOUT_SECONDS:.0f} seconds "
+                       f"while summarizing for topic '{topic_query}'. Please try again later.")
+        print(f"ERROR: Google Gemini API timed out (topic command) in channel {ctx.channel.id}.")
     except Exception as e:
+        await abort_summary_reply(reply)
         await ctx.send(f"An error occurred with the Google Gemini API while summarizing for topic '{topic_query}': {e}")
         print(f"ERROR: Google Gemini API Error (multimodal, topic command): {e}")
 
@@ -1966,6 +5560,48 @@ async def resetTime():
                pass
 
 
+@tasks.loop(minutes=ROLLING_SUMMARY_INTERVAL_MINUTES)
+async def rollingSummaryUpdate():
+    """
+    Folds new check-ins into the rolling summary of every cached channel that has the mode enabled,
+    covering the window since the channel's last reset.
+    """
+    if not os.getenv("GOOGLE_API_KEY"):
+        return
+
+    for guild_id, guild_data_entry in list(guild_channel_data_cache.items()):
+        for channel_id, channel_data in list(guild_data_entry.items()):
+            if channel_id == 0 or not channel_data.get("rolling_summary"):
+                continue
+            window_start = channel_data.get("last_reset_time")
+            if not isinstance(window_start, datetime) or not window_start.tzinfo:
+                continue
+            channel = bot.get_channel(channel_id)
+            if channel:
+                await fold_rolling_summary_in_background(guild_id, channel, window_start)
+
+
+@tasks.loop(minutes=IMAGE_DESCRIPTION_INTERVAL_MINUTES)
+async def describeCheckinImages():
+    """
+    Asks the model for a short description of images that were recently sent in summaries, so later
+    summaries of the same window can send the text instead of the image.
+    """
+    if not pending_image_descriptions or not os.getenv("GOOGLE_API_KEY"):
+        return
+
+    for attachment_id in list(pending_image_descriptions)[:IMAGE_DESCRIPTION_BATCH_SIZE]:
+        guild_id, image_hash, image_part = pending_image_descriptions.pop(attachment_id)
+        summary_metrics_context.set((guild_id, 0, "describe"))
+        try:
+            description, _ = await generate_with_gemini([IMAGE_DESCRIPTION_PROMPT, image_part])
+        except Exception as e:
+            print(f"ERROR: Could not describe image attachment {attachment_id}: {e}")
+            continue
+        if description:
+            await save_image_description(guild_id, attachment_id, image_hash, " ".join(description.split()))
+
+
 # async def _perform_channel_reset(guild_id, channel_id, channel_data, now_guild_tz, formatted_date):
 #     """
 #     Performs the reset for a channel: calculates and posts leaderboards, resets daily check-in lists,
@@ -2266,6 +5902,22 @@ async def _perform_channel_reset(guild_id, channel_id, channel_data, now_guild_t
                 # Never checked in → do nothing, continues "Never checked in"
                 pass
 
+    # Record this period in the attendance bitmaps (drives c.streak)
+    await update_attendance_bitmaps(guild_id, channel_id, now_guild_tz.date(), checked_users, unchecked_users)
+    await save_daily_snapshot(guild_id, channel_id, now_guild_tz.date(), checked_users, unchecked_users,
+                              channel_data["last_reset_time"])
+    await update_checkin_rollups(guild_id, channel_id, now_guild_tz.date())
+    invalidate_heatmap_cache(guild_id, channel_id)
+
+    # Archive yesterday's summary (now a complete calendar day) so week/month summaries only merge stored text
+    summary_channel = bot.get_channel(channel_id)
+    if summary_channel and os.getenv("GOOGLE_API_KEY"):
+        guild_tz = get_guild_tz(guild_channel_data_cache.get(guild_id, {}).get(0, {}))
+        archive_task = asyncio.create_task(archive_daily_summary_in_background(
+            guild_id, summary_channel, guild_tz, now_guild_tz.date() - timedelta(days=1)))
+        background_summary_tasks.add(archive_task)
+        archive_task.add_done_callback(background_summary_tasks.discard)
+
     # Persist updated fields
     channel_data["days_since_last"] = days_since
     channel_data["last_checkins"] = last_checkins
@@ -2375,6 +6027,13 @@ async def on_ready():
        print("INFO: resetTime task started.")
    else:
        print("INFO: resetTime task already running.")
+   if not rollingSummaryUpdate.is_running():
+       rollingSummaryUpdate.start()
+       print("INFO: rollingSummaryUpdate task started.")
+   await resume_backfills()
+   if not describeCheckinImages.is_running():
+       describeCheckinImages.start()
+       print("INFO: describeCheckinImages task started.")
    print("INFO: Bot is ready and running!")
 
 